@@ -0,0 +1,171 @@
+"""
+Benchmarks against a real PostgreSQL, for what the fake server in run.py
+can't show, such as how the server's own work compares to round trips.
+
+    python benchmarks/postgres.py --host /var/run/postgresql
+
+They create and drop their own tables in the database they are given.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(_HERE), "src"))
+sys.path.insert(0, _HERE)
+
+from twisted.internet import defer, task  # noqa: E402
+
+from run import _best, _report  # noqa: E402
+from sansiopg.protocol import PostgresConnection  # noqa: E402
+from sansiopg.statements import StatementRegistry  # noqa: E402
+from txpg.protocol import TwistedIOImplementation  # noqa: E402
+
+_BENCHMARKS = []
+
+
+def benchmark(func):
+    _BENCHMARKS.append(func)
+    return func
+
+
+async def _connect(options, **kwargs):
+    conn = PostgresConnection(TwistedIOImplementation(), **kwargs)
+    await conn.connect(options.host, options.database, options.user, options.password)
+    return conn
+
+
+_UPSERT = (
+    "INSERT INTO _bench_upsert VALUES ($1, $2, $3, $4, $5) ON CONFLICT (id)"
+    " DO UPDATE SET name = EXCLUDED.name, score = EXCLUDED.score,"
+    " tags = EXCLUDED.tags, flag = EXCLUDED.flag"
+)
+
+
+@benchmark
+async def upsert(options):
+    """
+    Upserting rows of (int, text, float8, int[], bool) into an empty table
+    with L{PostgresConnection.bulk_upsert}, with one pipelined INSERT ... ON
+    CONFLICT per row, and with one awaited per row. The last is only run for
+    a twentieth of the rows.
+    """
+    conn = await _connect(options)
+    await conn.script(
+        "DROP TABLE IF EXISTS _bench_upsert;"
+        " CREATE TABLE _bench_upsert"
+        " (id int PRIMARY KEY, name text, score float8, tags int[], flag bool)"
+    )
+    rows = [
+        (i, "name-%d" % (i,), i / 3, [i, i + 1], i % 2 == 0)
+        for i in range(options.rows)
+    ]
+
+    try:
+        start = time.perf_counter()
+        await conn.bulk_upsert("_bench_upsert", rows, ["id"])
+        bulk = time.perf_counter() - start
+        await conn.execute("TRUNCATE _bench_upsert")
+
+        start = time.perf_counter()
+        async with conn.new_pipelined_transaction() as transaction:
+            for row in rows:
+                transaction.execute(_UPSERT, list(row))
+        pipelined = time.perf_counter() - start
+        await conn.execute("TRUNCATE _bench_upsert")
+
+        awaited_rows = rows[: max(1, len(rows) // 20)]
+        start = time.perf_counter()
+        for row in awaited_rows:
+            await conn.execute(_UPSERT, list(row))
+        awaited = (time.perf_counter() - start) * len(rows) / len(awaited_rows)
+    finally:
+        await conn.execute("DROP TABLE _bench_upsert")
+        conn._pg.transport.loseConnection()
+
+    return {
+        "bulk_upsert_s": bulk,
+        "pipelined_s": pipelined,
+        "awaited_s": awaited,
+    }
+
+
+_LOOKUP = "SELECT id, name, score FROM _bench_lookup WHERE id = $1"
+
+
+@benchmark
+async def lookup(options):
+    """
+    Looking up one row by primary key, awaited one at a time, as an unnamed
+    statement parsed every time, and as a named one bound by a
+    L{StatementRegistry}. Mean latency per lookup, for a twentieth of the
+    rows.
+    """
+    conn = await _connect(options)
+    await conn.script(
+        "DROP TABLE IF EXISTS _bench_lookup;"
+        " CREATE TABLE _bench_lookup (id int PRIMARY KEY, name text, score float8);"
+        " INSERT INTO _bench_lookup"
+        " SELECT i, 'name-' || i, i / 3.0 FROM generate_series(0, %d) i"
+        % (options.rows,)
+    )
+    ids = range(0, options.rows, 20)
+
+    async def _lookups():
+        start = time.perf_counter()
+        for i in ids:
+            await conn.query(_LOOKUP, [i])
+        return (time.perf_counter() - start) / len(ids) * 1e6
+
+    try:
+        unnamed = await _lookups()
+        conn.registry = StatementRegistry(threshold=1)
+        named = await _lookups()
+    finally:
+        conn.registry = None
+        await conn.execute("DROP TABLE _bench_lookup")
+        conn._pg.transport.loseConnection()
+
+    return {
+        "unnamed_latency_us": unnamed,
+        "named_latency_us": named,
+    }
+
+
+async def _run_all(options):
+    for func in _BENCHMARKS:
+        name = func.__name__
+        if options.only and name not in options.only:
+            continue
+
+        samples = []
+        for _ in range(options.repeat):
+            samples.append(await func(options))
+
+        _report(name, _best(samples), None)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--host",
+        default=os.environ.get("PGHOST", "/var/run/postgresql"),
+        help="a host, host:port, or UNIX socket directory",
+    )
+    parser.add_argument("--database", default=os.environ.get("PGDATABASE", "postgres"))
+    parser.add_argument("--user", default=os.environ.get("PGUSER", "postgres"))
+    parser.add_argument("--password", default=os.environ.get("PGPASSWORD"))
+    parser.add_argument(
+        "--only", type=lambda s: s.split(","), help="comma-separated benchmarks"
+    )
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--rows", type=int, default=100000)
+    options = parser.parse_args(argv)
+
+    task.react(lambda reactor: defer.ensureDeferred(_run_all(options)))
+
+
+if __name__ == "__main__":
+    main()
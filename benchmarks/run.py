@@ -0,0 +1,796 @@
+"""
+Benchmarks for sansiopg and txpg, run against the fake server in
+L{txpg.test.fakeserver} so that no PostgreSQL is needed.
+
+    python benchmarks/run.py -o before.json
+    python benchmarks/run.py -o after.json --compare before.json
+
+Each benchmark reports one or more rates (higher is better) or latencies
+(lower is better); the JSON output records them along with the commit they
+were measured at.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(_HERE), "src"))
+
+from twisted.internet import defer, task  # noqa: E402
+from twisted.internet.endpoints import (  # noqa: E402
+    TCP4ClientEndpoint,
+    TCP4ServerEndpoint,
+    UNIXClientEndpoint,
+    UNIXServerEndpoint,
+)
+
+from sansiopg.arrays import encode_binary_array  # noqa: E402
+from sansiopg.bulk import COLUMNS_QUERY  # noqa: E402
+from sansiopg.conversion import Converter  # noqa: E402
+from sansiopg.instrumentation import Instrumentation, StatementStats  # noqa: E402
+from sansiopg.messages import (  # noqa: E402
+    Bind,
+    BindParam,
+    Execute,
+    IndividualRow,
+    Parse,
+    Sync,
+    parse_from_buffer,
+)
+from sansiopg.parser import ParserFeed  # noqa: E402
+from sansiopg.protocol import PostgresConnection  # noqa: E402
+from sansiopg.statements import StatementRegistry  # noqa: E402
+from sansiopg.trace import read_trace, replay_connection, replay_parser  # noqa
+from txpg.protocol import TwistedIOImplementation  # noqa: E402
+from txpg.test import fakeserver  # noqa: E402
+
+_BENCHMARKS = []
+
+
+def benchmark(func):
+    _BENCHMARKS.append(func)
+    return func
+
+
+def _scaled(n, options):
+    return max(1, int(n * options.scale))
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+_SMALL = fakeserver.Result.of(["a", "b"], [(1, "x")], oid=23)
+_SMALL.columns[1] = ("b", 25)
+
+
+def _results(options):
+    rows = _scaled(100000, options)
+    wide_rows = _scaled(2000, options)
+
+    large = fakeserver.Result.of(
+        ["id", "name", "flag"],
+        [(i, "name-%d" % (i,), "t") for i in range(rows)],
+    )
+    large.columns = [("id", 23), ("name", 25), ("flag", 16)]
+
+    wide = fakeserver.Result.of(
+        ["c%d" % (i,) for i in range(200)],
+        [tuple("v%d" % (i,) for i in range(200)) for _ in range(wide_rows)],
+    )
+
+    return {
+        "SELECT 1": _SMALL,
+        "SELECT $1": _SMALL,
+        "SELECT large": large,
+        "SELECT wide": wide,
+        "large": large,
+        COLUMNS_QUERY: fakeserver.Result(
+            columns=[("name", 25), ("columns", 1009), ("types", 1028)],
+            # The arrays are asked for in binary.
+            rows=[
+                (
+                    b"large",
+                    encode_binary_array([b"id", b"name", b"flag"], 25, bytes),
+                    encode_binary_array([23, 25, 16], 26, None),
+                )
+            ],
+        ),
+    }
+
+
+class _Target(object):
+    """
+    Where the connections under test connect to.
+    """
+
+    def __init__(self, reactor, options):
+        self.reactor = reactor
+        self.options = options
+        results = _results(options)
+        self.backend_factory = lambda: fakeserver.FakeBackend(results=results)
+        self.results = results
+        self._directory = tempfile.mkdtemp()
+        self._ports = {}
+
+    async def start(self):
+        if self.options.transport != "memory":
+            await self.listen(self.options.transport)
+
+    async def listen(self, transport):
+        """
+        Start the fake server listening over C{transport}, if it isn't yet.
+        """
+        if transport in self._ports:
+            return
+        elif transport == "tcp":
+            server = TCP4ServerEndpoint(self.reactor, 0, interface="127.0.0.1")
+        else:
+            path = os.path.join(self._directory, ".s.PGSQL.5432")
+            server = UNIXServerEndpoint(self.reactor, path)
+
+        self._ports[transport] = await server.listen(
+            fakeserver.FakeServerFactory(self.backend_factory)
+        )
+
+    def endpoint(self, transport=None):
+        transport = transport or self.options.transport
+
+        if transport == "memory":
+            return fakeserver.MemoryEndpoint(self.reactor, self.backend_factory)
+        elif transport == "tcp":
+            port = self._ports["tcp"].getHost().port
+            return TCP4ClientEndpoint(self.reactor, "127.0.0.1", port)
+        return UNIXClientEndpoint(self.reactor, self._ports["unix"].getHost().name)
+
+    async def connect(self, io_impl=None, transport=None, **kwargs):
+        conn = PostgresConnection(io_impl or TwistedIOImplementation(), **kwargs)
+        await conn.connect(self.endpoint(transport), "bench", "bench")
+        return conn
+
+    async def stop(self):
+        for port in self._ports.values():
+            await port.stopListening()
+        os.rmdir(self._directory)
+
+
+@benchmark
+def parser_data_rows(options):
+    """
+    ParserFeed on a stream of DataRows, fed in 64KiB chunks.
+    """
+    count = _scaled(200000, options)
+    row = fakeserver.data_row((b"12345", b"some text value", b"t"))
+    stream = row * count
+    chunks = [stream[i : i + 65536] for i in range(0, len(stream), 65536)]
+
+    def run():
+        feed = ParserFeed("utf8")
+        for chunk in chunks:
+            feed.feed(chunk)
+
+    elapsed = _timed(run)
+    return {
+        "messages_per_sec": count / elapsed,
+        "mb_per_sec": len(stream) / elapsed / 1e6,
+    }
+
+
+@benchmark
+def parser_large_value(options):
+    """
+    ParserFeed on one DataRow with a 64MiB value, fed in 64KiB chunks, both
+    buffered whole and streamed.
+    """
+    row = fakeserver.data_row((b"v" * _scaled(64 * 1024 * 1024, options),))
+    chunks = [row[i : i + 65536] for i in range(0, len(row), 65536)]
+
+    def run(stream_threshold):
+        feed = ParserFeed("utf8", stream_threshold)
+        for chunk in chunks:
+            feed.feed(chunk)
+
+    return {
+        "buffered_mb_per_sec": len(row) / _timed(run, None) / 1e6,
+        "streamed_mb_per_sec": len(row) / _timed(run, 65536) / 1e6,
+    }
+
+
+@benchmark
+def decode_text_columns(options):
+    """
+    Converting rows of ten text columns to Python, without the network or
+    the parser.
+    """
+    count = _scaled(100000, options)
+    columns = [("c%d" % (i,), 25) for i in range(10)]
+    description = parse_from_buffer(fakeserver.row_description(columns), "utf8")
+    row = tuple(b"some text value %d" % (i,) for i in range(10))
+    conn = PostgresConnection(TwistedIOImplementation())
+
+    def run():
+        conn._currentDescription = description.values
+        conn._dataRows = [row] * count
+        conn._collate()
+
+    return {"cells_per_sec": count * len(columns) / _timed(run)}
+
+
+@benchmark
+def decode_int_arrays(options):
+    """
+    Converting a column of hundred-element integer arrays to Python, in the
+    text and binary formats.
+    """
+    count = _scaled(10000, options)
+    elements = list(range(100))
+    text = ("{" + ",".join(map(str, elements)) + "}").encode("ascii")
+    binary = Converter().to_postgres(elements, data_type=1007).value
+    conn = PostgresConnection(TwistedIOImplementation())
+    results = {}
+
+    for name, format_code, value in [("text", 0, text), ("binary", 1, binary)]:
+        description = [IndividualRow(b"a", 1007, -1, format_code)]
+
+        def run():
+            conn._currentDescription = description
+            conn._dataRows = [(value,)] * count
+            conn._collate()
+
+        results[name + "_elements_per_sec"] = count * len(elements) / _timed(run)
+
+    return results
+
+
+@benchmark
+def serialize_extended_query(options):
+    """
+    Serialising the Parse/Bind/Execute/Sync of a two-parameter query.
+    """
+    count = _scaled(50000, options)
+    params = [BindParam(0, b"12345"), BindParam(0, b"some text value")]
+
+    def run():
+        for _ in range(count):
+            Parse("utf8", "", "SELECT $1, $2").ser()
+            Bind("utf8", "", "", params, None).ser()
+            Execute("utf8", "", 0).ser()
+            Sync().ser()
+
+    elapsed = _timed(run)
+    return {"queries_per_sec": count / elapsed}
+
+
+@benchmark
+async def connect(target, options):
+    """
+    Connecting, up to the first ReadyForQuery.
+    """
+    count = _scaled(300, options)
+    start = time.perf_counter()
+    for _ in range(count):
+        conn = await target.connect()
+        conn._pg.transport.loseConnection()
+    elapsed = time.perf_counter() - start
+    return {
+        "connects_per_sec": count / elapsed,
+        "mean_latency_ms": elapsed / count * 1e3,
+    }
+
+
+@benchmark
+async def small_query_simple(target, options):
+    """
+    Round trips of a parameterless one-row query.
+    """
+    count = _scaled(5000, options)
+    conn = await target.connect()
+    start = time.perf_counter()
+    for _ in range(count):
+        await conn.query("SELECT 1")
+    elapsed = time.perf_counter() - start
+    conn._pg.transport.loseConnection()
+    return {
+        "queries_per_sec": count / elapsed,
+        "mean_latency_us": elapsed / count * 1e6,
+    }
+
+
+@benchmark
+async def small_query_extended(target, options):
+    """
+    Round trips of a one-row query with a parameter.
+    """
+    count = _scaled(3000, options)
+    conn = await target.connect()
+    start = time.perf_counter()
+    for _ in range(count):
+        await conn.query("SELECT $1", [1])
+    elapsed = time.perf_counter() - start
+    conn._pg.transport.loseConnection()
+    return {
+        "queries_per_sec": count / elapsed,
+        "mean_latency_us": elapsed / count * 1e6,
+    }
+
+
+@benchmark
+async def small_query_prepared(target, options):
+    """
+    Round trips of a one-row query with a parameter, prepared as a named
+    statement after its first run.
+    """
+    count = _scaled(3000, options)
+    conn = await target.connect(registry=StatementRegistry(threshold=1))
+    start = time.perf_counter()
+    for _ in range(count):
+        await conn.query("SELECT $1", [1])
+    elapsed = time.perf_counter() - start
+    conn._pg.transport.loseConnection()
+    return {
+        "queries_per_sec": count / elapsed,
+        "mean_latency_us": elapsed / count * 1e6,
+    }
+
+
+@benchmark
+async def transport_latency(target, options):
+    """
+    Round trips of a one-row query with a parameter, and of a pipelined
+    transaction of ten of them, over TCP with and without TCP_NODELAY and
+    over a UNIX socket, whatever --transport says.
+    """
+    count = _scaled(1000, options)
+    transports = [
+        ("tcp_delay", "tcp", TwistedIOImplementation(tcp_nodelay=False)),
+        ("tcp_nodelay", "tcp", TwistedIOImplementation(tcp_nodelay=True)),
+        ("unix", "unix", TwistedIOImplementation()),
+    ]
+    results = {}
+
+    for name, transport, io_impl in transports:
+        await target.listen(transport)
+        conn = await target.connect(io_impl, transport)
+
+        start = time.perf_counter()
+        for _ in range(count):
+            await conn.query("SELECT $1", [1])
+        results[name + "_query_latency_us"] = (
+            (time.perf_counter() - start) / count * 1e6
+        )
+
+        pipelines = max(1, count // 10)
+        start = time.perf_counter()
+        for _ in range(pipelines):
+            async with conn.new_pipelined_transaction() as transaction:
+                for _ in range(10):
+                    transaction.execute("SELECT $1", [1])
+        results[name + "_pipeline_latency_us"] = (
+            (time.perf_counter() - start) / pipelines * 1e6
+        )
+
+        conn._pg.transport.loseConnection()
+
+    return results
+
+
+@benchmark
+async def small_query_histograms(target, options):
+    """
+    Round trips of a one-row query with a parameter on an instrumented
+    connection, with and without latency histograms, taking turns so that
+    both see the same conditions.
+
+    The difference between the two is within the noise of a run, so the
+    time taken to record each query in the histograms is also measured on
+    its own, as a share of the time a query takes.
+    """
+    rounds = _scaled(50, options)
+    instrumentation = Instrumentation()
+    conn = await target.connect(instrumentation=instrumentation)
+    stats = StatementStats(slow_threshold=1.0)
+    elapsed = [0.0, 0.0]
+
+    for _ in range(rounds):
+        for index, statements in enumerate((None, stats)):
+            instrumentation.statements = statements
+            start = time.perf_counter()
+            for _ in range(100):
+                await conn.query("SELECT $1", [1])
+            elapsed[index] += time.perf_counter() - start
+
+    conn._pg.transport.loseConnection()
+
+    recorded = list(instrumentation.recent)
+    stats = StatementStats(slow_threshold=1.0)
+    start = time.perf_counter()
+    for query in recorded:
+        stats.record(query)
+    record = (time.perf_counter() - start) / len(recorded)
+    query = elapsed[1] / (rounds * 100)
+
+    return {
+        "queries_per_sec": rounds * 100 / elapsed[1],
+        "overhead_pct": (elapsed[1] / elapsed[0] - 1) * 100,
+        "record_latency_us": record * 1e6,
+        "record_overhead_pct": record / query * 100,
+    }
+
+
+@benchmark
+async def large_result(target, options):
+    """
+    Fetching and decoding a large, narrow result.
+    """
+    rows = len(target.results["SELECT large"].rows)
+    conn = await target.connect()
+    start = time.perf_counter()
+    await conn.query("SELECT large")
+    elapsed = time.perf_counter() - start
+    conn._pg.transport.loseConnection()
+    return {"rows_per_sec": rows / elapsed}
+
+
+@benchmark
+async def large_result_pooled(target, options):
+    """
+    Fetching a large, narrow result, parsed and decoded in a process pool of
+    each size (0 being no pool), to show how it scales with the workers.
+    """
+    rows = len(target.results["SELECT large"].rows)
+    res = {"cpus": os.cpu_count()}
+
+    for workers in (0, 1, 2, 4):
+        pool = ProcessPoolExecutor(workers) if workers else None
+        conn = await target.connect(decode_pool=pool)
+        # Start the workers, and have them build their decoders.
+        await conn.query("SELECT large")
+        start = time.perf_counter()
+        await conn.query("SELECT large")
+        elapsed = time.perf_counter() - start
+        conn._pg.transport.loseConnection()
+        if pool is not None:
+            pool.shutdown()
+        res["rows_per_sec_%d_workers" % (workers,)] = rows / elapsed
+
+    return res
+
+
+@benchmark
+async def large_result_spilled(target, options):
+    """
+    Fetching a large, narrow result with a 1MiB memory budget, so that most
+    of it is spilled to disk, and then reading all of it back.
+    """
+    rows = len(target.results["SELECT large"].rows)
+    conn = await target.connect(memory_budget=1024 * 1024)
+    start = time.perf_counter()
+    result = await conn.query("SELECT large")
+    received = time.perf_counter() - start
+    for row in result:
+        pass
+    elapsed = time.perf_counter() - start
+    conn._pg.transport.loseConnection()
+    return {"receive_rows_per_sec": rows / received, "rows_per_sec": rows / elapsed}
+
+
+@benchmark
+async def large_result_iterated(target, options):
+    """
+    Iterating over a large, narrow result, fetched from a portal in batches
+    of each size, against fetching all of it at once.
+    """
+    rows = len(target.results["SELECT large"].rows)
+    conn = await target.connect()
+
+    start = time.perf_counter()
+    for row in await conn.query("SELECT large"):
+        pass
+    res = {"rows_per_sec_query": rows / (time.perf_counter() - start)}
+
+    for batch in (100, 1000, 10000):
+        start = time.perf_counter()
+        async for row in conn.iterate("SELECT large", batch=batch):
+            pass
+        res["rows_per_sec_batch_%d" % (batch,)] = rows / (time.perf_counter() - start)
+
+    conn._pg.transport.loseConnection()
+    return res
+
+
+@benchmark
+async def wide_rows(target, options):
+    """
+    Fetching and decoding rows of 200 text columns.
+    """
+    rows = len(target.results["SELECT wide"].rows)
+    conn = await target.connect()
+    start = time.perf_counter()
+    await conn.query("SELECT wide")
+    elapsed = time.perf_counter() - start
+    conn._pg.transport.loseConnection()
+    return {"rows_per_sec": rows / elapsed, "cells_per_sec": rows * 200 / elapsed}
+
+
+@benchmark
+async def copy_out(target, options):
+    """
+    COPY OUT of a large table, with a callback that does nothing.
+    """
+    result = target.results["large"]
+    size = len(result.copy_bytes())
+    conn = await target.connect()
+    start = time.perf_counter()
+    await conn.copy_out(lambda message: None, table="large")
+    elapsed = time.perf_counter() - start
+    conn._pg.transport.loseConnection()
+    return {
+        "mb_per_sec": size / elapsed / 1e6,
+        "rows_per_sec": len(result.rows) / elapsed,
+    }
+
+
+@benchmark
+async def copy_out_batches(target, options):
+    """
+    COPY OUT of a large table, iterating over it in batches.
+    """
+    result = target.results["large"]
+    size = len(result.copy_bytes())
+    conn = await target.connect()
+    start = time.perf_counter()
+    async for batch in conn.copy_out(table="large"):
+        pass
+    elapsed = time.perf_counter() - start
+    conn._pg.transport.loseConnection()
+    return {
+        "mb_per_sec": size / elapsed / 1e6,
+        "rows_per_sec": len(result.rows) / elapsed,
+    }
+
+
+@benchmark
+async def bulk_upsert(target, options):
+    """
+    Upserting rows with L{PostgresConnection.bulk_upsert}, against doing it
+    with one pipelined INSERT ... ON CONFLICT per row. The fake server
+    doesn't store anything, so this is only the client's side of it.
+    """
+    rows = [(i, "name-%d" % (i,), True) for i in range(_scaled(100000, options))]
+    conn = await target.connect()
+
+    start = time.perf_counter()
+    await conn.bulk_upsert("large", rows, ["id"])
+    bulk = time.perf_counter() - start
+
+    start = time.perf_counter()
+    async with conn.new_pipelined_transaction() as transaction:
+        for row in rows:
+            transaction.execute(
+                "INSERT INTO large VALUES ($1, $2, $3) ON CONFLICT (id) DO UPDATE"
+                " SET name = EXCLUDED.name, flag = EXCLUDED.flag",
+                list(row),
+            )
+    pipelined = time.perf_counter() - start
+
+    conn._pg.transport.loseConnection()
+    return {
+        "rows_per_sec": len(rows) / bulk,
+        "pipelined_rows_per_sec": len(rows) / pipelined,
+    }
+
+
+@benchmark
+def replay_trace_parser(options):
+    """
+    ParserFeed on the inbound side of the trace given with --trace.
+    """
+    if not options.trace:
+        return None
+
+    records = read_trace(options.trace)
+    size = sum(len(r.data) for r in records)
+    start = time.perf_counter()
+    count = replay_parser(records)
+    elapsed = time.perf_counter() - start
+    return {"messages_per_sec": count / elapsed, "mb_per_sec": size / elapsed / 1e6}
+
+
+@benchmark
+def replay_trace_connection(options):
+    """
+    PostgresConnection replaying the trace given with --trace.
+    """
+    if not options.trace:
+        return None
+
+    records = read_trace(options.trace)
+    size = sum(len(r.data) for r in records)
+    elapsed = _timed(replay_connection, records)
+    return {"mb_per_sec": size / elapsed / 1e6, "elapsed_s": elapsed}
+
+
+def _import_times(statement):
+    """
+    The cumulative time in microseconds that each module imported by
+    C{statement}, in a new interpreter, took to import, from
+    C{python -X importtime}. C{None} is the total over the top-level imports.
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [os.path.join(os.path.dirname(_HERE), "src"), env.get("PYTHONPATH", "")]
+    )
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        env=env,
+        stderr=subprocess.PIPE,
+        check=True,
+    ).stderr.decode("utf8")
+
+    times = {None: 0}
+    for line in output.splitlines()[1:]:
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative)
+        if not name.startswith("  "):
+            times[None] += int(cumulative)
+    return times
+
+
+@benchmark
+def import_time(options):
+    """
+    How long a new process takes to import txpg, and everything a
+    connection needs, as short-lived jobs would.
+    """
+    lazy = _import_times("import txpg")
+    full = _import_times("import txpg.protocol, sansiopg.protocol")
+
+    return {
+        "import_txpg_ms": lazy[None] / 1000,
+        "connection_modules_ms": full[None] / 1000,
+        "protocol_ms": full["sansiopg.protocol"] / 1000,
+        "messages_ms": full["sansiopg.messages"] / 1000,
+    }
+
+
+def _commit():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "HEAD"], cwd=_HERE, stderr=subprocess.DEVNULL
+            )
+            .decode("ascii")
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _best(samples):
+    """
+    Combine repeated runs, keeping the best value of each metric.
+    """
+    best = {}
+    for sample in samples:
+        for name, value in sample.items():
+            if name not in best:
+                best[name] = value
+            elif _lower_is_better(name):
+                best[name] = min(best[name], value)
+            else:
+                best[name] = max(best[name], value)
+    return best
+
+
+def _lower_is_better(metric):
+    return (
+        "latency" in metric
+        or metric.endswith("_ms")
+        or metric.endswith("_s")
+        or metric.endswith("_pct")
+    )
+
+
+async def _run_all(reactor, options):
+    target = _Target(reactor, options)
+    await target.start()
+
+    results = {}
+    try:
+        for func in _BENCHMARKS:
+            name = func.__name__
+            if options.only and name not in options.only:
+                continue
+
+            samples = []
+            for _ in range(options.repeat):
+                if func.__code__.co_flags & 0x80:  # a coroutine function
+                    sample = await func(target, options)
+                else:
+                    sample = func(options)
+                if sample is not None:
+                    samples.append(sample)
+
+            if not samples:
+                continue
+
+            results[name] = _best(samples)
+            _report(name, results[name], options.baseline.get(name))
+    finally:
+        await target.stop()
+
+    return results
+
+
+def _report(name, metrics, baseline):
+    parts = []
+    for metric, value in sorted(metrics.items()):
+        text = "%s=%.6g" % (metric, value)
+        if baseline and metric in baseline and baseline[metric]:
+            ratio = value / baseline[metric]
+            text += " (%.2fx)" % (ratio,)
+        parts.append(text)
+    print("%-28s %s" % (name, "  ".join(parts)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-o", "--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="a previous JSON results file to compare to")
+    parser.add_argument(
+        "--only", type=lambda s: s.split(","), help="comma-separated benchmarks"
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--scale", type=float, default=1.0, help="multiply the workload sizes"
+    )
+    parser.add_argument("--transport", choices=["tcp", "unix", "memory"], default="tcp")
+    parser.add_argument(
+        "--trace", help="a trace recorded with sansiopg.trace to replay as well"
+    )
+    options = parser.parse_args(argv)
+
+    options.baseline = {}
+    if options.compare:
+        with open(options.compare) as f:
+            options.baseline = json.load(f)["results"]
+
+    def _main(reactor):
+        d = defer.ensureDeferred(_run_all(reactor, options))
+        if options.output:
+            d.addCallback(_save, options)
+        return d
+
+    task.react(_main)
+
+
+def _save(results, options):
+    document = {
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "options": {
+            "repeat": options.repeat,
+            "scale": options.scale,
+            "transport": options.transport,
+            "trace": options.trace,
+        },
+        "results": results,
+    }
+    with open(options.output, "w") as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+"""
+Codecs for arrays and records (composite values), in both the text and the
+binary formats.
+
+The text decoders are built from a decoder for the elements. The binary
+formats say what type each element is, so those decoders are given a
+function to look element decoders up by type OID instead.
+"""
+
+import array
+import struct
+
+_INT32 = struct.Struct("!i")
+_ARRAY_HEADER = struct.Struct("!iii")
+_DIMENSION = struct.Struct("!ii")
+
+# Element types whose binary values can be unpacked in bulk, and what they
+# are in the struct and array modules.
+_FIXED_WIDTH = {
+    21: ("h", 2),
+    23: ("i", 4),
+    20: ("q", 8),
+    26: ("I", 4),
+    700: ("f", 4),
+    701: ("d", 8),
+}
+
+
+def _unquote(text):
+    """
+    Take the quotes and backslashes out of a quoted array or record element.
+    Records also escape quotes by doubling them.
+    """
+    res = bytearray()
+    position = 1
+    end = len(text) - 1
+
+    while position < end:
+        c = text[position]
+        if c == 92 or (c == 34 and text[position + 1] == 34):  # \ or ""
+            position += 1
+            c = text[position]
+        res.append(c)
+        position += 1
+
+    return bytes(res)
+
+
+def text_array_decoder(decode_element, compact=None, delimiter=b","):
+    """
+    A decoder for the text format of an array, giving (nested) lists of the
+    elements decoded with C{decode_element}, or None for NULLs. Elements are
+    separated by C{delimiter}, which is a comma for all but a few types.
+
+    If C{compact} is an L{array.array} type code, one-dimensional arrays
+    without NULLs are given as L{array.array}s of it.
+    """
+    separator = delimiter[0]
+    ends = delimiter + b"}"
+
+    def decode(value):
+        if value[:1] == b"[":
+            # Has explicit bounds, like [0:1]={1,2}
+            value = value[value.index(b"=") + 1 :]
+
+        stack = []
+        current = None
+        position = 0
+        length = len(value)
+
+        while position < length:
+            c = value[position]
+
+            if c == 123:  # {
+                new = []
+                if current is not None:
+                    current.append(new)
+                    stack.append(current)
+                current = new
+                position += 1
+            elif c == 125:  # }
+                position += 1
+                if stack:
+                    current = stack.pop()
+            elif c == separator:
+                position += 1
+            elif c == 34:  # "
+                end = position + 1
+                while value[end] != 34:
+                    end += 2 if value[end] == 92 else 1
+                element = _unquote(value[position : end + 1])
+                current.append(decode_element(element))
+                position = end + 1
+            else:
+                end = position
+                while value[end] not in ends:
+                    end += 1
+                element = value[position:end]
+                if element.upper() == b"NULL":
+                    current.append(None)
+                else:
+                    current.append(decode_element(element))
+                position = end
+
+        if compact is not None and current and None not in current:
+            if not isinstance(current[0], list):
+                return array.array(compact, current)
+
+        return current
+
+    return decode
+
+
+def text_record_decoder(decode_field):
+    """
+    A decoder for the text format of a record, giving a tuple of its fields
+    decoded with C{decode_field}, or None for NULLs. The text format doesn't
+    say what types the fields are.
+    """
+
+    def decode(value):
+        fields = []
+        position = 1
+        end = len(value) - 1
+
+        if end == position:
+            # A record without fields. One with a single NULL is written
+            # the same way, so can't be told apart from it.
+            return ()
+
+        while True:
+            if value[position] == 34:  # "
+                start = position
+                position += 1
+                while True:
+                    c = value[position]
+                    if c == 92 or (c == 34 and value[position + 1] == 34):
+                        position += 2
+                    elif c == 34:
+                        break
+                    else:
+                        position += 1
+                position += 1
+                fields.append(decode_field(_unquote(value[start:position])))
+            else:
+                start = position
+                while position < end and value[position] != 44:
+                    position += 1
+                if position == start:
+                    fields.append(None)
+                else:
+                    fields.append(decode_field(value[start:position]))
+
+            if position >= end:
+                return tuple(fields)
+            position += 1
+
+    return decode
+
+
+def binary_array_decoder(element_decoder_for, compact=False):
+    """
+    A decoder for the binary format of an array, giving (nested) lists.
+    C{element_decoder_for} takes an element type OID and returns its binary
+    decoder, or None to leave the elements as bytes.
+
+    If C{compact} is set, one-dimensional arrays of numbers without NULLs
+    are given as L{array.array}s, which take a lot less memory.
+    """
+
+    def decode(value):
+        dimensions, has_nulls, element_type = _ARRAY_HEADER.unpack_from(value)
+
+        if not dimensions:
+            return []
+
+        lengths = []
+        offset = _ARRAY_HEADER.size
+        for _ in range(dimensions):
+            length, lower_bound = _DIMENSION.unpack_from(value, offset)
+            lengths.append(length)
+            offset += _DIMENSION.size
+
+        count = 1
+        for length in lengths:
+            count *= length
+
+        fixed = _FIXED_WIDTH.get(element_type)
+
+        if fixed is not None and not has_nulls:
+            code, size = fixed
+            elements = struct.unpack_from("!" + ("i" + code) * count, value, offset)
+            elements = elements[1::2]
+            if compact and dimensions == 1:
+                return array.array(code, elements)
+            elements = list(elements)
+        else:
+            decode_element = element_decoder_for(element_type)
+            elements = []
+            for _ in range(count):
+                (size,) = _INT32.unpack_from(value, offset)
+                offset += 4
+                if size == -1:
+                    elements.append(None)
+                    continue
+                element = value[offset : offset + size]
+                offset += size
+                if decode_element is not None:
+                    element = decode_element(element)
+                elements.append(element)
+
+        # Fold the flat elements into nested lists, innermost dimension first.
+        for length in reversed(lengths[1:]):
+            elements = [
+                elements[i : i + length] for i in range(0, len(elements), length)
+            ]
+
+        return elements
+
+    return decode
+
+
+def binary_record_decoder(field_decoder_for):
+    """
+    A decoder for the binary format of a record, giving a tuple of its
+    fields. C{field_decoder_for} is as for L{binary_array_decoder}.
+    """
+
+    def decode(value):
+        (count,) = _INT32.unpack_from(value)
+        offset = 4
+        fields = []
+
+        for _ in range(count):
+            field_type, size = _DIMENSION.unpack_from(value, offset)
+            offset += 8
+            if size == -1:
+                fields.append(None)
+                continue
+            field = value[offset : offset + size]
+            offset += size
+            decode_field = field_decoder_for(field_type)
+            fields.append(field if decode_field is None else decode_field(field))
+
+        return tuple(fields)
+
+    return decode
+
+
+def _dimensions(seq):
+    lengths = []
+    while isinstance(seq, (list, tuple, array.array)):
+        lengths.append(len(seq))
+        if not len(seq):
+            break
+        seq = seq[0]
+    return lengths
+
+
+def _flatten(seq, depth):
+    if depth == 1:
+        return list(seq)
+    res = []
+    for item in seq:
+        res.extend(_flatten(item, depth - 1))
+    return res
+
+
+def encode_binary_array(seq, element_type, encode_element):
+    """
+    The binary format of the array C{seq}, of elements of type
+    C{element_type} encoded with C{encode_element}.
+    """
+    lengths = _dimensions(seq)
+
+    if not lengths or lengths == [0]:
+        return _ARRAY_HEADER.pack(0, 0, element_type)
+
+    elements = _flatten(seq, len(lengths))
+
+    if len(elements) != _product(lengths):
+        raise ValueError("Arrays must be rectangular.")
+
+    has_nulls = None in elements
+    res = [_ARRAY_HEADER.pack(len(lengths), int(has_nulls), element_type)]
+    res.extend(_DIMENSION.pack(length, 1) for length in lengths)
+
+    fixed = _FIXED_WIDTH.get(element_type)
+
+    if fixed is not None and not has_nulls:
+        code, size = fixed
+        packed = []
+        for element in elements:
+            packed.append(size)
+            packed.append(element)
+        res.append(struct.pack("!" + ("i" + code) * len(elements), *packed))
+    else:
+        for element in elements:
+            if element is None:
+                res.append(_INT32.pack(-1))
+            else:
+                data = encode_element(element)
+                res.append(_INT32.pack(len(data)))
+                res.append(data)
+
+    return b"".join(res)
+
+
+def _product(lengths):
+    count = 1
+    for length in lengths:
+        count *= length
+    return count
+
+
+def format_text_array(seq, format_element):
+    """
+    The text format of the array C{seq}, whose elements are formatted with
+    C{format_element}, which gives bytes. Every element is quoted, so the
+    server parses them as whatever type it expects.
+    """
+    parts = []
+
+    for element in seq:
+        if isinstance(element, (list, tuple, array.array)):
+            parts.append(format_text_array(element, format_element))
+        elif element is None:
+            parts.append(b"NULL")
+        else:
+            text = format_element(element)
+            text = text.replace(b"\\", b"\\\\").replace(b'"', b'\\"')
+            parts.append(b'"' + text + b'"')
+
+    return b"{" + b",".join(parts) + b"}"
@@ -0,0 +1,152 @@
+"""
+Loading many rows at once, by streaming them to the server with COPY FROM
+STDIN, and the SQL that L{PostgresConnection.bulk_upsert} merges them with.
+"""
+
+import struct
+
+# The name, columns and column types of a table.
+COLUMNS_QUERY = """
+SELECT $1::regclass::text AS name,
+       array_agg(a.attname::text ORDER BY a.attnum) AS columns,
+       array_agg(a.atttypid ORDER BY a.attnum) AS types
+FROM pg_attribute a
+WHERE a.attrelid = $1::regclass AND a.attnum > 0 AND NOT a.attisdropped
+"""
+
+# How much of the COPY stream goes in each CopyData.
+CHUNK_SIZE = 64 * 1024
+
+_BINARY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+_BINARY_TRAILER = struct.pack("!h", -1)
+_BINARY_NULL = struct.pack("!i", -1)
+_LENGTH = struct.Struct("!i")
+
+
+def _escape_text(value):
+    value = value.replace(b"\\", b"\\\\").replace(b"\t", b"\\t")
+    return value.replace(b"\n", b"\\n").replace(b"\r", b"\\r")
+
+
+def fixed_width_field_encoder(code, size):
+    """
+    A field encoder, like those of L{binary_field_encoder}, for values that
+    the L{struct} module packs as C{code} in C{size} bytes.
+    """
+    pack = struct.Struct("!i" + code).pack
+    return lambda value: pack(size, value)
+
+
+def binary_field_encoder(encode):
+    """
+    Make C{encode}, which gives the binary format of a value, give it as a
+    field of a binary COPY, length and all.
+    """
+    pack_length = _LENGTH.pack
+
+    def encode_field(value):
+        data = encode(value)
+        return pack_length(len(data)) + data
+
+    return encode_field
+
+
+def binary_copy(rows, encoders, chunk_size=CHUNK_SIZE):
+    """
+    The binary COPY stream of C{rows}, in pieces of about C{chunk_size}
+    bytes. C{encoders} are from L{binary_field_encoder}, one per column.
+    """
+    field_count = struct.pack("!h", len(encoders))
+    res = [_BINARY_HEADER]
+    size = len(_BINARY_HEADER)
+
+    for row in rows:
+        if len(row) != len(encoders):
+            raise ValueError(
+                "Expected %d values, got %d: %r" % (len(encoders), len(row), row)
+            )
+
+        res.append(field_count)
+        size += 2
+
+        for value, encode in zip(row, encoders):
+            field = _BINARY_NULL if value is None else encode(value)
+            res.append(field)
+            size += len(field)
+
+        if size >= chunk_size:
+            yield b"".join(res)
+            res = []
+            size = 0
+
+    res.append(_BINARY_TRAILER)
+    yield b"".join(res)
+
+
+def text_copy(rows, formatters, chunk_size=CHUNK_SIZE):
+    """
+    The text COPY stream of C{rows}, for columns without a binary encoding.
+    C{formatters} give the text of a value as bytes, one per column.
+    """
+    res = []
+    size = 0
+
+    for row in rows:
+        if len(row) != len(formatters):
+            raise ValueError(
+                "Expected %d values, got %d: %r" % (len(formatters), len(row), row)
+            )
+
+        line = b"\t".join(
+            b"\\N" if value is None else _escape_text(format(value))
+            for value, format in zip(row, formatters)
+        )
+        res.append(line + b"\n")
+        size += len(line) + 1
+
+        if size >= chunk_size:
+            yield b"".join(res)
+            res = []
+            size = 0
+
+    if res:
+        yield b"".join(res)
+
+
+def _quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def upsert_script(table, staging, columns, key_columns, binary):
+    """
+    The statements that copy rows of C{columns} into a temporary C{staging}
+    table and merge them into C{table}, which must be quoted already.
+
+    They are sent as one Query, so the server runs them in one transaction,
+    and starts on the merge as soon as the COPY is done.
+    """
+    names = ", ".join(_quote_identifier(column) for column in columns)
+    keys = ", ".join(_quote_identifier(column) for column in key_columns)
+    updates = ", ".join(
+        "%s = EXCLUDED.%s" % (_quote_identifier(column), _quote_identifier(column))
+        for column in columns
+        if column not in key_columns
+    )
+
+    statements = [
+        "CREATE TEMP TABLE %s ON COMMIT DROP AS SELECT %s FROM %s WITH NO DATA"
+        % (staging, names, table),
+        "COPY %s (%s) FROM STDIN%s"
+        % (staging, names, " (FORMAT binary)" if binary else ""),
+        "INSERT INTO %s (%s) SELECT %s FROM %s ON CONFLICT (%s) DO %s"
+        % (
+            table,
+            names,
+            names,
+            staging,
+            keys,
+            "UPDATE SET " + updates if updates else "NOTHING",
+        ),
+        "DROP TABLE %s" % (staging,),
+    ]
+    return ";\n".join(statements)
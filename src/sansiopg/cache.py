@@ -0,0 +1,215 @@
+"""
+A cache of query results, to put in front of L{PostgresConnection.query} for
+read-only lookups that run over and over.
+"""
+
+import sys
+import time
+from collections import OrderedDict
+
+import attr
+
+
+def _size_of(rows):
+    """
+    Roughly how much memory a collated result takes up.
+    """
+    size = sys.getsizeof(rows)
+    for row in rows:
+        size += sys.getsizeof(row)
+        for value in row:
+            size += sys.getsizeof(value)
+    return size
+
+
+def _freeze(value):
+    """
+    A hashable stand-in for a parameter, so that lists and dicts, which are
+    sent as arrays and JSON, can be part of a key. Raises C{TypeError} for
+    anything else that can't be hashed.
+
+    Values are keyed with their type, since 1, True and 1.0 are equal but
+    sent as different things.
+    """
+    if isinstance(value, (list, tuple)):
+        return (type(value), tuple(_freeze(x) for x in value))
+    if isinstance(value, dict):
+        return (dict, frozenset((k, _freeze(v)) for k, v in value.items()))
+    hash(value)
+    return (type(value), value)
+
+
+@attr.s
+class CacheStats(object):
+
+    hits = attr.ib(default=0)
+    misses = attr.ib(default=0)
+    evictions = attr.ib(default=0)
+    expirations = attr.ib(default=0)
+    invalidations = attr.ib(default=0)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        if not lookups:
+            return 0.0
+        return self.hits / lookups
+
+
+@attr.s
+class _Entry(object):
+
+    rows = attr.ib()
+    size = attr.ib()
+    expires = attr.ib()
+    tags = attr.ib()
+
+
+@attr.s
+class ResultCache(object):
+    """
+    Results keyed by query text and parameters, evicting the least recently
+    used once there are more than C{max_entries} or they take up more than
+    C{max_bytes}, and expiring them C{ttl} seconds after they were fetched.
+
+    Entries can be tagged, usually with the tables they read, and dropped by
+    tag with C{invalidate}, or by a NOTIFY once C{listen} has been called.
+    The cache doesn't belong to any one connection, so it can be shared by
+    all of the connections of a pool.
+    """
+
+    max_entries = attr.ib(default=1000)
+    max_bytes = attr.ib(default=64 * 1024 * 1024)
+    ttl = attr.ib(default=60.0)
+    clock = attr.ib(default=time.monotonic)
+    stats = attr.ib(factory=CacheStats, init=False)
+    bytes = attr.ib(default=0, init=False)
+    _entries = attr.ib(factory=OrderedDict, init=False, repr=False)
+    _tags = attr.ib(factory=dict, init=False, repr=False)
+    _generations = attr.ib(factory=dict, init=False, repr=False)
+    _clears = attr.ib(default=0, init=False, repr=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def query(self, connection, query, vals=[], tags=(), ttl=None):
+        """
+        Like C{connection.query}, but answered from the cache if it can be.
+        A result that is fetched is cached under C{tags}, for C{ttl} seconds
+        if given. Queries with parameters that can't be part of a key go
+        straight to the connection.
+        """
+        try:
+            key = (query, tuple(_freeze(x) for x in vals))
+        except TypeError:
+            return connection.query(query, vals)
+
+        found, rows = self.get(key)
+
+        if found:
+            return connection.succeeded(rows)
+
+        # If the tags are invalidated while the query is running, the
+        # result may be from before the change, so it isn't kept.
+        generation = self._generation(tags)
+        d = connection.query(query, vals)
+
+        def _store(rows):
+            if self._generation(tags) == generation:
+                self.put(key, rows, tags, ttl)
+            return rows
+
+        connection.io_impl.add_callback(d, _store)
+        return d
+
+    def get(self, key):
+        """
+        Returns whether C{key} is cached, and its rows if it is.
+        """
+        entry = self._entries.get(key)
+
+        if entry is None:
+            self.stats.misses += 1
+            return False, None
+
+        if entry.expires is not None and entry.expires <= self.clock():
+            self._remove(key)
+            self.stats.expirations += 1
+            self.stats.misses += 1
+            return False, None
+
+        self._entries.move_to_end(key)
+        self.stats.hits += 1
+
+        # The rows are immutable, but the list isn't.
+        return True, list(entry.rows)
+
+    def put(self, key, rows, tags=(), ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+
+        size = _size_of(rows)
+
+        if key in self._entries:
+            self._remove(key)
+
+        if size > self.max_bytes:
+            return
+
+        expires = None if ttl is None else self.clock() + ttl
+        self._entries[key] = _Entry(list(rows), size, expires, frozenset(tags))
+        self.bytes += size
+
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+
+        while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.stats.evictions += 1
+
+    def invalidate(self, tag):
+        """
+        Drop every entry tagged with C{tag}.
+        """
+        self._generations[tag] = self._generations.get(tag, 0) + 1
+
+        for key in self._tags.pop(tag, ()):
+            self._remove(key)
+            self.stats.invalidations += 1
+
+    def clear(self):
+        self._clears += 1
+        self._entries.clear()
+        self._tags.clear()
+        self.bytes = 0
+
+    def _generation(self, tags):
+        return self._clears, tuple(self._generations.get(tag, 0) for tag in tags)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.bytes -= entry.size
+
+        for tag in entry.tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def listen(self, connection, channel="sansiopg_invalidate"):
+        """
+        Invalidate entries when C{connection} receives a NOTIFY on
+        C{channel}, whose payload is the tag to invalidate, or empty to
+        invalidate everything. For example, from a trigger::
+
+            PERFORM pg_notify('sansiopg_invalidate', TG_TABLE_NAME);
+        """
+        return connection.listen(channel, self._on_notification)
+
+    def _on_notification(self, message):
+        if message.payload:
+            self.invalidate(message.payload)
+        else:
+            self.stats.invalidations += len(self._entries)
+            self.clear()
@@ -1,16 +1,31 @@
-from .messages import BindParam, DataType, FormatType
+import array
+import codecs
+import functools
+import re
+import struct
 
+from . import arrays
+from .messages import BindParam, DataType, FormatType, _data_type
 
-def _int_to_postgres(val):
-    return BindParam(0, str(val).encode("utf8"))
 
+def _int_to_postgres(val, encoding):
+    return BindParam(0, str(val).encode("ascii"))
 
-def _str_to_postgres(val):
-    return BindParam(0, val.encode("utf8"))
 
+def _str_to_postgres(val, encoding):
+    return BindParam(0, val.encode(encoding))
 
-def _text_text_from_postgres(val):
-    return val.decode("utf8")
+
+def _float_to_postgres(val, encoding):
+    return BindParam(0, repr(val).encode("ascii"))
+
+
+def _bool_to_postgres(val, encoding):
+    return BindParam(0, b"t" if val else b"f")
+
+
+def _bytes_to_postgres(val, encoding):
+    return BindParam(0, b"\\x" + val.hex().encode("ascii"))
 
 
 def _bool_text_from_postgres(val):
@@ -22,40 +37,423 @@ def _bool_text_from_postgres(val):
         raise ValueError()
 
 
-def _int_text_from_postgres(val):
-    return int(val.decode("ascii"))
+def _bytea_text_from_postgres(val):
+    # The hex format, which is the default since PostgreSQL 9.0.
+    return bytes.fromhex(val[2:].decode("ascii"))
+
+
+_HSTORE_PAIR = re.compile(rb'"((?:[^"\\]|\\.)*)"\s*=>\s*(?:"((?:[^"\\]|\\.)*)"|NULL)')
+_HSTORE_ESCAPE = re.compile(rb"\\(.)")
+
+
+def _hstore_text_decoder(decode):
+    def _unescape(val):
+        return decode(_HSTORE_ESCAPE.sub(rb"\1", val))
+
+    def from_postgres(val):
+        res = {}
+        for pair in _HSTORE_PAIR.finditer(val):
+            value = pair.group(2)
+            res[_unescape(pair.group(1))] = None if value is None else _unescape(value)
+        return res
+
+    return from_postgres
+
+
+# PostgreSQL's names for encodings that Python calls something else.
+_PYTHON_ENCODINGS = {
+    "SQL_ASCII": "ascii",
+    "WIN866": "cp866",
+    "WIN874": "cp874",
+    "WIN1250": "cp1250",
+    "WIN1251": "cp1251",
+    "WIN1252": "cp1252",
+    "WIN1253": "cp1253",
+    "WIN1254": "cp1254",
+    "WIN1255": "cp1255",
+    "WIN1256": "cp1256",
+    "WIN1257": "cp1257",
+    "WIN1258": "cp1258",
+    "KOI8R": "koi8_r",
+    "KOI8U": "koi8_u",
+    "UNICODE": "utf_8",
+}
+
+
+def python_encoding(name):
+    """
+    The name of the Python codec for the encoding PostgreSQL calls C{name}.
+    """
+    name = _PYTHON_ENCODINGS.get(name.upper(), name)
+    return codecs.lookup(name).name
+
+
+@functools.lru_cache()
+def _text_decoder(encoding):
+    encoding = python_encoding(encoding)
+
+    if encoding == "utf-8":
+        # The default, and the quickest way to get it.
+        return bytes.decode
+
+    return lambda val: val.decode(encoding)
+
+
+def _struct_decoder(fmt):
+    unpack = struct.Struct(fmt).unpack
+    return lambda val: unpack(val)[0]
 
 
+def _struct_encoder(fmt):
+    pack = struct.Struct(fmt).pack
+    return lambda val, encoding: pack(val)
+
+
+# Decoded with the connection's encoding.
+_TEXT = object()
+
+# The element types of the array types we know.
+_ARRAY_ELEMENTS = {
+    DataType._BOOL: DataType.BOOL,
+    DataType._BYTEA: DataType.BYTEA,
+    DataType._NAME: DataType.NAME,
+    DataType._INT2: DataType.INT2,
+    DataType._INT4: DataType.INT4,
+    DataType._TEXT: DataType.TEXT,
+    DataType._BPCHAR: DataType.BPCHAR,
+    DataType._VARCHAR: DataType.VARCHAR,
+    DataType._INT8: DataType.INT8,
+    DataType._FLOAT4: DataType.FLOAT4,
+    DataType._FLOAT8: DataType.FLOAT8,
+    DataType._OID: DataType.OID,
+    DataType._RECORD: DataType.RECORD,
+}
+
+# How array elements are sent in the binary format, by element type.
+_BINARY_TO_POSTGRES = {
+    DataType.BOOL: lambda val, encoding: b"\x01" if val else b"\x00",
+    DataType.BYTEA: lambda val, encoding: bytes(val),
+    DataType.NAME: lambda val, encoding: val.encode(encoding),
+    DataType.TEXT: lambda val, encoding: val.encode(encoding),
+    DataType.BPCHAR: lambda val, encoding: val.encode(encoding),
+    DataType.VARCHAR: lambda val, encoding: val.encode(encoding),
+    DataType.INT2: _struct_encoder("!h"),
+    DataType.INT4: _struct_encoder("!i"),
+    DataType.INT8: _struct_encoder("!q"),
+    DataType.OID: _struct_encoder("!I"),
+    DataType.FLOAT4: _struct_encoder("!f"),
+    DataType.FLOAT8: _struct_encoder("!d"),
+}
+
 _DEFAULT_CONVERTERS_FROM_POSTGRES = {
-    (DataType.NAME, FormatType.TEXT): _text_text_from_postgres,
-    (DataType.TEXT, FormatType.TEXT): _text_text_from_postgres,
+    (DataType.NAME, FormatType.TEXT): _TEXT,
+    (DataType.TEXT, FormatType.TEXT): _TEXT,
+    (DataType.VARCHAR, FormatType.TEXT): _TEXT,
+    (DataType.BPCHAR, FormatType.TEXT): _TEXT,
     (DataType.BOOL, FormatType.TEXT): _bool_text_from_postgres,
-    (DataType.INT4, FormatType.TEXT): _int_text_from_postgres,
+    (DataType.INT2, FormatType.TEXT): int,
+    (DataType.INT4, FormatType.TEXT): int,
+    (DataType.INT8, FormatType.TEXT): int,
+    (DataType.OID, FormatType.TEXT): int,
+    (DataType.FLOAT4, FormatType.TEXT): float,
+    (DataType.FLOAT8, FormatType.TEXT): float,
+    (DataType.BYTEA, FormatType.TEXT): _bytea_text_from_postgres,
+    (DataType.NAME, FormatType.BINARY): _TEXT,
+    (DataType.TEXT, FormatType.BINARY): _TEXT,
+    (DataType.VARCHAR, FormatType.BINARY): _TEXT,
+    (DataType.BPCHAR, FormatType.BINARY): _TEXT,
+    (DataType.BOOL, FormatType.BINARY): lambda val: val == b"\x01",
+    (DataType.INT2, FormatType.BINARY): _struct_decoder("!h"),
+    (DataType.INT4, FormatType.BINARY): _struct_decoder("!i"),
+    (DataType.INT8, FormatType.BINARY): _struct_decoder("!q"),
+    (DataType.OID, FormatType.BINARY): _struct_decoder("!I"),
+    (DataType.FLOAT4, FormatType.BINARY): _struct_decoder("!f"),
+    (DataType.FLOAT8, FormatType.BINARY): _struct_decoder("!d"),
+    (DataType.BYTEA, FormatType.BINARY): bytes,
+}
+_DEFAULT_CONVERTERS_TO_POSTGRES = {
+    type(None): lambda val, encoding: BindParam(0, None),
+    int: _int_to_postgres,
+    str: _str_to_postgres,
+    float: _float_to_postgres,
+    bool: _bool_to_postgres,
+    bytes: _bytes_to_postgres,
 }
-_DEFAULT_CONVERTERS_TO_POSTGRES = {int: _int_to_postgres, str: _str_to_postgres}
+
+# Sent as arrays.
+_SEQUENCES = (list, tuple, array.array)
+
+
+def decode_columns(rows, decoders, sunk=False):
+    """
+    Decode C{rows} with C{decoders}, one for each column (or None to leave
+    it as it is), returning the columns.
+
+    This goes a column at a time, so that each decoder is looked up once and
+    mapped over all of its values. Unless C{sunk} is set, when values may
+    have been written to files, the columns are lazy.
+    """
+    if not rows:
+        # Such as when every row was spilled; there is nothing to zip.
+        return []
+
+    columns = list(zip(*rows))
+
+    for index, decoder in enumerate(decoders):
+        if decoder is None:
+            continue
+
+        values = columns[index]
+
+        if sunk or None in values:
+            columns[index] = [decoder(x) if type(x) is bytes else x for x in values]
+        else:
+            columns[index] = map(decoder, values)
+
+    return columns
 
 
 class Converter(object):
-    def __init__(self):
+    """
+    Converts parameters to what PostgreSQL expects, and the values in
+    results to Python.
+
+    Arrays come back as lists, nested for each dimension. If
+    C{compact_arrays} is set, one-dimensional arrays of numbers without
+    NULLs come back as L{array.array}s instead, which take a lot less
+    memory. Records come back as tuples of strings, because the text format
+    doesn't say what types their fields are.
+    """
+
+    def __init__(self, compact_arrays=False):
+        self.compact_arrays = compact_arrays
         self._from_postgres = dict(_DEFAULT_CONVERTERS_FROM_POSTGRES)
         self._to_postgres = dict(_DEFAULT_CONVERTERS_TO_POSTGRES)
 
-    def to_postgres(self, value):
+    def __reduce__(self):
+        # The converters can't be pickled, so a worker process gets a fresh
+        # converter of the same class.
+        return type(self), (self.compact_arrays,)
+
+    def to_postgres(self, value, encoding="utf8", data_type=None):
+        """
+        Convert C{value} to a L{BindParam}. C{data_type} is the OID of the
+        type the server expects for it, if known, which lets lists and
+        tuples go as binary arrays rather than text.
+        """
+        if isinstance(value, _SEQUENCES):
+            return self._array_to_postgres(value, encoding, data_type)
+
         try:
             conv = self._to_postgres.get(type(value))
-            return conv(value)
+            return conv(value, encoding)
         except Exception:
             print("Can't convert ", value)
             raise ValueError()
 
-    def from_postgres(self, value, row_format):
-        try:
-            conv = self._from_postgres.get(
-                (row_format.data_type, row_format.format_code)
+    def _array_to_postgres(self, value, encoding, data_type):
+        element_type = _ARRAY_ELEMENTS.get(_data_type(data_type))
+        encode = _BINARY_TO_POSTGRES.get(element_type)
+
+        if encode is not None:
+            return BindParam(
+                1,
+                arrays.encode_binary_array(
+                    value, element_type.value, lambda val: encode(val, encoding)
+                ),
             )
-            return conv(value)
-        except Exception:
-            # print("Can't convert ", value, row_format)
-            # print("Falling back to text decode")
-            if row_format.format_code == FormatType.TEXT:
-                return value.decode("utf8")
+
+        # The server parses it as whatever it expects.
+        return BindParam(
+            0,
+            arrays.format_text_array(
+                value, lambda val: self.to_postgres(val, encoding).value
+            ),
+        )
+
+    def copy_encoder(self, data_types, encoding="utf8"):
+        """
+        How to COPY rows whose columns are of C{data_types} (type OIDs) to
+        the server. Returns whether the COPY is binary, and a function that
+        takes the rows and gives the pieces of the COPY stream.
+
+        It is binary if every column has a binary encoding, and otherwise
+        text, which the server parses like it does parameters.
+        """
+        # Only needed for COPY, so not imported along with this module.
+        from . import bulk
+
+        encoders = [self._copy_field_encoder(x, encoding) for x in data_types]
+
+        if None not in encoders:
+            return True, lambda rows: bulk.binary_copy(rows, encoders)
+
+        def format_value(value):
+            if isinstance(value, _SEQUENCES):
+                return arrays.format_text_array(value, format_value)
+            return self.to_postgres(value, encoding).value
+
+        formatters = [format_value] * len(encoders)
+        return False, lambda rows: bulk.text_copy(rows, formatters)
+
+    def _copy_field_encoder(self, data_type, encoding):
+        from . import bulk
+
+        fixed = arrays._FIXED_WIDTH.get(data_type)
+        if fixed is not None:
+            return bulk.fixed_width_field_encoder(*fixed)
+
+        data_type = _data_type(data_type)
+        encode = _BINARY_TO_POSTGRES.get(data_type)
+        if encode is not None:
+            return bulk.binary_field_encoder(lambda val: encode(val, encoding))
+
+        element_type = _ARRAY_ELEMENTS.get(data_type)
+        encode = _BINARY_TO_POSTGRES.get(element_type)
+        if encode is not None:
+            return bulk.binary_field_encoder(
+                lambda val: arrays.encode_binary_array(
+                    val, element_type.value, lambda x: encode(x, encoding)
+                )
+            )
+
+        return None
+
+    def result_format(self, row_format):
+        """
+        The format to ask for the column described by C{row_format} in. We
+        ask for arrays in binary, which is quicker to decode, when we know
+        their elements.
+        """
+        element_type = _ARRAY_ELEMENTS.get(row_format.data_type)
+
+        if (
+            element_type is not None
+            and (row_format.data_type, FormatType.TEXT) not in self._from_postgres
+            and (element_type, FormatType.BINARY) in self._from_postgres
+        ):
+            return FormatType.BINARY
+        return FormatType.TEXT
+
+    def result_formats(self, description, encoding="utf8", raw=()):
+        """
+        The formats to ask for the columns described by C{description}, as
+        from L{result_format}. Columns in C{raw}, as for L{decoders}, are
+        left in the text format.
+        """
+        if raw is True:
+            return [FormatType.TEXT] * len(description)
+
+        name_encoding = python_encoding(encoding)
+
+        return [
+            (
+                FormatType.TEXT
+                if raw and row_format.field_name.decode(name_encoding) in raw
+                else self.result_format(row_format)
+            )
+            for row_format in description
+        ]
+
+    def decoder_for(self, row_format, encoding="utf8", types=None):
+        """
+        The function that converts values of the column described by
+        C{row_format}, or None if they are to be left as bytes.
+
+        Text, and anything else in the text format that there isn't a
+        converter for, is decoded with C{encoding}. Binary values there isn't
+        a converter for are left alone.
+
+        Types the converter doesn't know are looked up in C{types}, a
+        L{sansiopg.introspection.TypeCache}, if given. Domains are converted
+        as their base types, enums are text, and arrays and composites of
+        them are converted like the built-in ones.
+        """
+        return self._decoder(
+            row_format.data_type, row_format.format_code, encoding, types
+        )
+
+    def _decoder(self, data_type, format_code, encoding, types=None):
+        conv = self._from_postgres.get((data_type, format_code))
+
+        if conv is _TEXT:
+            return _text_decoder(encoding)
+        elif conv is not None:
+            return conv
+
+        element_type = _ARRAY_ELEMENTS.get(data_type)
+        info = None
+
+        if types is not None and type(data_type) is int:
+            info = types.get(data_type)
+
+        if info is not None:
+            if info.kind == "d":
+                return self._decoder(
+                    _data_type(info.base), format_code, encoding, types
+                )
+            elif info.is_array:
+                element_type = _data_type(info.element)
+
+        is_record = data_type == DataType.RECORD or (
+            info is not None and info.kind == "c"
+        )
+
+        if format_code == FormatType.BINARY:
+            lookup = functools.lru_cache()(
+                lambda oid: self._decoder(
+                    _data_type(oid), FormatType.BINARY, encoding, types
+                )
+            )
+            if element_type is not None:
+                return arrays.binary_array_decoder(lookup, self.compact_arrays)
+            elif is_record:
+                return arrays.binary_record_decoder(lookup)
+            elif info is not None and info.kind == "e":
+                # The label, as in the text format.
+                return _text_decoder(encoding)
+            return None
+
+        if element_type is not None:
+            fixed = arrays._FIXED_WIDTH.get(getattr(element_type, "value", None))
+            return arrays.text_array_decoder(
+                self._decoder(element_type, format_code, encoding, types),
+                fixed[0] if fixed and self.compact_arrays else None,
+                b"," if info is None else info.delimiter.encode("ascii"),
+            )
+        elif is_record:
+            return arrays.text_record_decoder(_text_decoder(encoding))
+        elif info is not None and info.name == "hstore":
+            return _hstore_text_decoder(_text_decoder(encoding))
+
+        return _text_decoder(encoding)
+
+    def decoders(self, description, encoding="utf8", raw=(), types=None):
+        """
+        The decoders for each column of rows described by C{description}, as
+        from L{decoder_for}. Columns named in C{raw}, or all of them if it is
+        True, are left as bytes.
+        """
+        if raw is True:
+            return [None] * len(description)
+
+        res = []
+        name_encoding = python_encoding(encoding)
+
+        for row_format in description:
+            if raw and row_format.field_name.decode(name_encoding) in raw:
+                res.append(None)
+            else:
+                res.append(self.decoder_for(row_format, encoding, types))
+
+        return res
+
+    def from_postgres(self, value, row_format):
+        if value is None:
+            return None
+
+        conv = self.decoder_for(row_format)
+
+        if conv is None:
+            return value
+        return conv(value)
@@ -0,0 +1,77 @@
+class PostgresError(Exception):
+    """
+    The server sent an ErrorResponse.
+
+    The fields of the response are available as attributes, and the original
+    message as C{error}. Use L{PostgresError.from_error} to get the most
+    specific subclass for the error's SQLSTATE.
+    """
+
+    def __init__(self, error):
+        info = error.info
+        self.error = error
+        self.severity = error.severity
+        self.sqlstate = info.get("sqlstate")
+        self.message = info.get("message")
+        self.detail = info.get("detail")
+        self.hint = info.get("hint")
+        self.position = info.get("position")
+        self.where = info.get("where")
+        self.schema_name = info.get("schema_name")
+        self.table_name = info.get("table_name")
+        self.column_name = info.get("column_name")
+        self.data_type_name = info.get("data_type_name")
+        self.constraint_name = info.get("constraint_name")
+        super().__init__(self.severity, self.sqlstate, self.message)
+
+    def __str__(self):
+        return f"{self.severity}: {self.message} (SQLSTATE {self.sqlstate})"
+
+    @classmethod
+    def from_error(cls, error):
+        sqlstate = error.sqlstate or ""
+        klass = _SQLSTATES.get(sqlstate) or _SQLSTATE_CLASSES.get(sqlstate[:2], cls)
+        return klass(error)
+
+
+class IntegrityError(PostgresError):
+    """
+    SQLSTATE class 23, integrity constraint violation.
+    """
+
+
+class UniqueViolation(IntegrityError):
+    pass
+
+
+class ForeignKeyViolation(IntegrityError):
+    pass
+
+
+class TransactionRollbackError(PostgresError):
+    """
+    SQLSTATE class 40, the transaction was rolled back and may be retried.
+    """
+
+
+class SerializationFailure(TransactionRollbackError):
+    pass
+
+
+class DeadlockDetected(TransactionRollbackError):
+    pass
+
+
+class QueryCanceled(PostgresError):
+    pass
+
+
+_SQLSTATE_CLASSES = {"23": IntegrityError, "40": TransactionRollbackError}
+
+_SQLSTATES = {
+    "23503": ForeignKeyViolation,
+    "23505": UniqueViolation,
+    "40001": SerializationFailure,
+    "40P01": DeadlockDetected,
+    "57014": QueryCanceled,
+}
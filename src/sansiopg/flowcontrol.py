@@ -0,0 +1,50 @@
+import attr
+
+
+@attr.s
+class FlowControl(object):
+    """
+    Count the rows, and their bytes, that have been received but not yet
+    consumed.
+
+    C{received} says when reading from the server should pause, which is
+    when either count reaches its high watermark, and C{consumed} says when
+    it should resume, which is when both are back under their low
+    watermarks.
+
+    Only rows that have a consumer to wait for are counted: those of
+    L{CopyOut} and of C{copy_out} targets that return awaitables. The rows
+    of C{query} have no consumer until the query completes, so they aren't
+    held back by pausing; the C{memory_budget} spills them instead, and
+    C{iterate} bounds them by fetching in batches.
+    """
+
+    high_rows = attr.ib(default=10000)
+    low_rows = attr.ib(default=1000)
+    high_bytes = attr.ib(default=16 * 1024 * 1024)
+    low_bytes = attr.ib(default=1024 * 1024)
+    rows = attr.ib(default=0, init=False)
+    bytes = attr.ib(default=0, init=False)
+    paused = attr.ib(default=False, init=False)
+
+    def received(self, rows, size):
+        self.rows += rows
+        self.bytes += size
+
+        if not self.paused and (
+            self.rows >= self.high_rows or self.bytes >= self.high_bytes
+        ):
+            self.paused = True
+            return True
+
+        return False
+
+    def consumed(self, rows, size):
+        self.rows -= rows
+        self.bytes -= size
+
+        if self.paused and self.rows <= self.low_rows and self.bytes <= self.low_bytes:
+            self.paused = False
+            return True
+
+        return False
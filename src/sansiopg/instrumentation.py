@@ -0,0 +1,325 @@
+import math
+import time
+from collections import Counter, defaultdict, deque
+
+import attr
+
+# The phases of a query, by the states of PostgresConnection they happen
+# in. Time in an executing state after the first row has arrived is spent
+# fetching instead.
+_PHASES = {
+    "WAITING_FOR_PARSE": "parse",
+    "WAITING_FOR_DESCRIBE": "bind",
+    "WAITING_FOR_BIND": "bind",
+    "EXECUTING": "execute",
+    "SUSPENDED": "fetch",
+    "EXECUTING_SIMPLE_QUERY": "execute",
+    "PIPELINING": "execute",
+    "WAITING_FOR_COPY_OUT_RESPONSE": "execute",
+    "RECEIVING_COPY_DATA": "fetch",
+    "COPY_OUT_COMPLETE": "fetch",
+    "COMMAND_COMPLETE": "fetch",
+}
+
+# Each doubling of latency is split into this many histogram buckets, of
+# equal width, as in an HDR histogram. Every latency is within an eighth of
+# the bounds of its bucket.
+_SUB_BUCKETS = 8
+
+# Looked up once, since it is used for every latency recorded.
+_frexp = math.frexp
+
+
+@attr.s
+class QueryStats(object):
+    """
+    What happened on the wire for one query, from when it was sent until the
+    server was ready for the next one. Times are readings of the
+    instrumentation's clock.
+    """
+
+    query = attr.ib()
+    started = attr.ib()
+    params = attr.ib(default=None, repr=False)
+    first_byte = attr.ib(default=None)
+    first_row = attr.ib(default=None)
+    finished = attr.ib(default=None)
+    rows = attr.ib(default=0)
+    bytes_sent = attr.ib(default=0)
+    bytes_received = attr.ib(default=0)
+    messages = attr.ib(factory=Counter)
+    state_times = attr.ib(factory=lambda: defaultdict(float))
+    phases = attr.ib(factory=lambda: defaultdict(float))
+
+    @property
+    def time_to_first_byte(self):
+        if self.first_byte is not None:
+            return self.first_byte - self.started
+
+    @property
+    def time_to_first_row(self):
+        if self.first_row is not None:
+            return self.first_row - self.started
+
+    @property
+    def latency(self):
+        if self.finished is not None:
+            return self.finished - self.started
+
+
+def _bucket_limit(bucket):
+    """
+    The longest latency, in seconds, that goes in C{bucket}.
+    """
+    exponent, sub_bucket = divmod(bucket, _SUB_BUCKETS)
+    return (1 + (sub_bucket + 1) / _SUB_BUCKETS) * 2 ** (exponent - 1) / 1e6
+
+
+@attr.s
+class LatencyHistogram(object):
+    """
+    Counts of latencies, in buckets that grow exponentially like those of
+    an HDR histogram, so that it is as precise for a millisecond query as
+    for an hour-long one. Only the buckets in use take memory.
+    """
+
+    count = attr.ib(default=0)
+    total = attr.ib(default=0.0)
+    max = attr.ib(default=0.0)
+    _buckets = attr.ib(factory=dict, repr=False)
+
+    def record(self, seconds):
+        # Each doubling of microseconds is a power of two, split linearly by
+        # the mantissa.
+        micros = seconds * 1e6
+        if micros < 1:
+            bucket = 0
+        else:
+            mantissa, exponent = _frexp(micros)
+            bucket = (exponent - 1) * _SUB_BUCKETS + int(mantissa * 2 * _SUB_BUCKETS)
+
+        buckets = self._buckets
+        buckets[bucket] = buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        for bucket, count in other._buckets.items():
+            self._buckets[bucket] = self._buckets.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent):
+        """
+        The latency that C{percent} of those recorded were within, to the
+        precision of the buckets.
+        """
+        if not self.count:
+            return None
+
+        wanted = math.ceil(self.count * percent / 100)
+        seen = 0
+
+        for bucket in sorted(self._buckets):
+            seen += self._buckets[bucket]
+            if seen >= wanted:
+                return min(_bucket_limit(bucket), self.max)
+
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+@attr.s
+class StatementStats(object):
+    """
+    Latency histograms for each statement, keyed by its query text, of the
+    whole query and of each of its phases: parse, bind, execute (until the
+    first row) and fetch. Queries beyond the first C{max_statements} are
+    counted together, under C{OTHER}.
+
+    Queries that take C{slow_threshold} seconds or more are sampled, with
+    their parameters, into C{slow}, which keeps the most recent
+    C{slow_samples} of their L{QueryStats}.
+
+    Pass one to L{Instrumentation}, or to a pool to share between its
+    connections.
+    """
+
+    OTHER = "(other)"
+
+    max_statements = attr.ib(default=1000)
+    slow_threshold = attr.ib(default=None)
+    slow_samples = attr.ib(default=100)
+    slow = attr.ib(init=False)
+    _statements = attr.ib(factory=dict, init=False, repr=False)
+
+    @slow.default
+    def _slow_default(self):
+        return deque(maxlen=self.slow_samples)
+
+    def record(self, stats):
+        query = stats.query
+
+        if query is None:
+            # Connecting, which isn't a statement.
+            return
+
+        if type(query) is not str:
+            # A pipeline, which is timed as a whole.
+            query = "; ".join(query)
+
+        histograms = self._statements.get(query)
+
+        if histograms is None:
+            if len(self._statements) >= self.max_statements:
+                query = self.OTHER
+            histograms = self._statements.get(query)
+            if histograms is None:
+                histograms = self._statements[query] = {"total": LatencyHistogram()}
+
+        latency = stats.finished - stats.started
+        histograms["total"].record(latency)
+
+        for phase, spent in stats.phases.items():
+            histogram = histograms.get(phase)
+            if histogram is None:
+                histogram = histograms[phase] = LatencyHistogram()
+            histogram.record(spent)
+
+        if self.slow_threshold is not None and latency >= self.slow_threshold:
+            self.slow.append(stats)
+        else:
+            stats.params = None
+
+    @property
+    def keeps_params(self):
+        return self.slow_threshold is not None
+
+    def histograms(self, query):
+        """
+        The L{LatencyHistogram}s of C{query}, by phase, with the whole query
+        under C{"total"}.
+        """
+        return dict(self._statements.get(query, {}))
+
+    def snapshot(self):
+        """
+        The summaries of the histograms of every statement, by phase.
+        """
+        return {
+            query: {
+                phase: histogram.summary() for phase, histogram in histograms.items()
+            }
+            for query, histograms in self._statements.items()
+        }
+
+
+@attr.s
+class Instrumentation(object):
+    """
+    Collects L{QueryStats} for the queries of a connection, along with the
+    time spent in each state of its state machine.
+
+    Pass one to L{PostgresConnection} to turn it on; a connection without one
+    pays nothing more than an attribute check. Override L{on_query_complete}
+    to export the statistics somewhere, otherwise the most recent are kept
+    in C{recent}. Give it a L{StatementStats} as C{statements} to keep
+    latency histograms as well.
+    """
+
+    clock = attr.ib(default=time.perf_counter)
+    recent = attr.ib(factory=lambda: deque(maxlen=1000))
+    statements = attr.ib(default=None)
+    state_times = attr.ib(factory=lambda: defaultdict(float), init=False)
+    current = attr.ib(default=None, init=False)
+    _state = attr.ib(default=None, init=False)
+    _last_transition = attr.ib(default=None, init=False)
+
+    def on_query_complete(self, stats):
+        self.recent.append(stats)
+
+    def query_started(self, query, params=None):
+        if self.statements is None or not self.statements.keeps_params:
+            params = None
+        self.current = QueryStats(query=query, started=self.clock(), params=params)
+
+    def bytes_sent(self, count):
+        if self.current is not None:
+            self.current.bytes_sent += count
+
+    def bytes_received(self, count):
+        current = self.current
+
+        if current is not None:
+            if current.first_byte is None:
+                current.first_byte = self.clock()
+            current.bytes_received += count
+
+    def message_received(self, message):
+        current = self.current
+
+        if current is None:
+            return
+
+        name = message.__class__.__name__
+        current.messages[name] += 1
+
+        if name == "DataRow" or name == "CopyData":
+            if current.first_row is None:
+                current.first_row = self.clock()
+            current.rows += 1
+        elif name == "DataRowBatch" or name == "CopyDataBatch":
+            if current.first_row is None:
+                current.first_row = self.clock()
+            current.rows += len(message)
+        elif name == "DataRowChunk" or name == "CopyDataChunk":
+            if current.first_row is None:
+                current.first_row = self.clock()
+            if message.last:
+                current.rows += 1
+        elif name == "ReadyForQuery":
+            # The state we are leaving belongs to this query, but the
+            # transition out of it happens after we are done with it.
+            current.finished = self._account_state_time()
+            self.current = None
+            self.on_query_complete(current)
+            if self.statements is not None:
+                self.statements.record(current)
+
+    def state_changed(self, old_state, input, new_state):
+        self._account_state_time()
+        self._state = new_state
+
+    def _account_state_time(self):
+        now = self.clock()
+
+        if self._last_transition is not None:
+            spent = now - self._last_transition
+            self.state_times[self._state] += spent
+            current = self.current
+
+            if current is not None:
+                current.state_times[self._state] += spent
+                phase = _PHASES.get(self._state)
+
+                if phase == "execute" and current.first_row is not None:
+                    split = max(current.first_row, self._last_transition)
+                    current.phases["execute"] += split - self._last_transition
+                    current.phases["fetch"] += now - split
+                elif phase is not None:
+                    current.phases[phase] += spent
+
+        self._last_transition = now
+        return now
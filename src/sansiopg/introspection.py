@@ -0,0 +1,83 @@
+"""
+What we learn about types the converter doesn't know, such as enums,
+domains, and those from extensions, by looking them up in pg_type.
+"""
+
+import attr
+
+# Domains and arrays are looked up along with the types they are built on.
+# Everything is cast to a type the converter already knows, so that this
+# doesn't need looking up itself.
+TYPES_QUERY = """
+WITH RECURSIVE wanted(oid) AS (
+    SELECT unnest($1::oid[])
+  UNION
+    SELECT CASE WHEN t.typtype = 'd' THEN t.typbasetype ELSE t.typelem END
+    FROM pg_type t JOIN wanted ON t.oid = wanted.oid
+    WHERE t.typtype = 'd' OR t.typelem <> 0
+)
+SELECT t.oid, t.typname, t.typtype::text, t.typcategory::text, t.typbasetype,
+       t.typelem, t.typdelim::text
+FROM pg_type t JOIN wanted ON t.oid = wanted.oid
+"""
+
+
+@attr.s(frozen=True)
+class TypeInfo(object):
+    """
+    A row of pg_type. C{kind} is its C{typtype}, such as C{"b"} for base
+    types, C{"d"} for domains and C{"e"} for enums.
+    """
+
+    oid = attr.ib()
+    name = attr.ib()
+    kind = attr.ib()
+    category = attr.ib()
+    base = attr.ib()
+    element = attr.ib()
+    delimiter = attr.ib()
+
+    @property
+    def is_array(self):
+        return self.category == "A" and self.element != 0
+
+
+@attr.s
+class TypeCache(object):
+    """
+    The types looked up from one server, by OID.
+
+    Type OIDs are only the same between connections to the same server, so
+    connections to one can share a cache, and those to another can't.
+    """
+
+    _types = attr.ib(factory=dict, repr=False)
+    _missing = attr.ib(factory=set, repr=False)
+
+    def __len__(self):
+        return len(self._types)
+
+    def get(self, oid):
+        return self._types.get(oid)
+
+    def unknown(self, oids):
+        """
+        Those of C{oids} that haven't been looked up yet.
+        """
+        return {
+            oid for oid in oids if oid not in self._types and oid not in self._missing
+        }
+
+    def add(self, rows):
+        """
+        Add the rows of L{TYPES_QUERY}.
+        """
+        for row in rows:
+            self._types[row[0]] = TypeInfo(*row)
+
+    def looked_up(self, oids):
+        """
+        Note that C{oids} have been looked up, so that any that weren't found
+        aren't looked up over and over.
+        """
+        self._missing.update(oid for oid in oids if oid not in self._types)
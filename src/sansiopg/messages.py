@@ -1,3 +1,4 @@
+import array
 import enum
 import struct
 import re
@@ -6,6 +7,7 @@ from enum import Enum
 import attr
 
 _SPLIT_DELIMITER = re.compile(rb"(?<!\\)\t")
+_INT32 = struct.Struct("!i")
 
 
 class FormatType(Enum):
@@ -15,17 +17,50 @@ class FormatType(Enum):
 
 class DataType(Enum):
     BOOL = 16
+    BYTEA = 17
     NAME = 19
+    INT8 = 20
+    INT2 = 21
     INT4 = 23
     TEXT = 25
     OID = 26
+    FLOAT4 = 700
+    FLOAT8 = 701
     ABSTIME = 702
+    _BOOL = 1000
+    _BYTEA = 1001
+    _NAME = 1003
+    _INT2 = 1005
+    _INT4 = 1007
     _TEXT = 1009
+    _BPCHAR = 1014
+    _VARCHAR = 1015
+    _INT8 = 1016
+    _FLOAT4 = 1021
+    _FLOAT8 = 1022
+    _OID = 1028
+    BPCHAR = 1042
+    VARCHAR = 1043
+    RECORD = 2249
+    _RECORD = 2287
+
+
+_DATA_TYPES = {x.value: x for x in DataType}
+
+
+def _data_type(oid):
+    """
+    The L{DataType} for C{oid}, or C{oid} itself for types we don't know.
+    """
+    return _DATA_TYPES.get(oid, oid)
 
 
 class FrontendMessageType(Enum):
     BIND = b"B"
     CLOSE = b"C"
+    COPY_DATA = b"d"
+    COPY_DONE = b"c"
+    COPY_FAIL = b"f"
     DESCRIBE = b"D"
     EXECUTE = b"E"
     FLUSH = b"H"
@@ -62,9 +97,13 @@ class BackendMessageType(Enum):
     PARSE_COMPLETE = b"1"
     BIND_COMPLETE = b"2"
     CLOSE_COMPLETE = b"3"
+    COPY_IN_RESPONSE = b"G"
     COPY_OUT_RESPONSE = b"H"
     COPY_DONE = b"c"
     COPY_DATA = b"d"
+    EMPTY_QUERY_RESPONSE = b"I"
+    NOTIFICATION_RESPONSE = b"A"
+    PORTAL_SUSPENDED = b"s"
     UNKNOWN = None
 
     def _missing_(value):
@@ -96,6 +135,19 @@ class StartupMessage(object):
         return struct.pack("!i", len(msg) + 4) + msg
 
 
+@attr.s
+class CancelRequest(object):
+
+    process_id = attr.ib()
+    secret_key = attr.ib()
+    request_code = attr.ib(default=80877102)
+
+    def ser(self):
+        return struct.pack(
+            "!iiii", 16, self.request_code, self.process_id, self.secret_key
+        )
+
+
 @attr.s
 class ReadyForQuery(object):
     backend_status = attr.ib()
@@ -156,10 +208,15 @@ class Describe(object):
 
     _encoding = attr.ib()
     prepared_statement_name = attr.ib()
+    describe_type = attr.ib(default="S")
 
     def ser(self):
 
-        res = [b"S", self.prepared_statement_name.encode(self._encoding), b"\0"]
+        res = [
+            self.describe_type.encode(self._encoding),
+            self.prepared_statement_name.encode(self._encoding),
+            b"\0",
+        ]
 
         msg = b"".join(res)
         return (
@@ -192,17 +249,29 @@ class Bind(object):
         res.append(self.prepared_statement.encode(self._encoding))
         res.append(b"\0")
 
-        # No input format codes
-        res.append(struct.pack("!h", 0))
+        # All text unless told otherwise
+        if any(p.format_code for p in self.parameters):
+            res.append(struct.pack("!h", len(self.parameters)))
+            for p in self.parameters:
+                res.append(struct.pack("!h", p.format_code))
+        else:
+            res.append(struct.pack("!h", 0))
 
         res.append(struct.pack("!h", len(self.parameters)))
 
         for p in self.parameters:
-            res.append(struct.pack("!i", len(p.value)))
-            res.append(p.value)
-
-        # No result format codes
-        res.append(struct.pack("!h", 0))
+            if p.value is None:
+                res.append(struct.pack("!i", -1))
+            else:
+                res.append(struct.pack("!i", len(p.value)))
+                res.append(p.value)
+
+        if self.result_format_codes and any(self.result_format_codes):
+            codes = self.result_format_codes
+            res.append(struct.pack("!h", len(codes)))
+            res.append(struct.pack("!%dh" % (len(codes),), *codes))
+        else:
+            res.append(struct.pack("!h", 0))
 
         msg = b"".join(res)
         return FrontendMessageType.BIND.value + struct.pack("!i", len(msg) + 4) + msg
@@ -245,10 +314,22 @@ class NoData:
         return cls()
 
 
+@attr.s
+class PortalSuspended:
+    """
+    The Execute asked for no more rows than were sent, and the portal has
+    more, or might.
+    """
+
+    @classmethod
+    def deser(cls, buf, server_encoding):
+        return cls()
+
+
 @attr.s
 class IndividualRow(object):
     field_name = attr.ib()
-    data_type = attr.ib(converter=DataType)
+    data_type = attr.ib(converter=_data_type)
     type_modifier = attr.ib()
     format_code = attr.ib(converter=FormatType)
 
@@ -301,7 +382,7 @@ class ParameterDescription:
     @classmethod
     def deser(cls, buf, server_encoding):
         (parameter_count,) = struct.unpack("!h", buf[5:7])
-        ids = struct.unpack("!" + "i" * parameter_count, buf[7:])
+        ids = struct.unpack("!" + "I" * parameter_count, buf[7:])
         return cls(object_ids=ids)
 
 
@@ -312,19 +393,70 @@ class DataRow(object):
 
     @classmethod
     def deser(cls, buf, server_encoding):
+        return cls(values=_data_row_values(buf, 0))
 
-        (col_values,) = struct.unpack("!h", buf[5:7])
-        content = buf[7:]
 
-        vals = []
+def _data_row_values(buf, start):
+    """
+    The values of the DataRow at C{start} in C{buf}.
+    """
+    (col_values,) = struct.unpack_from("!h", buf, start + 5)
+    offset = start + 7
 
-        for x in range(col_values):
-            (length_of_next,) = struct.unpack("!i", content[0:4])
-            col_val = content[4 : length_of_next + 4]
-            vals.append(col_val)
-            content = content[length_of_next + 4 :]
+    vals = []
 
-        return cls(values=tuple(vals))
+    for x in range(col_values):
+        (length_of_next,) = struct.unpack_from("!i", buf, offset)
+        offset += 4
+        if length_of_next == -1:
+            vals.append(None)
+            continue
+        vals.append(buf[offset : offset + length_of_next])
+        offset += length_of_next
+
+    return tuple(vals)
+
+
+@attr.s
+class DataRowBatch(object):
+    """
+    DataRows that arrived together, from L{ParserFeed}'s batching mode,
+    left unparsed: C{data} is their bytes, one after the other, and
+    C{offsets} an L{array.array} of where each one starts.
+    """
+
+    data = attr.ib(repr=False)
+    offsets = attr.ib(repr=False)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def rows(self):
+        data = self.data
+        return [_data_row_values(data, offset) for offset in self.offsets]
+
+
+@attr.s
+class DataRowChunk(object):
+    """
+    Part of a DataRow too large to buffer whole, from L{ParserFeed}'s
+    streaming mode. Each column arrives as one or more chunks, the last of
+    them C{final}; a NULL is a single final chunk with C{data} of None.
+    C{length} is the size of the whole value, or -1 for a NULL.
+    """
+
+    column = attr.ib()
+    columns = attr.ib()
+    length = attr.ib()
+    data = attr.ib()
+    final = attr.ib()
+
+    @property
+    def last(self):
+        """
+        Whether this chunk ends the row.
+        """
+        return self.final and self.column == self.columns - 1
 
 
 @attr.s
@@ -355,6 +487,25 @@ class ParameterStatus(object):
         return cls(name=key, val=val)
 
 
+@attr.s
+class NotificationResponse(object):
+
+    process_id = attr.ib()
+    channel = attr.ib()
+    payload = attr.ib()
+
+    @classmethod
+    def deser(cls, buf, server_encoding):
+        (process_id,) = struct.unpack("!i", buf[5:9])
+        channel, payload = buf[9:-1].split(b"\0")
+
+        return cls(
+            process_id=process_id,
+            channel=channel.decode(server_encoding),
+            payload=payload.decode(server_encoding),
+        )
+
+
 @attr.s
 class BackendKeyData(object):
 
@@ -367,59 +518,104 @@ class BackendKeyData(object):
         return cls(process_id=proc_id, secret_key=secret_key)
 
 
+# Field type codes of ErrorResponse and NoticeResponse, and what we call them.
+_ERROR_FIELD_NAMES = {
+    b"S": "severity",
+    b"V": "severity_nonlocalized",
+    b"C": "sqlstate",
+    b"M": "message",
+    b"D": "detail",
+    b"H": "hint",
+    b"P": "position",
+    b"p": "internal_position",
+    b"q": "internal_query",
+    b"W": "where",
+    b"s": "schema_name",
+    b"t": "table_name",
+    b"c": "column_name",
+    b"d": "data_type_name",
+    b"n": "constraint_name",
+    b"F": "file",
+    b"L": "line",
+    b"R": "routine",
+}
+
+
 @attr.s
 class ErrorField(object):
     error_type = attr.ib()
     error_text = attr.ib()
 
+    @property
+    def name(self):
+        return _ERROR_FIELD_NAMES.get(self.error_type, self.error_type.decode("ascii"))
 
-@attr.s
-class Error(object):
-    fields = attr.ib()
 
-    @classmethod
-    def deser(cls, buf, server_encoding):
+def _deser_error_fields(buf):
 
-        fields = []
-        content = buf[5:]
+    fields = []
+    content = buf[5:]
 
-        while content:
+    while content:
 
-            field_type = content[0:1]
+        field_type = content[0:1]
 
-            if field_type == b"\0":
-                break
+        if field_type == b"\0":
+            break
 
-            msg, content = content[1:].split(b"\0", 1)
+        msg, content = content[1:].split(b"\0", 1)
 
-            fields.append(ErrorField(error_type=field_type, error_text=msg))
+        fields.append(ErrorField(error_type=field_type, error_text=msg))
 
-        return cls(fields=fields)
+    return fields
 
 
 @attr.s
-class Notice(object):
-
+class Error(object):
     fields = attr.ib()
+    _server_encoding = attr.ib(default="utf8", repr=False)
+
+    @property
+    def info(self):
+        """
+        The fields of the error, keyed by name, as text.
+        """
+        return {
+            field.name: field.error_text.decode(self._server_encoding, "replace")
+            for field in self.fields
+        }
+
+    @property
+    def sqlstate(self):
+        return self.info.get("sqlstate")
+
+    @property
+    def severity(self):
+        info = self.info
+        return info.get("severity_nonlocalized", info.get("severity"))
+
+    @property
+    def message(self):
+        return self.info.get("message")
 
     @classmethod
     def deser(cls, buf, server_encoding):
+        return cls(fields=_deser_error_fields(buf), server_encoding=server_encoding)
 
-        fields = []
-        content = buf[5:]
 
-        while content:
-
-            field_type = content[0:1]
-
-            if field_type == b"\0":
-                break
+@attr.s
+class Notice(object):
 
-            msg, content = content[1:].split(b"\0", 1)
+    fields = attr.ib()
+    _server_encoding = attr.ib(default="utf8", repr=False)
 
-            fields.append(ErrorField(error_type=field_type, error_text=msg))
+    info = Error.info
+    severity = Error.severity
+    message = Error.message
 
-        return cls(fields=fields)
+    @classmethod
+    def deser(cls, buf, server_encoding):
+        return cls(fields=_deser_error_fields(buf), server_encoding=server_encoding)
 
 
 @attr.s
@@ -477,8 +673,20 @@ class CopyOutResponse:
         )
 
 
+@attr.s
+class CopyInResponse(CopyOutResponse):
+    """
+    The server is ready for the rows of a COPY FROM STDIN.
+    """
+
+
 @attr.s
 class CopyData:
+    """
+    From the server, C{data} is the fields of one row of a text COPY. To the
+    server, it is any amount of the raw COPY stream.
+    """
+
     data = attr.ib()
 
     @classmethod
@@ -489,6 +697,74 @@ class CopyData:
 
         return cls(data=sep)
 
+    def ser(self):
+        return (
+            FrontendMessageType.COPY_DATA.value
+            + struct.pack("!i", len(self.data) + 4)
+            + self.data
+        )
+
+
+@attr.s
+class CopyDataBatch(object):
+    """
+    CopyDatas that arrived together, from L{ParserFeed}'s batching mode,
+    left unparsed: C{data} is their bytes, one after the other, and
+    C{offsets} an L{array.array} of where each one starts.
+    """
+
+    data = attr.ib(repr=False)
+    offsets = attr.ib(repr=False)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @classmethod
+    def join(cls, batches):
+        data = []
+        offsets = array.array("q")
+        length = 0
+
+        for batch in batches:
+            offsets.extend(offset + length for offset in batch.offsets)
+            data.append(batch.data)
+            length += len(batch.data)
+
+        return cls(b"".join(data), offsets)
+
+    def lines(self):
+        """
+        The raw COPY stream of each row, newline and all.
+        """
+        data = self.data
+        unpack_from = _INT32.unpack_from
+        return [
+            data[offset + 5 : offset + 1 + unpack_from(data, offset + 1)[0]]
+            for offset in self.offsets
+        ]
+
+    def rows(self):
+        """
+        The fields of each row, as the C{data} of a L{CopyData}.
+        """
+        split = _SPLIT_DELIMITER.split
+        return [split(line[:-1]) for line in self.lines()]
+
+
+@attr.s
+class CopyDataChunk:
+    """
+    Part of a CopyData too large to buffer whole, from L{ParserFeed}'s
+    streaming mode. Unlike L{CopyData}, C{data} is the raw bytes.
+    """
+
+    data = attr.ib()
+    final = attr.ib()
+
+    @property
+    def last(self):
+        return self.final
+
 
 @attr.s
 class CopyDone:
@@ -496,6 +772,34 @@ class CopyDone:
     def deser(cls, buf, server_encoding):
         return cls()
 
+    def ser(self):
+        return FrontendMessageType.COPY_DONE.value + struct.pack("!i", 4)
+
+
+@attr.s
+class CopyFail(object):
+    """
+    Abandon a COPY FROM STDIN, which the server fails with C{message}.
+    """
+
+    _encoding = attr.ib()
+    message = attr.ib()
+
+    def ser(self):
+        encoded = self.message.encode(self._encoding) + b"\0"
+        return (
+            FrontendMessageType.COPY_FAIL.value
+            + struct.pack("!i", len(encoded) + 4)
+            + encoded
+        )
+
+
+@attr.s
+class EmptyQueryResponse:
+    @classmethod
+    def deser(cls, buf, server_encoding):
+        return cls()
+
 
 @attr.s
 class Unknown(object):
@@ -525,17 +829,91 @@ class PasswordMessage(object):
         )
 
 
+@attr.s
+class SaslInitialResponse(object):
+
+    mechanism = attr.ib()
+    data = attr.ib()
+
+    def ser(self):
+        content = (
+            self.mechanism.encode("ascii")
+            + b"\0"
+            + struct.pack("!i", len(self.data))
+            + self.data
+        )
+        return (
+            FrontendMessageType.PASSWORD_MESSAGE.value
+            + struct.pack("!i", len(content) + 4)
+            + content
+        )
+
+
+@attr.s
+class SaslResponse(object):
+
+    data = attr.ib()
+
+    def ser(self):
+        return (
+            FrontendMessageType.PASSWORD_MESSAGE.value
+            + struct.pack("!i", len(self.data) + 4)
+            + self.data
+        )
+
+
 @attr.s
 class AuthenticationOk(object):
-    pass
+    @classmethod
+    def deser(cls, content):
+        return cls()
 
 
 @attr.s
 class AuthenticationCleartextPassword(object):
-    pass
+    @classmethod
+    def deser(cls, content):
+        return cls()
+
+
+@attr.s
+class AuthenticationSasl(object):
+
+    mechanisms = attr.ib()
+
+    @classmethod
+    def deser(cls, content):
+        names = content.split(b"\0")
+        return cls(mechanisms=[x.decode("ascii") for x in names if x])
+
+
+@attr.s
+class AuthenticationSaslContinue(object):
+
+    data = attr.ib()
+
+    @classmethod
+    def deser(cls, content):
+        return cls(data=content)
 
 
-AuthenticationRequestTypes = {0: AuthenticationOk, 3: AuthenticationCleartextPassword}
+@attr.s
+class AuthenticationSaslFinal(object):
+
+    data = attr.ib()
+
+    @classmethod
+    def deser(cls, content):
+        return cls(data=content)
+
+
+AuthenticationRequestTypes = {
+    0: AuthenticationOk,
+    3: AuthenticationCleartextPassword,
+    10: AuthenticationSasl,
+    11: AuthenticationSaslContinue,
+    12: AuthenticationSaslFinal,
+}
 
 
 @attr.s
@@ -545,9 +923,11 @@ class AuthenticationRequest(object):
         (typ,) = struct.unpack("!i", buf[5:9])
 
         try:
-            return AuthenticationRequestTypes[typ]()
-        except ValueError:
-            return Unknown.deser(buf)
+            request = AuthenticationRequestTypes[typ]
+        except KeyError:
+            return Unknown.deser(buf, server_encoding)
+
+        return request.deser(buf[9:])
 
 
 class Parser(Enum):
@@ -566,9 +946,13 @@ class Parser(Enum):
     PARSE_COMPLETE = ParseComplete
     BIND_COMPLETE = BindComplete
     NO_DATA = NoData
+    COPY_IN_RESPONSE = CopyInResponse
     COPY_OUT_RESPONSE = CopyOutResponse
     COPY_DATA = CopyData
     COPY_DONE = CopyDone
+    EMPTY_QUERY_RESPONSE = EmptyQueryResponse
+    NOTIFICATION_RESPONSE = NotificationResponse
+    PORTAL_SUSPENDED = PortalSuspended
     UNKNOWN = Unknown
 
 
@@ -0,0 +1,100 @@
+"""
+Decoding large results in other processes.
+
+With a C{decode_pool}, a L{PostgresConnection} has its DataRows handed to it
+unparsed, in L{DataRowBatch}es, and sends them to the pool to be split up
+and decoded by L{decode_batch}. Only the bytes, the offsets of the rows and
+a L{DecodeSpec} go to the workers, which build the column decoders for each
+spec once and keep them.
+"""
+
+import array
+
+import attr
+
+from .conversion import decode_columns
+from .messages import DataRowBatch
+
+# About how many bytes of rows each worker is given at a time. Batches are
+# only as big as what the server sent in one go, which is often too little
+# to be worth sending to another process.
+TASK_SIZE = 1024 * 1024
+
+# The decoders built in this process, by DecodeSpec key, up to a point.
+_decoders = {}
+_MAX_DECODERS = 256
+
+
+@attr.s(frozen=True)
+class DecodeSpec(object):
+    """
+    Everything a worker needs to build the decoders for a result. C{key} is
+    the same for any two that give the same decoders.
+    """
+
+    key = attr.ib()
+    converter = attr.ib()
+    description = attr.ib()
+    encoding = attr.ib()
+    raw = attr.ib()
+    types = attr.ib()
+
+    @classmethod
+    def of(cls, converter, description, encoding, raw, types):
+        key = (
+            type(converter),
+            getattr(converter, "compact_arrays", False),
+            tuple(
+                (row.field_name, row.data_type, row.format_code) for row in description
+            ),
+            encoding,
+            raw if raw is True else tuple(raw),
+            len(types) if types is not None else None,
+        )
+        return cls(key, converter, description, encoding, raw, types)
+
+    def decoders(self):
+        decoders = _decoders.get(self.key)
+
+        if decoders is None:
+            if len(_decoders) >= _MAX_DECODERS:
+                _decoders.clear()
+            decoders = _decoders[self.key] = self.converter.decoders(
+                self.description, self.encoding, self.raw, self.types
+            )
+
+        return decoders
+
+
+def tasks(batches, size=TASK_SIZE):
+    """
+    Join L{DataRowBatch}es into pieces of work of about C{size} bytes, each
+    the bytes of its rows and their offsets.
+    """
+    data = []
+    offsets = array.array("q")
+    length = 0
+
+    for batch in batches:
+        offsets.extend(offset + length for offset in batch.offsets)
+        data.append(batch.data)
+        length += len(batch.data)
+
+        if length >= size:
+            yield b"".join(data), offsets
+            data = []
+            offsets = array.array("q")
+            length = 0
+
+    if data:
+        yield b"".join(data), offsets
+
+
+def decode_batch(spec, data, offsets):
+    """
+    Split up and decode the DataRows at C{offsets} in C{data}, returning how
+    many there are and the decoded columns.
+    """
+    rows = DataRowBatch(data, offsets).rows()
+    columns = decode_columns(rows, spec.decoders())
+    return len(rows), [list(column) for column in columns]
@@ -1,37 +1,227 @@
+import array
 import struct
 
 import attr
 
-from .messages import parse_from_buffer
+from .messages import (
+    CopyDataBatch,
+    CopyDataChunk,
+    DataRowBatch,
+    DataRowChunk,
+    parse_from_buffer,
+)
+
+_INT16 = struct.Struct("!h")
+_INT32 = struct.Struct("!i")
+
+# DataRow and CopyData are the only messages that carry user data, and so
+# the only ones that can be too big to buffer.
+_STREAMABLE = (b"D", b"d")
 
 
 @attr.s
 class ParserFeed(object):
+    """
+    Split what the server sends into messages.
+
+    If C{stream_threshold} is set, DataRows and CopyDatas longer than that
+    are not buffered whole but handed out as L{DataRowChunk}s and
+    L{CopyDataChunk}s as their bytes arrive, so that large values can be
+    moved in constant memory.
+
+    If C{batch_rows} is set, DataRows that arrive together are handed out
+    unparsed, as L{DataRowBatch}es, for parsing somewhere else. Likewise,
+    if C{batch_copy} is set, CopyDatas are handed out as L{CopyDataBatch}es.
+    """
 
     _server_encoding = attr.ib()
-    _buffer = attr.ib(default=b"", init=False)
+    stream_threshold = attr.ib(default=None)
+    batch_rows = attr.ib(default=False)
+    batch_copy = attr.ib(default=False)
+    _buffer = attr.ib(factory=bytearray, init=False, repr=False)
+    _offset = attr.ib(default=0, init=False, repr=False)
+    _wanted = attr.ib(default=5, init=False, repr=False)
+
+    # The message being streamed, if any.
+    _streaming = attr.ib(default=None, init=False, repr=False)
+    _remaining = attr.ib(default=0, init=False, repr=False)
+    _columns = attr.ib(default=None, init=False, repr=False)
+    _column = attr.ib(default=0, init=False, repr=False)
+    _column_length = attr.ib(default=None, init=False, repr=False)
+    _column_remaining = attr.ib(default=None, init=False, repr=False)
 
     def feed(self, input):
 
         self._buffer += input
 
+        if self._streaming is None and len(self._buffer) - self._offset < self._wanted:
+            # Still waiting for the rest of a message.
+            return []
+
         messages = []
 
-        while True:
-            if len(self._buffer) < 5:
-                # We can't even get the message, so, return
-                return messages
+        with memoryview(self._buffer) as view:
+            while self._next(view, messages):
+                pass
+
+        # Drop what has been parsed. Whatever is left is at most part of one
+        # message, so this doesn't copy the buffer over and over.
+        if self._offset:
+            del self._buffer[: self._offset]
+            self._offset = 0
+
+        return messages
+
+    def _next(self, view, messages):
+        """
+        Parse the next message, or the next part of one that is being
+        streamed, into C{messages}. Returns False if more bytes are needed.
+        """
+        if self._streaming == b"D":
+            return self._next_data_row_chunk(view, messages)
+        elif self._streaming == b"d":
+            return self._next_copy_data_chunk(view, messages)
+
+        available = len(view) - self._offset
+
+        if available < 5:
+            # We can't even get the message, so, return
+            self._wanted = 5
+            return False
+
+        # Get the length of the message
+        (msg_len,) = _INT32.unpack_from(view, self._offset + 1)
+        type_code = bytes(view[self._offset : self._offset + 1])
+
+        if (
+            self.stream_threshold is not None
+            and msg_len + 1 > self.stream_threshold
+            and type_code in _STREAMABLE
+        ):
+            self._streaming = type_code
+            self._remaining = msg_len - 4
+            self._columns = None
+            self._offset += 5
+            return True
+
+        # Check if we have the whole message
+        if available < msg_len + 1:
+            self._wanted = msg_len + 1
+            return False
+
+        if self.batch_rows and type_code == b"D":
+            return self._next_batch(view, messages, DataRowBatch)
+        elif self.batch_copy and type_code == b"d":
+            return self._next_batch(view, messages, CopyDataBatch)
+
+        # If we do, split it up
+        msg = bytes(view[self._offset : self._offset + msg_len + 1])
+        self._offset += msg_len + 1
+        self._wanted = 5
+
+        messages.append(parse_from_buffer(msg, self._server_encoding))
+        return True
+
+    def _next_batch(self, view, messages, batch_type):
+        start = offset = self._offset
+        end = len(view)
+        offsets = array.array("q")
+        type_code = view[offset]
+
+        # Take every whole message of this type from here on that isn't to
+        # be streamed.
+        while end - offset >= 5 and view[offset] == type_code:
+            (msg_len,) = _INT32.unpack_from(view, offset + 1)
+            if end - offset < msg_len + 1:
+                break
+            if (
+                self.stream_threshold is not None
+                and msg_len + 1 > self.stream_threshold
+            ):
+                break
+            offsets.append(offset - start)
+            offset += msg_len + 1
+
+        messages.append(batch_type(bytes(view[start:offset]), offsets))
+        self._offset = offset
+        self._wanted = 5
+        return True
+
+    def _take(self, view, size):
+        data = bytes(view[self._offset : self._offset + size])
+        self._offset += size
+        self._remaining -= size
+        return data
+
+    def _next_copy_data_chunk(self, view, messages):
+        size = min(len(view) - self._offset, self._remaining)
+
+        if not size:
+            return False
+
+        data = self._take(view, size)
+
+        if not self._remaining:
+            self._streaming = None
+
+        messages.append(CopyDataChunk(data, not self._remaining))
+        return True
+
+    def _next_data_row_chunk(self, view, messages):
+        available = len(view) - self._offset
+
+        if self._columns is None:
+            if available < 2:
+                return False
+            (self._columns,) = _INT16.unpack(self._take(view, 2))
+            self._column = 0
+            self._column_remaining = None
+            if not self._columns:
+                self._streaming = None
+            return True
+
+        if self._column_remaining is None:
+            if available < 4:
+                return False
+
+            (length,) = _INT32.unpack(self._take(view, 4))
+            self._column_length = length
+
+            if length == -1:
+                # NULL
+                self._end_column(messages, None)
+            elif length == 0:
+                self._end_column(messages, b"")
+            else:
+                self._column_remaining = length
+
+            return True
+
+        size = min(available, self._column_remaining)
+
+        if not size:
+            return False
+
+        data = self._take(view, size)
+        self._column_remaining -= size
 
-            # Get the length of the message
-            (msg_len,) = struct.unpack("!i", self._buffer[1:5])
+        if self._column_remaining:
+            messages.append(
+                DataRowChunk(
+                    self._column, self._columns, self._column_length, data, False
+                )
+            )
+        else:
+            self._end_column(messages, data)
 
-            # Check if we have the whole message
-            if len(self._buffer) < msg_len + 1:
-                print("Dont have for", self._buffer)
-                return messages
+        return True
 
-            # If we do, split it up
-            msg = self._buffer[0 : msg_len + 1]
-            self._buffer = self._buffer[msg_len + 1 :]
+    def _end_column(self, messages, data):
+        messages.append(
+            DataRowChunk(self._column, self._columns, self._column_length, data, True)
+        )
+        self._column += 1
+        self._column_remaining = None
 
-            messages.append(parse_from_buffer(msg, self._server_encoding))
+        if self._column == self._columns:
+            self._streaming = None
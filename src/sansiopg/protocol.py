@@ -1,34 +1,94 @@
+import array
+import functools
+import itertools
+import logging
 import re
-from collections import namedtuple
+from collections import deque, namedtuple
 
 import attr
 from automat import MethodicalMachine
 
-from .conversion import Converter
-from .messages import Notice, Error
+from .conversion import Converter, decode_columns, python_encoding
+from .errors import PostgresError
+from .flowcontrol import FlowControl
+from .messages import (
+    BackendTransactionStatus,
+    CopyData,
+    CopyDataBatch,
+    CopyDataChunk,
+    DataRowBatch,
+    Error,
+    Notice,
+    NotificationResponse,
+    ParameterStatus,
+    ReadyForQuery,
+)
+
+_log = logging.getLogger(__name__)
+
+# The temporary table that bulk_upsert copies into.
+_STAGING = "_sansiopg_upsert"
+
+# The server hangs up after errors of these severities, rather than sending
+# ReadyForQuery.
+_FATAL_SEVERITIES = ("FATAL", "PANIC")
+
+# The modules of features that not every connection uses, like SCRAM and
+# spilling, are imported where they are first needed, to keep importing this
+# one cheap.
+
+
+def _new_type_cache():
+    from .introspection import TypeCache
+
+    return TypeCache()
+
+
+def _as_budget(value):
+    if value is None:
+        return None
+
+    from .spill import as_budget
+
+    return as_budget(value)
+
 
 _convert_to_underscores_lmao = re.compile(r"(?<!^)(?=[A-Z])")
 
 
-def _get_last_collector(results):
+@functools.lru_cache(maxsize=256)
+def _result_type(names):
+    return namedtuple("Result", names)
 
-    try:
-        from twisted.internet.defer import Deferred, DeferredList
-    except ImportError:
-        Deferred = None
 
-    results = list(results)
+@functools.lru_cache(maxsize=None)
+def _input_name(message_type):
+    """
+    The name of the input that messages of C{message_type} are fed to.
+    """
+    name = _convert_to_underscores_lmao.sub("_", message_type.__name__)
+    return "_REMOTE_" + name.upper()
 
-    if Deferred in map(type, results):
-        for res in results:
-            if not isinstance(res, Deferred):
-                results.remove(res)
 
-        r = DeferredList(list(results), fireOnOneErrback=True, consumeErrors=True)
-        r.addCallback(lambda res: res[-1][-1])
-        return r
+def _collect_futures(results):
+    """
+    The futures returned by the outputs of a transition, which
+    L{PostgresConnection._last_result} makes into one.
+    """
+    return [res for res in results if res is not None]
 
-    return results
+
+@attr.s
+class _Undecoded(object):
+    """
+    Rows that can't be decoded until the types in C{oids} are looked up, or
+    that are to be decoded in a pool, in which case C{decode} returns a
+    future.
+    """
+
+    oids = attr.ib()
+    decode = attr.ib()
+    pooled = attr.ib(default=False)
 
 
 @attr.s
@@ -56,6 +116,395 @@ class Transaction:
             await self.rollback()
 
 
+@attr.s
+class _PipelinedStatement:
+
+    query = attr.ib()
+    vals = attr.ib()
+    future = attr.ib(default=None)
+    bind_vals = attr.ib(default=None, init=False)
+
+
+@attr.s
+class PipelinedTransaction:
+    """
+    A transaction whose statements are buffered, and then sent along with the
+    BEGIN and COMMIT in a single flight when it is committed.
+
+    The futures returned by C{query} and C{execute} fire once the transaction
+    has been sent and their statement has completed. If any statement fails,
+    the transaction is rolled back and every outstanding future, as well as
+    the one returned by C{commit}, fails with the error.
+    """
+
+    _conn = attr.ib()
+    _statements = attr.ib(factory=list, init=False)
+
+    def query(self, query, vals=[]):
+        future = self._conn._io_impl.make_callback()
+        self._statements.append(_PipelinedStatement(query, vals, future))
+        return future
+
+    def execute(self, command, args=[]):
+        d = self.query(command, args)
+        self._conn._io_impl.add_callback(d, lambda x: None)
+        return d
+
+    def commit(self):
+        statements = (
+            [_PipelinedStatement("BEGIN", [])]
+            + self._statements
+            + [_PipelinedStatement("COMMIT", [])]
+        )
+        self._statements = []
+        return self._conn._run_pipeline(statements)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if tb is None:
+            await self.commit()
+        else:
+            # Nothing has been sent yet, so there is nothing to roll back,
+            # but anything waiting on a statement needs to hear why it won't
+            # run.
+            statements, self._statements = self._statements, []
+            for statement in statements:
+                self._conn._io_impl.fail_callback(statement.future, exc)
+
+
+def _row_size(row):
+    """
+    How many bytes of values a buffered row holds.
+    """
+    if type(row) is DataRowBatch:
+        return len(row.data)
+    return sum(len(value) for value in row if type(value) is bytes)
+
+
+def _copy_size(message):
+    """
+    How many rows, and how many bytes, a message from a COPY OUT holds.
+    """
+    if type(message) is CopyDataChunk:
+        return int(message.final), len(message.data)
+    return len(message), len(message.data)
+
+
+@attr.s
+class CopyOut(object):
+    """
+    The rows of a COPY OUT, as an async iterator of L{CopyDataBatch}es. Each
+    is sliced from what the server sent and holds at least C{batch_rows}
+    rows or C{batch_bytes} bytes, apart from the last. Rows longer than the
+    connection's C{stream_threshold} come as L{CopyDataChunk}s instead.
+
+    Rows count as unconsumed (see L{FlowControl}) until they are yielded, so
+    reading from the server pauses while the consumer is behind. A consumer
+    that stops early must L{close} this, or leave an C{async with} block.
+    """
+
+    _conn = attr.ib()
+    batch_rows = attr.ib(default=1000)
+    batch_bytes = attr.ib(default=256 * 1024)
+    _done = attr.ib(default=None, init=False, repr=False)
+    _pending = attr.ib(factory=deque, init=False, repr=False)
+    _rows = attr.ib(default=0, init=False)
+    _bytes = attr.ib(default=0, init=False)
+    _waiter = attr.ib(default=None, init=False, repr=False)
+    _finished = attr.ib(default=False, init=False)
+    _closed = attr.ib(default=False, init=False)
+
+    def _start(self, table, query):
+        conn = self._conn
+        self._done = conn._last_result(conn._copy_out(self, table, query))
+        conn._io_impl.add_both(self._done, self._finish)
+
+    def _finish(self, result):
+        self._finished = True
+        # The consumer may await the COPY's future next, which can't be done
+        # from within its own callbacks.
+        self._conn._io_impl.call_later(0, self._wake)
+        return result
+
+    def _wake(self):
+        waiter, self._waiter = self._waiter, None
+        if waiter is not None:
+            self._conn._io_impl.trigger_callback(waiter, None)
+
+    def __call__(self, message):
+        if self._closed:
+            return
+
+        if type(message) is CopyData:
+            # From a parser that isn't batching.
+            line = b"\t".join(message.data) + b"\n"
+            message = CopyDataBatch(CopyData(line).ser(), array.array("q", [0]))
+
+        rows, size = _copy_size(message)
+        self._pending.append(message)
+        self._rows += rows
+        self._bytes += size
+        self._conn._rows_buffered(rows, size)
+
+        if self._waiter is not None and self._ready():
+            self._wake()
+
+    def _ready(self):
+        if not self._pending:
+            return False
+        return (
+            type(self._pending[0]) is CopyDataChunk
+            or self._rows >= self.batch_rows
+            or self._bytes >= self.batch_bytes
+            or self._finished
+            # Nothing more is coming until some rows are consumed.
+            or self._conn.flow_control.paused
+        )
+
+    def _take(self):
+        pending = self._pending
+
+        if type(pending[0]) is CopyDataChunk:
+            taken = pending.popleft()
+        else:
+            batches = []
+            while pending and type(pending[0]) is CopyDataBatch:
+                batches.append(pending.popleft())
+            taken = batches[0] if len(batches) == 1 else CopyDataBatch.join(batches)
+
+        rows, size = _copy_size(taken)
+        self._rows -= rows
+        self._bytes -= size
+        self._conn._rows_consumed(rows, size)
+        return taken
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not (self._finished or self._closed or self._ready()):
+            self._waiter = self._conn._io_impl.make_callback()
+            await self._waiter
+
+        if self._pending:
+            return self._take()
+
+        done, self._done = self._done, None
+        if done is not None:
+            # Raises the error, if the COPY failed.
+            await done
+
+        raise StopAsyncIteration
+
+    def close(self):
+        """
+        Stop iterating, dropping the rows that haven't been yielded. The
+        returned future fires once the COPY is over.
+        """
+        self._closed = True
+        self._pending.clear()
+        self._conn._rows_consumed(self._rows, self._bytes)
+        self._rows = self._bytes = 0
+        self._wake()
+
+        done, self._done = self._done, None
+        if done is None:
+            return self._conn.succeeded(None)
+        return done
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+@attr.s
+class Cursor(object):
+    """
+    The rows of a query, as an async iterator, fetched from a portal on the
+    server C{batch} rows at a time. While one batch is consumed, the next
+    C{prefetch} are fetched, and no more, so that only a few are held at
+    once however many rows there are.
+
+    The query is prepared first, so that the types of its columns can be
+    looked up before the portal is opened. The portal lives in the
+    transaction that is open, or if none is, in that of the extended query,
+    which is not synced until the portal is done; either way, nothing else
+    can be run on the connection until then. A consumer that stops early
+    must L{close} this, or leave an C{async with} block, which closes the
+    portal.
+    """
+
+    _conn = attr.ib()
+    _query = attr.ib()
+    _vals = attr.ib()
+    _raw = attr.ib(default=())
+    batch = attr.ib(default=1000)
+    prefetch = attr.ib(default=1)
+    _done = attr.ib(default=None, init=False, repr=False)
+    _pending = attr.ib(factory=deque, init=False, repr=False)
+    _rows = attr.ib(factory=lambda: iter(()), init=False, repr=False)
+    _waiter = attr.ib(default=None, init=False, repr=False)
+    _opened = attr.ib(default=False, init=False)
+    _received = attr.ib(default=False, init=False)
+    _suspended = attr.ib(default=False, init=False)
+    _finished = attr.ib(default=False, init=False)
+    _closed = attr.ib(default=False, init=False)
+
+    async def _open(self):
+        conn = self._conn
+        query = self._query
+        registry = conn.registry
+        hot = registry is not None and registry.used(query)
+        keep = query in conn._prepared
+
+        if not keep:
+            await conn.prepare([query])
+            keep = hot and len(conn._prepared) <= registry.max_statements
+
+        description = conn._prepared[query].description
+
+        if description is not None and conn.types is not None and self._raw is not True:
+            unknown = conn.types.unknown(
+                {row.data_type for row in description if type(row.data_type) is int}
+            )
+            if unknown:
+                await conn._look_up_types(unknown)
+
+        if self._closed:
+            return
+
+        self._opened = True
+        self._done = conn._last_result(
+            conn._portal_query(self, query, self._vals, self._raw, self.batch)
+        )
+        conn._io_impl.add_both(self._done, self._finish)
+
+        if not keep:
+            # Closing it would close the portal too, so it is closed along
+            # with whatever is parsed after the portal is done.
+            conn._forget_statement(query)
+
+    def _batch_received(self, suspended):
+        conn = self._conn
+        rows, spill = conn._take_rows()
+        sunk, conn._sunk = conn._sunk, False
+        self._received = True
+
+        if self._closed:
+            if spill is not None:
+                spill.close()
+            if suspended:
+                conn._close()
+            return
+
+        if rows or spill is not None:
+            self._pending.append(
+                conn._decode(rows, conn._currentDescription, self._raw, sunk, spill)
+            )
+
+        self._suspended = suspended
+        self._fetch_ahead()
+        self._wake()
+
+    def _fetch_ahead(self):
+        if self._suspended and len(self._pending) < self.prefetch:
+            self._suspended = False
+            self._conn._fetch(self.batch)
+
+    def _finish(self, result):
+        self._finished = True
+        self._suspended = False
+        # The consumer may await the portal's future next, which can't be
+        # done from within its own callbacks.
+        self._conn._io_impl.call_later(0, self._wake)
+        return result
+
+    def _wake(self):
+        waiter, self._waiter = self._waiter, None
+        if waiter is not None:
+            self._conn._io_impl.trigger_callback(waiter, None)
+
+    def _retry(self, error):
+        """
+        Whether to open the portal again after C{error}, which it can be if
+        it came before any rows did, because the statement had to be
+        prepared again.
+        """
+        from .statements import invalidated
+
+        conn = self._conn
+
+        if (
+            self._received
+            or not invalidated(error)
+            or conn._transactionStatus != BackendTransactionStatus.IDLE
+        ):
+            return False
+
+        conn._forget_statement(self._query)
+        self._opened = self._finished = False
+        return True
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._closed:
+            row = next(self._rows, None)
+
+            if row is not None:
+                return row
+            elif self._pending:
+                self._rows = iter(self._pending.popleft())
+                self._fetch_ahead()
+            elif not self._opened:
+                await self._open()
+            elif not self._finished:
+                self._waiter = self._conn._io_impl.make_callback()
+                await self._waiter
+            else:
+                done, self._done = self._done, None
+                if done is None:
+                    break
+                try:
+                    await done
+                except Exception as e:
+                    if not self._retry(e):
+                        raise
+
+        raise StopAsyncIteration
+
+    def close(self):
+        """
+        Stop iterating, dropping the rows that haven't been yielded, and
+        close the portal. The returned future fires once it is closed.
+        """
+        self._closed = True
+        self._pending.clear()
+        self._rows = iter(())
+        self._wake()
+
+        done, self._done = self._done, None
+        if done is None:
+            return self._conn.succeeded(None)
+
+        if self._suspended:
+            self._suspended = False
+            self._conn._close()
+        # Otherwise it is closed once the rows it is sending have come.
+        return done
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
 @attr.s
 class PostgresConnection(object):
 
@@ -64,9 +513,65 @@ class PostgresConnection(object):
     _io_impl = attr.ib()
     encoding = attr.ib(default="utf8")
     _converter = attr.ib(factory=Converter)
+    instrumentation = attr.ib(default=None)
+    flow_control = attr.ib(factory=FlowControl)
+    stream_threshold = attr.ib(default=None)
+    large_value_sink = attr.ib(default=None)
+    types = attr.ib(factory=_new_type_cache)
+    decode_pool = attr.ib(default=None)
+    memory_budget = attr.ib(default=None, converter=_as_budget)
+    registry = attr.ib(default=None)
     _dataRows = attr.ib(factory=list, init=False, repr=False)
+    _bufferedBytes = attr.ib(default=0, init=False, repr=False)
+    _spill = attr.ib(default=None, init=False, repr=False)
+    _partialRow = attr.ib(default=None, init=False, repr=False)
+    _sunk = attr.ib(default=False, init=False, repr=False)
+    _raw = attr.ib(default=(), init=False, repr=False)
+    _parameterTypes = attr.ib(default=(), init=False, repr=False)
+    _copySource = attr.ib(default=None, init=False, repr=False)
+    _copyError = attr.ib(default=None, init=False, repr=False)
+    _copyPaused = attr.ib(default=False, init=False, repr=False)
+    _copyProducing = attr.ib(default=False, init=False, repr=False)
+    _prepared = attr.ib(factory=dict, init=False, repr=False)
+    _preparing = attr.ib(factory=deque, init=False, repr=False)
+    _stale = attr.ib(factory=list, init=False, repr=False)
+    _statementNames = attr.ib(factory=itertools.count, init=False, repr=False)
+    _currentStatement = attr.ib(default="", init=False, repr=False)
+    _transactionStatus = attr.ib(default=None, init=False, repr=False)
     _auth = attr.ib(default=None, init=False, repr=False)
+    _scram = attr.ib(default=None, init=False, repr=False)
     _parameters = attr.ib(factory=dict, init=False)
+    _listeners = attr.ib(factory=dict, init=False, repr=False)
+    _pipeline = attr.ib(default=None, init=False, repr=False)
+    _portal = attr.ib(default=None, init=False, repr=False)
+    _backend_key = attr.ib(default=None, init=False, repr=False)
+    _endpoint = attr.ib(default=None, init=False, repr=False)
+    _hungUp = attr.ib(default=False, init=False, repr=False)
+
+    # Tracing isn't part of automat's public API, so it may go away.
+    _setTrace = getattr(_machine, "_setTrace", None)
+
+    def __attrs_post_init__(self):
+        if self.instrumentation is not None:
+            self.trace_states(self.instrumentation.state_changed)
+
+    def trace_states(self, tracer):
+        """
+        Call C{tracer(old_state, input, new_state)} on every transition of
+        the connection's state machine.
+
+        @return: Whether the installed version of automat can do this; if
+            not, nothing is traced, and L{Instrumentation} only misses the
+            time spent in each state.
+        """
+        if self._setTrace is None:
+            return False
+        self._setTrace(tracer)
+        return True
+
+    def _instrument_query(self, query, params=None):
+        if self.instrumentation is not None:
+            self.instrumentation.query_started(query, params)
 
     @_machine.state(initial=True)
     def DISCONNECTED(self):
@@ -98,11 +603,17 @@ class PostgresConnection(object):
     def WAITING_FOR_BIND(self):
         pass
 
+    @_machine.state()
+    def PREPARING(self):
+        """
+        Preparing named statements, which ends with a Sync.
+        """
+
     @_machine.state()
     def WAITING_FOR_CLOSE(self):
         pass
 
-    @_machine.state()
+    @_machine.state(serialized="READY")
     def READY(self):
         pass
 
@@ -118,6 +629,13 @@ class PostgresConnection(object):
     def EXECUTING(self):
         pass
 
+    @_machine.state()
+    def SUSPENDED(self):
+        """
+        A portal has sent as many rows as were asked for, and is waiting for
+        an Execute to send more, or a Close.
+        """
+
     @_machine.state()
     def WAITING_FOR_COPY_OUT_RESPONSE(self):
         pass
@@ -130,6 +648,21 @@ class PostgresConnection(object):
     def COMMAND_COMPLETE(self):
         pass
 
+    @_machine.state()
+    def EXECUTING_SIMPLE_QUERY(self):
+        pass
+
+    @_machine.state()
+    def PIPELINING(self):
+        pass
+
+    @_machine.state()
+    def WAITING_FOR_READY_AFTER_ERROR(self):
+        """
+        The current operation failed, and the server will send ReadyForQuery
+        once it has skipped the rest of it.
+        """
+
     @_machine.input()
     def _REMOTE_READY_FOR_QUERY(self, message):
         pass
@@ -142,6 +675,10 @@ class PostgresConnection(object):
     def _REMOTE_ROW_DESCRIPTION(self, message):
         pass
 
+    @_machine.input()
+    def _REMOTE_PARAMETER_DESCRIPTION(self, message):
+        pass
+
     @_machine.input()
     def _REMOTE_BIND_COMPLETE(self, message):
         pass
@@ -154,10 +691,22 @@ class PostgresConnection(object):
     def _REMOTE_DATA_ROW(self, message):
         pass
 
+    @_machine.input()
+    def _REMOTE_DATA_ROW_CHUNK(self, message):
+        pass
+
+    @_machine.input()
+    def _REMOTE_DATA_ROW_BATCH(self, message):
+        pass
+
     @_machine.input()
     def _REMOTE_NO_DATA(self, message):
         pass
 
+    @_machine.input()
+    def _REMOTE_PORTAL_SUSPENDED(self, message):
+        pass
+
     @_machine.input()
     def _REMOTE_AUTHENTICATION_OK(self, message):
         pass
@@ -166,12 +715,24 @@ class PostgresConnection(object):
     def _REMOTE_AUTHENTICATION_CLEARTEXT_PASSWORD(self, message):
         pass
 
+    @_machine.input()
+    def _REMOTE_AUTHENTICATION_SASL(self, message):
+        pass
+
+    @_machine.input()
+    def _REMOTE_AUTHENTICATION_SASL_CONTINUE(self, message):
+        pass
+
+    @_machine.input()
+    def _REMOTE_AUTHENTICATION_SASL_FINAL(self, message):
+        pass
+
     @_machine.input()
     def _REMOTE_CLOSE_COMPLETE(self, message):
         pass
 
     @_machine.input()
-    def _REMOTE_PARAMETER_STATUS(self, message):
+    def _REMOTE_COPY_IN_RESPONSE(self, message):
         pass
 
     @_machine.input()
@@ -182,16 +743,48 @@ class PostgresConnection(object):
     def _REMOTE_COPY_DATA(self, message):
         pass
 
+    @_machine.input()
+    def _REMOTE_COPY_DATA_CHUNK(self, message):
+        pass
+
+    @_machine.input()
+    def _REMOTE_COPY_DATA_BATCH(self, message):
+        pass
+
     @_machine.input()
     def _REMOTE_COPY_DONE(self, message):
         pass
 
+    @_machine.input()
+    def _REMOTE_EMPTY_QUERY_RESPONSE(self, message):
+        pass
+
+    @_machine.input()
+    def _REMOTE_ERROR(self, message):
+        pass
+
+    @_machine.input()
+    def _REMOTE_BACKEND_KEY_DATA(self, message):
+        pass
+
     def _wait_for_ready(self, *args, **kwargs):
         self._ready_callback = self._io_impl.make_callback()
         return self._ready_callback
 
-    @_machine.input()
     def connect(self, endpoint, database, username, password=None):
+        return self._last_result(self._connect(endpoint, database, username, password))
+
+    def _last_result(self, futures):
+        """
+        One future for those returned by an input, which fires with the result
+        of the last of them, or fails as soon as any of them does.
+        """
+        if len(futures) == 1:
+            return futures[0]
+        return self._io_impl.gather_last(futures)
+
+    @_machine.input()
+    def _connect(self, endpoint, database, username, password=None):
         pass
 
     @_machine.output()
@@ -200,6 +793,12 @@ class PostgresConnection(object):
         if password:
             self._auth = password
 
+        self._endpoint = endpoint
+        self._hungUp = False
+        # A new session has none of the statements of the last one.
+        self._prepared.clear()
+        self._stale = []
+        self._instrument_query(None)
         return self._io_impl.connect(self, endpoint, database, username)
 
     @_machine.output()
@@ -209,13 +808,14 @@ class PostgresConnection(object):
     @_machine.output()
     def _on_connected(self, message):
         if self._ready_callback:
-            self._io_impl.trigger_callback(self._ready_callback, message.backend_status)
+            ready_callback, self._ready_callback = self._ready_callback, None
+            self._io_impl.trigger_callback(ready_callback, message.backend_status)
 
     DISCONNECTED.upon(
-        connect,
+        _connect,
         enter=CONNECTING,
         outputs=[do_connect, _wait_for_ready_on_connect],
-        collector=_get_last_collector,
+        collector=_collect_futures,
     )
 
     @_machine.output()
@@ -231,149 +831,1170 @@ class PostgresConnection(object):
         outputs=[_send_auth_plaintext],
     )
 
-    WAITING_FOR_AUTH.upon(
-        _REMOTE_AUTHENTICATION_OK, enter=WAITING_FOR_READY, outputs=[]
-    )
-
     CONNECTING.upon(_REMOTE_AUTHENTICATION_OK, enter=WAITING_FOR_READY, outputs=[])
 
-    @_machine.output()
-    def _register_parameter(self, message):
-        self._parameters[message.name] = message.val
-
-        if message.name == "server_encoding":
-            self._pg._encoding = message.val
-
-    WAITING_FOR_READY.upon(
-        _REMOTE_PARAMETER_STATUS, enter=WAITING_FOR_READY, outputs=[_register_parameter]
-    )
-
-    WAITING_FOR_READY.upon(
-        _REMOTE_READY_FOR_QUERY, enter=READY, outputs=[_on_connected]
-    )
-
-    COMMAND_COMPLETE.upon(_REMOTE_READY_FOR_QUERY, enter=READY, outputs=[_on_connected])
-
-    @_machine.input()
-    def query(self, query, vals):
-        pass
+    def _fail_auth(self, reason):
+        # There's no way on from here, so hang up, ignoring whatever else
+        # the server sent, such as an AuthenticationOk it had no right to.
+        ready_callback, self._ready_callback = self._ready_callback, None
+        self._auth = None
+        self._scram = None
+        self._hang_up()
+        self._io_impl.fail_callback(ready_callback, reason)
 
     @_machine.output()
-    def _do_query(self, query, vals):
-        self._currentQuery = query
-        self._currentVals = vals
-        self._dataRows = []
-        self._ready_callback = self._io_impl.make_callback()
-        self._pg.sendParse(query)
+    def _check_auth_complete(self, message):
+        if self._scram is not None:
+            from .scram import ScramError
 
-    @_machine.output()
-    def _wait_for_result(self, query, vals):
-        self._result_callback = self._io_impl.make_callback()
-        self._io_impl.add_callback(self._result_callback, lambda x: self._collate())
-        return self._result_callback
+            # Only the SASLFinal proves that the server knows the password,
+            # so without it we could be talking to anyone.
+            self._fail_auth(ScramError("The server skipped its SCRAM signature."))
 
     @_machine.output()
-    def _wait_for_ready_on_query(self, query, vals):
-        return self._wait_for_ready()
+    def _send_sasl_initial_response(self, message):
+        from .scram import MECHANISM, ScramClient, ScramError
 
-    READY.upon(
-        query,
-        enter=WAITING_FOR_PARSE,
-        outputs=[_do_query, _wait_for_ready_on_query, _wait_for_result],
-        collector=_get_last_collector,
-    )
+        if MECHANISM not in message.mechanisms:
+            self._fail_auth(
+                ScramError("No supported SASL mechanism in %r" % (message.mechanisms,))
+            )
+            return
+        elif self._auth is None:
+            self._fail_auth(ScramError("The server wants a password."))
+            return
 
-    def execute(self, command, args=[]):
-        d = self.query(command, args)
-        self._io_impl.add_callback(d, lambda x: None)
-        return d
+        self._scram = ScramClient(self._auth)
+        self._auth = None
+        self._pg.sendSaslInitialResponse(MECHANISM, self._scram.client_first())
 
     @_machine.output()
-    def _do_send_describe(self, message):
-        self._pg.sendDescribe()
+    def _send_sasl_response(self, message):
+        from .scram import ScramError
 
-    WAITING_FOR_PARSE.upon(
-        _REMOTE_PARSE_COMPLETE, enter=WAITING_FOR_DESCRIBE, outputs=[_do_send_describe]
-    )
+        try:
+            response = self._scram.client_final(message.data)
+        except ScramError as e:
+            self._fail_auth(e)
+        else:
+            self._pg.sendSaslResponse(response)
 
     @_machine.output()
-    def _on_row_description(self, message):
-        print(message.values)
-        self._currentDescription = message.values
+    def _verify_sasl_final(self, message):
+        from .scram import ScramError
 
-    @_machine.output()
-    def _do_bind(self, message):
-        bind_vals = [self._converter.to_postgres(x) for x in self._currentVals]
-        self._pg.sendBind(bind_vals)
+        scram, self._scram = self._scram, None
 
-    WAITING_FOR_DESCRIBE.upon(
-        _REMOTE_ROW_DESCRIPTION,
-        enter=WAITING_FOR_BIND,
-        outputs=[_on_row_description, _do_bind],
-    )
+        try:
+            scram.verify(message.data)
+        except ScramError as e:
+            self._fail_auth(e)
 
-    WAITING_FOR_DESCRIBE.upon(
-        _REMOTE_NO_DATA, enter=WAITING_FOR_BIND, outputs=[_do_bind]
+    CONNECTING.upon(
+        _REMOTE_AUTHENTICATION_SASL,
+        enter=WAITING_FOR_AUTH,
+        outputs=[_send_sasl_initial_response],
+    )
+    WAITING_FOR_AUTH.upon(
+        _REMOTE_AUTHENTICATION_SASL_CONTINUE,
+        enter=WAITING_FOR_AUTH,
+        outputs=[_send_sasl_response],
+    )
+    WAITING_FOR_AUTH.upon(
+        _REMOTE_AUTHENTICATION_SASL_FINAL,
+        enter=WAITING_FOR_AUTH,
+        outputs=[_verify_sasl_final],
+    )
+    WAITING_FOR_AUTH.upon(
+        _REMOTE_AUTHENTICATION_OK,
+        enter=WAITING_FOR_READY,
+        outputs=[_check_auth_complete],
     )
 
     @_machine.output()
-    def _send_execute(self, message):
-        self._pg.sendExecute("")
+    def _store_backend_key(self, message):
+        self._backend_key = message
 
-    WAITING_FOR_BIND.upon(
-        _REMOTE_BIND_COMPLETE, enter=EXECUTING, outputs=[_send_execute]
+    WAITING_FOR_READY.upon(
+        _REMOTE_BACKEND_KEY_DATA, enter=WAITING_FOR_READY, outputs=[_store_backend_key]
     )
 
-    @_machine.output()
-    def _store_row(self, message):
-        self._addDataRow(message)
+    def cancel(self):
+        """
+        Ask the server to cancel whatever this connection is running, over a
+        separate connection to the same endpoint.
 
-    EXECUTING.upon(_REMOTE_DATA_ROW, enter=EXECUTING, outputs=[_store_row])
+        If the cancellation takes effect, the running query fails with
+        L{QueryCanceled}. The returned future fires once the request is sent.
+        """
+        if self._backend_key is None:
+            raise ValueError("The server has not sent us a cancellation key.")
 
-    @_machine.output()
-    def _on_command_complete(self, message):
-        self._currentQuery = None
-        self._currentVals = None
-        self._io_impl.trigger_callback(self._result_callback, True)
-        self._pg.sync()
+        return self._io_impl.cancel(
+            self._endpoint, self._backend_key.process_id, self._backend_key.secret_key
+        )
 
-    EXECUTING.upon(
-        _REMOTE_COMMAND_COMPLETE, enter=COMMAND_COMPLETE, outputs=[_on_command_complete]
-    )
+    def _check_deadline(self, timeout):
+        """
+        Refuse a C{timeout} before the query is sent if it can't be kept.
+        """
+        if timeout is not None and self._backend_key is None:
+            raise ValueError(
+                "The server has not sent us a cancellation key, so queries "
+                "can't time out."
+            )
 
-    def _addDataRow(self, msg):
-        self._dataRows.append(msg.values)
+    def _with_deadline(self, future, timeout):
+        """
+        Cancel the query if C{future} has not fired within C{timeout} seconds.
 
-    def _collate(self):
+        The returned future fires with the result of C{future}, or fails with
+        the error if the cancellation can't be sent.
         """
-        Collate the responses of a query.
+        if timeout is None:
+            return future
+
+        result = self._io_impl.make_callback()
+        done = False
+
+        def _finish(outcome, failed):
+            nonlocal done
+            if done:
+                return
+            done = True
+            if delayed.active():
+                delayed.cancel()
+            if failed:
+                self._io_impl.fail_callback(result, outcome)
+            else:
+                self._io_impl.trigger_callback(result, outcome)
+
+        def _cancel():
+            try:
+                d = self.cancel()
+            except Exception as e:
+                _finish(e, True)
+            else:
+                self._io_impl.add_errback(d, lambda e: _finish(e, True))
+
+        delayed = self._io_impl.call_later(timeout, _cancel)
+        self._io_impl.add_callback(future, lambda res: _finish(res, False))
+        self._io_impl.add_errback(future, lambda e: _finish(e, True))
+        return result
+
+    def _rows_buffered(self, rows, size):
         """
-        if not self._dataRows:
-            return []
+        Note rows that have been received but not consumed yet, pausing
+        reading from the server if too many are outstanding.
+        """
+        if self.flow_control.received(rows, size):
+            self._io_impl.pause_reading(self)
 
-        for row in self._currentDescription:
-            if row.field_name == b"?column?":
-                row.field_name = b"anonymous"
+    def _rows_consumed(self, rows, size):
+        if self.flow_control.consumed(rows, size):
+            self._io_impl.resume_reading(self)
 
-        res = namedtuple(
-            "Result", [x.field_name.decode("utf8") for x in self._currentDescription]
+    def _register_parameter(self, message):
+        self._parameters[message.name] = message.val
+
+        if message.name == "client_encoding":
+            self._pg._encoding = python_encoding(message.val)
+
+    @_machine.serializer()
+    def _serialized_state(self, state):
+        return state
+
+    @property
+    def idle(self):
+        """
+        Whether the connection is waiting for a query, and not in a
+        transaction.
+        """
+        return (
+            self._serialized_state() == "READY"
+            and self._transactionStatus == BackendTransactionStatus.IDLE
         )
 
-        resp = []
+    @property
+    def io_impl(self):
+        """
+        What the connection does I/O with, for adding callbacks to its
+        futures.
+        """
+        return self._io_impl
+
+    @property
+    def client_encoding(self):
+        """
+        The encoding text is sent and received in.
+        """
+        return self._parameters.get("client_encoding", self.encoding)
+
+    WAITING_FOR_READY.upon(
+        _REMOTE_READY_FOR_QUERY, enter=READY, outputs=[_on_connected]
+    )
+
+    COMMAND_COMPLETE.upon(_REMOTE_READY_FOR_QUERY, enter=READY, outputs=[_on_connected])
+
+    def query(self, query, vals=[], timeout=None, raw=()):
+        """
+        Run a query, returning the collated rows.
+
+        Values are converted to Python types, except in the columns named in
+        C{raw}, or all of them if it is True, which are left as bytes.
+
+        Queries without parameters are sent using the simple query protocol,
+        which takes a single message and round trip. If the query contains
+        more than one statement, the rows of the last one are returned.
+
+        If C{timeout} is given, the query is cancelled once it has run for
+        that many seconds, and fails with L{QueryCanceled}. A C{ValueError}
+        is raised at once if the server gave us no key to cancel it with.
+
+        If the rows would take more than the C{memory_budget} while they are
+        received, the rest are spilled to a temporary file, and the result
+        is a L{SpilledResult} that reads them back as it is iterated.
+        Reading from the server is never paused for C{query}; use C{iterate}
+        to hold no more than a batch of rows at a time.
+        """
+        self._check_deadline(timeout)
+
+        if vals:
+            d = self._with_types(self._run_extended(query, vals, raw))
+            return self._with_deadline(d, timeout)
+
+        d = self._with_types(self._last_result(self._simple_query(query, raw)), True)
+        self._io_impl.add_callback(d, lambda res: res[-1] if res else [])
+        return self._with_deadline(d, timeout)
+
+    def script(self, query, timeout=None, raw=()):
+        """
+        Run one or more statements with the simple query protocol, returning
+        a list of the collated rows of each statement.
+        """
+        self._check_deadline(timeout)
+        d = self._with_types(self._last_result(self._simple_query(query, raw)), True)
+        return self._with_deadline(d, timeout)
+
+    def _run_extended(self, query, vals, raw):
+        """
+        Run C{query} with the extended query protocol, as a named statement
+        if the C{registry} says it is hot.
+        """
+        registry = self.registry
+        hot = registry is not None and registry.used(query)
+
+        if query not in self._prepared:
+            statement = ""
+            if hot and len(self._prepared) < registry.max_statements:
+                statement = self._new_statement_name()
+            return self._last_result(self._extended_query(query, vals, raw, statement))
+
+        d = self._last_result(self._prepared_query(query, vals, raw))
+
+        def _prepare_again(error):
+            from .statements import invalidated
+
+            if not invalidated(error):
+                raise error
+
+            self._forget_statement(query)
+
+            if self._transactionStatus != BackendTransactionStatus.IDLE:
+                # The error has aborted the transaction, so it's too late.
+                raise error
+
+            return self._run_extended(query, vals, raw)
+
+        self._io_impl.add_errback(d, _prepare_again)
+        return d
+
+    def _new_statement_name(self):
+        from .statements import STATEMENT_PREFIX
+
+        return STATEMENT_PREFIX + str(next(self._statementNames))
+
+    def _forget_statement(self, query):
+        statement = self._prepared.pop(query, None)
+        if statement is not None:
+            # Closed along with whatever is parsed next.
+            self._stale.append(statement.name)
+
+    def _close_stale_statements(self):
+        stale, self._stale = self._stale, []
+        for name in stale:
+            self._pg.sendCloseStatement(name)
+
+    def prepare(self, queries):
+        """
+        Prepare C{queries} as named statements, in one round trip, so that
+        running them with L{query} only binds them. Queries that are
+        prepared already are skipped.
+
+        If one fails to prepare, those after it are not prepared either, and
+        the returned future fails with the error.
+        """
+        return self._last_result(self._prepare(list(queries)))
+
+    @_machine.input()
+    def _prepare(self, queries):
+        pass
+
+    @_machine.output()
+    def _do_prepare(self, queries):
+        self._preparing.clear()
+        self._parameterTypes = ()
+        self._ready_callback = self._io_impl.make_callback()
+        self._close_stale_statements()
 
-        for i in self._dataRows:
-            row = []
-            for x, form in zip(i, self._currentDescription):
-                row.append(self._converter.from_postgres(x, form))
-            resp.append(res(*row))
+        for query in dict.fromkeys(queries):
+            if query in self._prepared:
+                continue
+            name = self._new_statement_name()
+            self._preparing.append((query, name))
+            self._pg.sendParse(query, name)
+            self._pg.sendDescribe(name)
 
-        self._dataRows.clear()
+        self._pg.sync()
+        return self._ready_callback
+
+    READY.upon(
+        _prepare,
+        enter=PREPARING,
+        outputs=[_do_prepare],
+        collector=_collect_futures,
+    )
+
+    @_machine.output()
+    def _on_statement_described(self, message):
+        from .statements import PreparedStatement
+
+        query, name = self._preparing.popleft()
+        description = getattr(message, "values", None)
+        self._prepared[query] = PreparedStatement(
+            name, tuple(self._parameterTypes), description
+        )
+        self._parameterTypes = ()
+
+    @_machine.output()
+    def _on_prepare_error(self, message):
+        self._preparing.clear()
+        self._fail_when_ready(message, self._ready_callback)
+
+    @_machine.input()
+    def _extended_query(self, query, vals, raw=(), statement=""):
+        pass
+
+    @_machine.output()
+    def _do_query(self, query, vals, raw=(), statement=""):
+        self._currentQuery = query
+        self._currentVals = vals
+        self._currentStatement = statement
+        self._raw = raw
+        self._parameterTypes = ()
+        self._dataRows = []
+        self._ready_callback = self._io_impl.make_callback()
+        self._instrument_query(query, vals)
+        self._close_stale_statements()
+        self._pg.sendParse(query, statement)
+
+    @_machine.output()
+    def _wait_for_result(self, query, vals):
+        self._result_callback = self._io_impl.make_callback()
+        self._io_impl.add_callback(
+            self._result_callback, lambda x: self._collate(undecoded=True)
+        )
+        return self._result_callback
+
+    @_machine.output()
+    def _wait_for_ready_on_query(self, query, vals):
+        return self._wait_for_ready()
+
+    READY.upon(
+        _extended_query,
+        enter=WAITING_FOR_PARSE,
+        outputs=[_do_query, _wait_for_ready_on_query, _wait_for_result],
+        collector=_collect_futures,
+    )
+
+    @_machine.input()
+    def _prepared_query(self, query, vals, raw=()):
+        pass
+
+    @_machine.output()
+    def _do_prepared_query(self, query, vals, raw=()):
+        statement = self._prepared[query]
+        self._currentQuery = query
+        self._currentVals = vals
+        self._currentStatement = statement.name
+        self._currentDescription = statement.description
+        self._parameterTypes = statement.parameter_types
+        self._raw = raw
+        self._dataRows = []
+        self._ready_callback = self._io_impl.make_callback()
+        self._instrument_query(query, vals)
+        self._bind()
+        self._pg.sendExecute("")
+
+    # There is nothing to parse or describe, so it is bound and executed in
+    # one go.
+    READY.upon(
+        _prepared_query,
+        enter=EXECUTING,
+        outputs=[_do_prepared_query, _wait_for_ready_on_query, _wait_for_result],
+        collector=_collect_futures,
+    )
+
+    def iterate(self, query, vals=[], batch=1000, raw=(), prefetch=1):
+        """
+        Iterate over the rows of C{query}, which are fetched C{batch} at a
+        time from a portal on the server, with a L{Cursor}::
+
+            async with conn.iterate(query, vals, batch=1000) as rows:
+                async for row in rows:
+                    ...
+
+        Rows are decoded as by L{query}, but only a few batches of them are
+        held at once, however many there are.
+        """
+        return Cursor(self, query, vals, raw, batch, prefetch)
+
+    @_machine.input()
+    def _portal_query(self, portal, query, vals, raw, batch):
+        pass
+
+    @_machine.output()
+    def _do_portal_query(self, portal, query, vals, raw, batch):
+        statement = self._prepared[query]
+        self._portal = portal
+        self._currentQuery = query
+        self._currentVals = vals
+        self._currentStatement = statement.name
+        self._currentDescription = statement.description
+        self._parameterTypes = statement.parameter_types
+        self._raw = raw
+        self._dataRows = []
+        self._ready_callback = self._io_impl.make_callback()
+        # The last rows, once the portal is done.
+        self._result_callback = self._io_impl.make_callback()
+        self._io_impl.add_callback(
+            self._result_callback, lambda _: portal._batch_received(False)
+        )
+        self._instrument_query(query, vals)
+        self._close_stale_statements()
+        self._bind()
+        self._pg.sendExecute("", batch)
+        return self._ready_callback
+
+    READY.upon(
+        _portal_query,
+        enter=EXECUTING,
+        outputs=[_do_portal_query],
+        collector=_collect_futures,
+    )
+
+    @_machine.output()
+    def _on_portal_suspended(self, message):
+        self._portal._batch_received(True)
+
+    EXECUTING.upon(
+        _REMOTE_PORTAL_SUSPENDED, enter=SUSPENDED, outputs=[_on_portal_suspended]
+    )
+
+    @_machine.input()
+    def _fetch(self, rows):
+        pass
+
+    @_machine.output()
+    def _do_fetch(self, rows):
+        self._pg.sendExecute("", rows)
+
+    SUSPENDED.upon(_fetch, enter=EXECUTING, outputs=[_do_fetch])
+
+    @_machine.input()
+    def _simple_query(self, query, raw=()):
+        pass
+
+    @_machine.output()
+    def _do_simple_query(self, query, raw=()):
+        self._currentQuery = query
+        self._raw = raw
+        self._currentDescription = None
+        self._dataRows = []
+        self._statementResults = []
+        self._instrument_query(query)
+        self._pg.sendQuery(query)
+
+    @_machine.output()
+    def _wait_for_simple_result(self, query):
+        self._result_callback = self._io_impl.make_callback()
+        return self._result_callback
+
+    READY.upon(
+        _simple_query,
+        enter=EXECUTING_SIMPLE_QUERY,
+        outputs=[_do_simple_query, _wait_for_simple_result],
+        collector=_collect_futures,
+    )
+
+    def execute(self, command, args=[], timeout=None):
+        d = self.query(command, args, timeout=timeout)
+        self._io_impl.add_callback(d, lambda x: None)
+        return d
+
+    @_machine.output()
+    def _do_send_describe(self, message):
+        self._pg.sendDescribe(self._currentStatement)
+
+    WAITING_FOR_PARSE.upon(
+        _REMOTE_PARSE_COMPLETE, enter=WAITING_FOR_DESCRIBE, outputs=[_do_send_describe]
+    )
+
+    @_machine.output()
+    def _on_row_description(self, message):
+        self._currentDescription = message.values
+
+    @_machine.output()
+    def _on_parameter_description(self, message):
+        self._parameterTypes = message.object_ids
+
+    WAITING_FOR_DESCRIBE.upon(
+        _REMOTE_PARAMETER_DESCRIPTION,
+        enter=WAITING_FOR_DESCRIBE,
+        outputs=[_on_parameter_description],
+    )
+
+    @_machine.output()
+    def _do_bind(self, message):
+        if self._currentStatement:
+            from .statements import PreparedStatement
+
+            # The statement's description, before any formats are chosen
+            # for this run of it.
+            self._prepared[self._currentQuery] = PreparedStatement(
+                self._currentStatement,
+                tuple(self._parameterTypes),
+                self._currentDescription,
+            )
+        self._bind()
+
+    def _bind(self):
+        encoding = self._pg._encoding
+        types = list(self._parameterTypes)
+        types += [None] * (len(self._currentVals) - len(types))
+        bind_vals = [
+            self._converter.to_postgres(x, encoding, data_type)
+            for x, data_type in zip(self._currentVals, types)
+        ]
+
+        formats = None
+        description = self._currentDescription
+
+        if description is not None:
+            # The statement's description has every column in the text
+            # format, so it is updated with what we ask for.
+            formats = self._converter.result_formats(description, encoding, self._raw)
+            self._currentDescription = [
+                row if fmt == row.format_code else attr.evolve(row, format_code=fmt)
+                for row, fmt in zip(description, formats)
+            ]
+            formats = [fmt.value for fmt in formats]
+
+        self._pg.sendBind(bind_vals, formats, self._currentStatement)
+
+    WAITING_FOR_DESCRIBE.upon(
+        _REMOTE_ROW_DESCRIPTION,
+        enter=WAITING_FOR_BIND,
+        outputs=[_on_row_description, _do_bind],
+    )
+
+    WAITING_FOR_DESCRIBE.upon(
+        _REMOTE_NO_DATA, enter=WAITING_FOR_BIND, outputs=[_do_bind]
+    )
+
+    @_machine.output()
+    def _send_execute(self, message):
+        self._pg.sendExecute("")
+
+    WAITING_FOR_BIND.upon(
+        _REMOTE_BIND_COMPLETE, enter=EXECUTING, outputs=[_send_execute]
+    )
+    EXECUTING.upon(_REMOTE_BIND_COMPLETE, enter=EXECUTING, outputs=[])
+    # Statements left over from a portal are closed ahead of the next one.
+    EXECUTING.upon(_REMOTE_CLOSE_COMPLETE, enter=EXECUTING, outputs=[])
+
+    WAITING_FOR_PARSE.upon(_REMOTE_CLOSE_COMPLETE, enter=WAITING_FOR_PARSE, outputs=[])
+
+    PREPARING.upon(_REMOTE_CLOSE_COMPLETE, enter=PREPARING, outputs=[])
+    PREPARING.upon(_REMOTE_PARSE_COMPLETE, enter=PREPARING, outputs=[])
+    PREPARING.upon(
+        _REMOTE_PARAMETER_DESCRIPTION,
+        enter=PREPARING,
+        outputs=[_on_parameter_description],
+    )
+    PREPARING.upon(
+        _REMOTE_ROW_DESCRIPTION, enter=PREPARING, outputs=[_on_statement_described]
+    )
+    PREPARING.upon(_REMOTE_NO_DATA, enter=PREPARING, outputs=[_on_statement_described])
+    PREPARING.upon(_REMOTE_READY_FOR_QUERY, enter=READY, outputs=[_on_connected])
+
+    @_machine.output()
+    def _store_row(self, message):
+        self._addDataRow(message)
+
+    @_machine.output()
+    def _store_row_chunk(self, message):
+        self._addDataRowChunk(message)
+
+    EXECUTING.upon(_REMOTE_DATA_ROW, enter=EXECUTING, outputs=[_store_row])
+    EXECUTING.upon(_REMOTE_DATA_ROW_CHUNK, enter=EXECUTING, outputs=[_store_row_chunk])
+    EXECUTING.upon(_REMOTE_DATA_ROW_BATCH, enter=EXECUTING, outputs=[_store_row])
+
+    @_machine.output()
+    def _on_command_complete(self, message):
+        self._currentQuery = None
+        self._currentVals = None
+        result_callback, self._result_callback = self._result_callback, None
+        self._io_impl.trigger_callback(result_callback, True)
+        self._pg.sync()
+
+    EXECUTING.upon(
+        _REMOTE_COMMAND_COMPLETE, enter=COMMAND_COMPLETE, outputs=[_on_command_complete]
+    )
+
+    @_machine.output()
+    def _on_statement_complete(self, message):
+        self._statementResults.append(self._collate(undecoded=True))
         self._currentDescription = None
 
-        return resp
+    @_machine.output()
+    def _on_simple_query_complete(self, message):
+        results = self._statementResults
+        result_callback, self._result_callback = self._result_callback, None
+        self._currentQuery = None
+        self._statementResults = None
+        self._io_impl.trigger_callback(result_callback, results)
+
+    EXECUTING_SIMPLE_QUERY.upon(
+        _REMOTE_ROW_DESCRIPTION,
+        enter=EXECUTING_SIMPLE_QUERY,
+        outputs=[_on_row_description],
+    )
+    EXECUTING_SIMPLE_QUERY.upon(
+        _REMOTE_DATA_ROW, enter=EXECUTING_SIMPLE_QUERY, outputs=[_store_row]
+    )
+    EXECUTING_SIMPLE_QUERY.upon(
+        _REMOTE_DATA_ROW_CHUNK,
+        enter=EXECUTING_SIMPLE_QUERY,
+        outputs=[_store_row_chunk],
+    )
+    EXECUTING_SIMPLE_QUERY.upon(
+        _REMOTE_DATA_ROW_BATCH, enter=EXECUTING_SIMPLE_QUERY, outputs=[_store_row]
+    )
+    EXECUTING_SIMPLE_QUERY.upon(
+        _REMOTE_COMMAND_COMPLETE,
+        enter=EXECUTING_SIMPLE_QUERY,
+        outputs=[_on_statement_complete],
+    )
+    EXECUTING_SIMPLE_QUERY.upon(
+        _REMOTE_EMPTY_QUERY_RESPONSE,
+        enter=EXECUTING_SIMPLE_QUERY,
+        outputs=[_on_statement_complete],
+    )
+    EXECUTING_SIMPLE_QUERY.upon(
+        _REMOTE_READY_FOR_QUERY, enter=READY, outputs=[_on_simple_query_complete]
+    )
+
+    @_machine.input()
+    def _copy_in(self, query, source, raw=()):
+        pass
+
+    @_machine.output()
+    def _store_copy_source(self, source):
+        self._copySource = source
+
+    READY.upon(
+        _copy_in,
+        enter=EXECUTING_SIMPLE_QUERY,
+        outputs=[_store_copy_source, _do_simple_query, _wait_for_simple_result],
+        collector=_collect_futures,
+    )
+
+    @_machine.output()
+    def _send_copy_data(self, message):
+        if self._copySource is None:
+            self._pg.sendCopyFail("There is nothing to copy in.")
+            return
+
+        # The source is sent as fast as the transport takes it, rather than
+        # all at once, so that a large one isn't buffered in memory.
+        self._copySource = iter(self._copySource)
+        self._copyProducing = True
+        self._io_impl.produce(self, self._pause_copy, self._pump_copy)
+        self._pump_copy()
+
+    def _pause_copy(self):
+        self._copyPaused = True
+
+    def _pump_copy(self):
+        """
+        Send the COPY's source until it is used up, or the transport asks us
+        to pause.
+        """
+        self._copyPaused = False
+        source = self._copySource
+
+        if source is None:
+            return
+
+        # The source encodes the rows as it goes, so this is where anything
+        # wrong with them turns up.
+        try:
+            for data in source:
+                self._pg.sendCopyData(data)
+                if self._copyPaused:
+                    return
+        except Exception as e:
+            self._stop_copy()
+            self._copyError = e
+            self._pg.sendCopyFail(repr(e))
+        else:
+            self._stop_copy()
+            self._pg.sendCopyDone()
+
+    def _stop_copy(self):
+        self._copySource = None
+
+        if self._copyProducing:
+            self._copyProducing = False
+            self._io_impl.stop_producing(self)
+
+    EXECUTING_SIMPLE_QUERY.upon(
+        _REMOTE_COPY_IN_RESPONSE,
+        enter=EXECUTING_SIMPLE_QUERY,
+        outputs=[_send_copy_data],
+    )
+
+    def bulk_upsert(self, table, rows, key_columns, columns=None, timeout=None):
+        """
+        Insert C{rows} into C{table}, updating the rows already there with
+        the same C{key_columns}, which must have a unique index.
+
+        C{rows} are sequences of the values of C{columns}, or of every column
+        of the table in order if it isn't given. They are streamed into a
+        temporary table with COPY, which is binary if we have a binary
+        encoding for every column, and merged with one INSERT ... ON
+        CONFLICT. All of it is sent as one query, so it runs in one
+        transaction (or the one already open) and takes one round trip, plus
+        another to look up the table's columns.
+
+        PostgreSQL won't update a row twice in one statement, so each key
+        may only be in C{rows} once.
+        """
+        from .bulk import COLUMNS_QUERY, upsert_script
+
+        self._check_deadline(timeout)
+        d = self.query(COLUMNS_QUERY, [table])
+
+        def _copy(result):
+            name, names, data_types = result[0]
+            types = dict(zip(names, data_types))
+            wanted = names if columns is None else list(columns)
+            missing = [x for x in wanted + list(key_columns) if x not in types]
+
+            if missing:
+                raise ValueError(
+                    "%s has no column %s" % (name, ", ".join(map(repr, missing)))
+                )
+
+            binary, encode = self._converter.copy_encoder(
+                [types[x] for x in wanted], self._pg._encoding
+            )
+            query = upsert_script(name, _STAGING, wanted, key_columns, binary)
+            return self._last_result(self._copy_in(query, encode(rows)))
+
+        self._io_impl.add_callback(d, _copy)
+        return self._with_deadline(d, timeout)
+
+    def _run_pipeline(self, statements):
+        for statement in statements:
+            statement.bind_vals = [
+                self._converter.to_postgres(x, self._pg._encoding)
+                for x in statement.vals
+            ]
+        return self._last_result(self._pipelined_query(statements))
 
     @_machine.input()
+    def _pipelined_query(self, statements):
+        pass
+
+    @_machine.output()
+    def _do_pipelined_query(self, statements):
+        self._pipeline = deque(statements)
+        self._pipelineResults = []
+        self._pipelineError = None
+        self._currentDescription = None
+        self._dataRows = []
+        self._instrument_query(
+            [statement.query for statement in statements],
+            [statement.vals for statement in statements],
+        )
+
+        for statement in statements:
+            self._pg.sendPipelinedQuery(statement.query, statement.bind_vals)
+        self._pg.sendSync()
+
+        self._result_callback = self._io_impl.make_callback()
+        return self._result_callback
+
+    READY.upon(
+        _pipelined_query,
+        enter=PIPELINING,
+        outputs=[_do_pipelined_query],
+        collector=_collect_futures,
+    )
+
+    @_machine.output()
+    def _on_pipelined_statement_complete(self, message):
+        statement = self._pipeline.popleft()
+        result = self._collate()
+        self._currentDescription = None
+
+        if statement.future is not None:
+            self._pipelineResults.append(result)
+            self._io_impl.trigger_callback(statement.future, result)
+
+    @_machine.output()
+    def _on_pipeline_error(self, message):
+        error = PostgresError.from_error(message)
+        self._pipelineError = error
+        self._drop_rows()
+
+        # The server skips everything up to the Sync, so the rest of the
+        # statements will never run.
+        while self._pipeline:
+            statement = self._pipeline.popleft()
+            if statement.future is not None:
+                self._io_impl.fail_callback(statement.future, error)
+
+    @_machine.output()
+    def _on_pipeline_complete(self, message):
+        error = self._pipelineError
+        results = self._pipelineResults
+        result_callback, self._result_callback = self._result_callback, None
+        self._pipeline = None
+        self._pipelineError = None
+        self._pipelineResults = None
+
+        if error is None:
+            self._io_impl.trigger_callback(result_callback, results)
+        elif message.backend_status == BackendTransactionStatus.IN_ERRORED_TRANSACTION:
+            # The BEGIN went through, so the server is waiting for us to end
+            # the now-failed transaction.
+            # The statement's error is the one to report, whether or not
+            # the ROLLBACK succeeds.
+            d = self.execute("ROLLBACK")
+            self._io_impl.add_both(
+                d, lambda x: self._io_impl.fail_callback(result_callback, error)
+            )
+        else:
+            self._io_impl.fail_callback(result_callback, error)
+
+    PIPELINING.upon(_REMOTE_PARSE_COMPLETE, enter=PIPELINING, outputs=[])
+    PIPELINING.upon(_REMOTE_BIND_COMPLETE, enter=PIPELINING, outputs=[])
+    PIPELINING.upon(_REMOTE_NO_DATA, enter=PIPELINING, outputs=[])
+    PIPELINING.upon(
+        _REMOTE_ROW_DESCRIPTION, enter=PIPELINING, outputs=[_on_row_description]
+    )
+    PIPELINING.upon(_REMOTE_DATA_ROW, enter=PIPELINING, outputs=[_store_row])
+    PIPELINING.upon(
+        _REMOTE_DATA_ROW_CHUNK, enter=PIPELINING, outputs=[_store_row_chunk]
+    )
+    PIPELINING.upon(_REMOTE_DATA_ROW_BATCH, enter=PIPELINING, outputs=[_store_row])
+    PIPELINING.upon(
+        _REMOTE_COMMAND_COMPLETE,
+        enter=PIPELINING,
+        outputs=[_on_pipelined_statement_complete],
+    )
+    PIPELINING.upon(
+        _REMOTE_EMPTY_QUERY_RESPONSE,
+        enter=PIPELINING,
+        outputs=[_on_pipelined_statement_complete],
+    )
+    PIPELINING.upon(_REMOTE_ERROR, enter=PIPELINING, outputs=[_on_pipeline_error])
+    PIPELINING.upon(
+        _REMOTE_READY_FOR_QUERY, enter=READY, outputs=[_on_pipeline_complete]
+    )
+
+    def _addDataRow(self, msg):
+        if type(msg) is DataRowBatch:
+            # Parsed when the result is decoded.
+            self._keep_row(msg)
+        else:
+            self._keep_row(msg.values)
+
+    def _keep_row(self, row):
+        """
+        Buffer C{row} for the result, or if that would go over the memory
+        budget, spill it, and every row of the result after it, to a file.
+        """
+        if self._spill is not None:
+            self._spill.add(row)
+        elif self.memory_budget is None:
+            self._dataRows.append(row)
+        else:
+            size = _row_size(row)
+            if self.memory_budget.reserve(size):
+                self._bufferedBytes += size
+                self._dataRows.append(row)
+            else:
+                from .spill import SpillFile
+
+                self._spill = SpillFile(self.memory_budget.directory)
+                self._spill.add(row)
+
+    def _take_rows(self):
+        """
+        The rows buffered for the result, and the file any others were
+        spilled to, which are no longer counted against the budget.
+        """
+        rows, self._dataRows = self._dataRows, []
+        spill, self._spill = self._spill, None
+
+        if self._bufferedBytes:
+            self.memory_budget.release(self._bufferedBytes)
+            self._bufferedBytes = 0
+
+        return rows, spill
+
+    def _drop_rows(self):
+        rows, spill = self._take_rows()
+        if spill is not None:
+            spill.close()
+
+    def _addDataRowChunk(self, msg):
+        """
+        Put a streamed DataRow back together. Values longer than
+        C{stream_threshold} are written to a file from C{large_value_sink}, if
+        there is one, which then stands in for the value in the row; otherwise
+        a value's chunks are joined once it is complete.
+        """
+        if self._partialRow is None:
+            self._partialRow = []
+
+        row = self._partialRow
+
+        if len(row) == msg.column:
+            # The first chunk of this column.
+            if msg.data is None:
+                row.append(None)
+            elif (
+                self.large_value_sink is not None and msg.length > self.stream_threshold
+            ):
+                row.append(self.large_value_sink(self._currentDescription[msg.column]))
+                self._sunk = True
+            else:
+                row.append([])
+
+        value = row[-1]
+
+        if isinstance(value, list):
+            value.append(msg.data)
+            if msg.final:
+                row[-1] = b"".join(value)
+        elif value is not None:
+            value.write(msg.data)
+
+        if msg.last:
+            self._partialRow = None
+            self._keep_row(tuple(row))
+
+    def _collate(self, undecoded=False):
+        """
+        Collate the responses of a query.
+
+        If C{undecoded} is set and there are columns of types that haven't
+        been looked up yet, an L{_Undecoded} is returned instead, for
+        L{_with_types} to finish.
+        """
+        if not self._dataRows and self._spill is None:
+            return []
+
+        rows, spill = self._take_rows()
+        description, self._currentDescription = self._currentDescription, None
+        sunk, self._sunk = self._sunk, False
+        decode = functools.partial(
+            self._decode, rows, description, self._raw, sunk, spill
+        )
+        unknown = ()
+
+        if undecoded and self.types is not None and self._raw is not True:
+            unknown = self.types.unknown(
+                {row.data_type for row in description if type(row.data_type) is int}
+            )
+
+        # Rows that weren't parsed on the way in are parsed and decoded in
+        # the pool, unless some were streamed and so can't be sent there.
+        if (
+            undecoded
+            and self.decode_pool is not None
+            and spill is None
+            and all(type(row) is DataRowBatch for row in rows)
+        ):
+            return _Undecoded(
+                unknown,
+                functools.partial(self._decode_in_pool, rows, description, self._raw),
+                pooled=True,
+            )
+
+        if unknown:
+            return _Undecoded(unknown, decode)
+
+        return decode()
+
+    def _result_type(self, description):
+        for row in description:
+            if row.field_name == b"?column?":
+                row.field_name = b"anonymous"
+
+        encoding = python_encoding(self.client_encoding)
+        return _result_type(tuple(x.field_name.decode(encoding) for x in description))
+
+    def _decode(self, rows, description, raw, sunk, spill=None):
+        if any(type(row) is DataRowBatch for row in rows):
+            rows = list(
+                itertools.chain.from_iterable(
+                    row.rows() if type(row) is DataRowBatch else [row] for row in rows
+                )
+            )
+
+        res = self._result_type(description)
+        decoders = self._converter.decoders(
+            description, self.client_encoding, raw, self.types
+        )
+        columns = decode_columns(rows, decoders, sunk)
+
+        if columns:
+            rows = list(map(res._make, zip(*columns)))
+        else:
+            rows = [res() for _ in rows]
+
+        if spill is not None:
+            from .spill import SpilledResult
+
+            return SpilledResult(rows, spill, decoders, res)
+        return rows
+
+    def _decode_in_pool(self, batches, description, raw):
+        """
+        Parse and decode C{batches} in C{decode_pool}, returning a future of
+        the rows, in order.
+        """
+        from . import parallel
+
+        res = self._result_type(description)
+        spec = parallel.DecodeSpec.of(
+            self._converter, description, self.client_encoding, raw, self.types
+        )
+        futures = []
+        parts = []
+
+        for data, offsets in parallel.tasks(batches):
+            future = self._io_impl.submit(
+                self.decode_pool, parallel.decode_batch, spec, data, offsets
+            )
+            futures.append(future)
+            parts.append(None)
+            self._io_impl.add_callback(
+                future, functools.partial(parts.__setitem__, len(parts) - 1)
+            )
+
+        def _reassemble(_):
+            rows = []
+            for count, columns in parts:
+                if columns:
+                    rows.extend(map(res._make, zip(*columns)))
+                else:
+                    rows.extend(res() for _ in range(count))
+            return rows
+
+        d = self._io_impl.gather_last(futures)
+        self._io_impl.add_callback(d, _reassemble)
+        return d
+
+    def _with_types(self, future, many=False):
+        """
+        Finish decoding the result of C{future}, or its results if C{many},
+        once the types they need have been looked up.
+
+        This is done once the connection is ready for another query. If the
+        types can't be looked up, the values are decoded as text.
+        """
+
+        def _look_up(result):
+            results = result if many else [result]
+            pending = [r for r in results if isinstance(r, _Undecoded)]
+
+            if not pending:
+                return result
+
+            def _decode(_):
+                decoded = list(results)
+                futures = []
+
+                for index, r in enumerate(results):
+                    if not isinstance(r, _Undecoded):
+                        continue
+                    decoded[index] = r.decode()
+                    if r.pooled:
+                        futures.append(decoded[index])
+                        self._io_impl.add_callback(
+                            decoded[index],
+                            functools.partial(decoded.__setitem__, index),
+                        )
+
+                if futures:
+                    d = self._io_impl.gather_last(futures)
+                    self._io_impl.add_callback(
+                        d, lambda _: decoded if many else decoded[0]
+                    )
+                    return d
+
+                return decoded if many else decoded[0]
+
+            oids = set().union(*(p.oids for p in pending))
+
+            if not oids:
+                return _decode(None)
+
+            d = self._look_up_types(oids)
+            self._io_impl.add_both(d, _decode)
+            return d
+
+        self._io_impl.add_callback(future, _look_up)
+        return future
+
+    def _look_up_types(self, oids):
+        from .introspection import TYPES_QUERY
+
+        oids = sorted(oids)
+        types = self.types
+        d = self._with_types(
+            self._last_result(self._extended_query(TYPES_QUERY, [oids]))
+        )
+        self._io_impl.add_callback(d, types.add)
+        self._io_impl.add_both(d, lambda _: types.looked_up(oids))
+        return d
+
     def close(self):
+        """
+        Close the unnamed portal, such as one left suspended by a L{Cursor},
+        and sync.
+        """
+        return self._last_result(self._close())
+
+    @_machine.input()
+    def _close(self):
         pass
 
     @_machine.output()
@@ -384,39 +2005,154 @@ class PostgresConnection(object):
         return self._ready_callback
 
     READY.upon(
-        close,
+        _close,
+        enter=WAITING_FOR_CLOSE,
+        outputs=[_do_close],
+        collector=_collect_futures,
+    )
+
+    SUSPENDED.upon(
+        _close,
         enter=WAITING_FOR_CLOSE,
         outputs=[_do_close],
-        collector=_get_last_collector,
+        collector=_collect_futures,
     )
 
     WAITING_FOR_CLOSE.upon(_REMOTE_CLOSE_COMPLETE, enter=WAITING_FOR_READY, outputs=[])
 
     def _onMessage(self, message):
+        if self._hungUp:
+            # The rest of what arrived with the message we hung up over.
+            return
+
+        if self.instrumentation is not None:
+            self.instrumentation.message_received(message)
 
         # These can come at any time
         if isinstance(message, Notice):
             return
-        elif isinstance(message, Error):
-            print(message)
-            self._pg.transport.loseConnection()
+        elif isinstance(message, ParameterStatus):
+            self._register_parameter(message)
+            return
+        elif isinstance(message, NotificationResponse):
+            self._dispatch_notification(message)
+            return
+        elif isinstance(message, ReadyForQuery):
+            # Noted before the input, so that callbacks fired by it see it.
+            self._transactionStatus = message.backend_status
+        elif type(message) is Error and message.severity in _FATAL_SEVERITIES:
+            self._fatal_error(message)
             return
 
-        rem = _convert_to_underscores_lmao.sub("_", message.__class__.__name__).upper()
-        func = getattr(self, "_REMOTE_" + rem, None)
+        func = getattr(self, _input_name(type(message)), None)
 
         if func is None:
-            print(f"Ignoring incoming message {message} as {rem}")
+            # Nothing we act on, such as ParameterDescription.
             return
 
         func(message)
         return
 
+    def listen(self, channel, callback):
+        """
+        Call C{callback} with every L{NotificationResponse} sent on
+        C{channel}, as soon as it arrives, whatever the connection is doing.
+
+        Any number of callbacks can listen on a channel; LISTEN is only sent
+        for the first. The returned future fires once the server is
+        listening.
+        """
+        listeners = self._listeners.get(channel)
+        self._listeners[channel] = (listeners or ()) + (callback,)
+
+        if listeners:
+            return self.succeeded(None)
+
+        from .bulk import _quote_identifier
+
+        return self.execute("LISTEN " + _quote_identifier(channel))
+
+    def unlisten(self, channel, callback=None):
+        """
+        Stop calling C{callback}, or every callback, for notifications on
+        C{channel}. UNLISTEN is sent once no callbacks are left.
+        """
+        listeners = self._listeners.get(channel, ())
+
+        if callback is not None:
+            # Compared by equality, so that a bound method can be passed
+            # again to stop it.
+            listeners = tuple(x for x in listeners if x != callback)
+        else:
+            listeners = ()
+
+        if listeners:
+            self._listeners[channel] = listeners
+            return self.succeeded(None)
+
+        if self._listeners.pop(channel, None) is None:
+            return self.succeeded(None)
+
+        from .bulk import _quote_identifier
+
+        return self.execute("UNLISTEN " + _quote_identifier(channel))
+
+    def succeeded(self, result):
+        """
+        A future of this connection's kind that has already fired with
+        C{result}, for code that answers without asking the server.
+        """
+        future = self._io_impl.make_callback()
+        self._io_impl.trigger_callback(future, result)
+        return future
+
+    def _dispatch_notification(self, message):
+        # The callbacks are kept in a tuple that is replaced, never changed,
+        # so that they can listen and unlisten while being called.
+        for callback in self._listeners.get(message.channel, ()):
+            try:
+                callback(message)
+            except Exception:
+                _log.exception("Listener for %r failed", message.channel)
+
     def new_transaction(self):
         return Transaction(self)
 
+    def new_pipelined_transaction(self):
+        return PipelinedTransaction(self)
+
+    def copy_out(
+        self,
+        target=None,
+        table=None,
+        query=None,
+        batch_rows=1000,
+        batch_bytes=256 * 1024,
+    ):
+        """
+        Copy a table, or the result of a query, out of the server, calling
+        C{target} with each CopyData.
+
+        Rows longer than C{stream_threshold} are passed to C{target} in
+        pieces, as L{CopyDataChunk}s of the raw bytes.
+
+        If C{target} returns a future or awaitable, the row counts as
+        unconsumed until it fires, and reading from the server is paused
+        while too many rows are unconsumed (see L{FlowControl}).
+
+        Without a C{target}, this returns a L{CopyOut} to iterate over the
+        rows in batches of C{batch_rows} rows or C{batch_bytes} bytes,
+        which saves a call per row.
+        """
+        if target is None:
+            rows = CopyOut(self, batch_rows, batch_bytes)
+            rows._start(table, query)
+            return rows
+
+        return self._last_result(self._copy_out(target, table, query))
+
     @_machine.input()
-    def copy_out(self, target, table=None, query=None):
+    def _copy_out(self, target, table=None, query=None):
         pass
 
     @_machine.output()
@@ -437,15 +2173,16 @@ class PostgresConnection(object):
         self._currentQuery = query
         self._currentVals = []
         self._ready_callback = self._io_impl.make_callback()
+        self._instrument_query(target_query)
         self._pg.sendQuery(target_query)
 
         return self._ready_callback
 
     READY.upon(
-        copy_out,
+        _copy_out,
         enter=WAITING_FOR_COPY_OUT_RESPONSE,
         outputs=[_do_copy_out],
-        collector=_get_last_collector,
+        collector=_collect_futures,
     )
 
     @_machine.output()
@@ -460,11 +2197,42 @@ class PostgresConnection(object):
 
     @_machine.output()
     def _on_copy_data(self, message):
-        self._copy_out_func(message)
+        target = self._copy_out_func
+
+        if type(message) is CopyDataBatch and type(target) is not CopyOut:
+            for fields in message.rows():
+                self._deliver_copy_data(target, CopyData(fields))
+        else:
+            self._deliver_copy_data(target, message)
+
+    def _deliver_copy_data(self, target, message):
+        result = target(message)
+
+        if result is not None:
+            # The target will finish with the row later, so hold off reading
+            # if it is falling behind.
+            future = self._io_impl.as_future(result)
+            if isinstance(message, CopyDataChunk):
+                rows, size = int(message.final), len(message.data)
+            else:
+                rows, size = 1, sum(map(len, message.data))
+            self._rows_buffered(rows, size)
+
+            def _consumed(result):
+                self._rows_consumed(rows, size)
+                return result
+
+            self._io_impl.add_both(future, _consumed)
 
     RECEIVING_COPY_DATA.upon(
         _REMOTE_COPY_DATA, enter=RECEIVING_COPY_DATA, outputs=[_on_copy_data]
     )
+    RECEIVING_COPY_DATA.upon(
+        _REMOTE_COPY_DATA_CHUNK, enter=RECEIVING_COPY_DATA, outputs=[_on_copy_data]
+    )
+    RECEIVING_COPY_DATA.upon(
+        _REMOTE_COPY_DATA_BATCH, enter=RECEIVING_COPY_DATA, outputs=[_on_copy_data]
+    )
 
     RECEIVING_COPY_DATA.upon(_REMOTE_COPY_DONE, enter=COPY_OUT_COMPLETE, outputs=[])
 
@@ -478,3 +2246,198 @@ class PostgresConnection(object):
         enter=COMMAND_COMPLETE,
         outputs=[],
     )
+
+    def _fail_when_ready(self, message, future):
+        """
+        Fail C{future} with the error in C{message} once the server has
+        recovered from it and is ready for the next query.
+        """
+        self._error = PostgresError.from_error(message)
+        self._failing_callback = future
+        self._currentQuery = None
+        self._currentVals = None
+        self._currentDescription = None
+        self._drop_rows()
+        self._partialRow = None
+        self._sunk = False
+
+    @_machine.output()
+    def _on_extended_query_error(self, message):
+        # The server discards everything until it sees a Sync, which we
+        # haven't sent yet.
+        self._pg.sync()
+        self._fail_when_ready(message, self._ready_callback)
+
+    @_machine.output()
+    def _on_query_error(self, message):
+        self._fail_when_ready(message, self._ready_callback)
+
+    @_machine.output()
+    def _on_simple_query_error(self, message):
+        self._fail_when_ready(message, self._result_callback)
+        self._stop_copy()
+
+        if self._copyError is not None:
+            # The server failed the COPY because we did, so say why.
+            self._error, self._copyError = self._copyError, None
+
+    @_machine.output()
+    def _on_ready_after_error(self, message):
+        future, error = self._failing_callback, self._error
+        self._failing_callback = None
+        self._error = None
+        # The operation is over, whichever of these it was waiting on.
+        self._ready_callback = None
+        self._result_callback = None
+
+        self._io_impl.fail_callback(future, error)
+
+    def _hang_up(self):
+        """
+        Close the connection, ignoring anything more the server sends.
+        """
+        self._hungUp = True
+        self._pg.transport.loseConnection()
+
+    @_machine.output()
+    def _on_startup_error(self, message):
+        # The server closes the connection after a failed startup.
+        ready_callback, self._ready_callback = self._ready_callback, None
+        self._auth = None
+        self._hang_up()
+        self._io_impl.fail_callback(ready_callback, PostgresError.from_error(message))
+
+    def _fail_pending(self, error):
+        """
+        Fail whatever is waiting on the server with C{error}, since it will
+        never answer.
+        """
+        pending = [
+            getattr(self, "_failing_callback", None),
+            getattr(self, "_ready_callback", None),
+            getattr(self, "_result_callback", None),
+        ]
+        self._failing_callback = self._ready_callback = self._result_callback = None
+        self._error = None
+        pipeline, self._pipeline = self._pipeline, None
+        self._auth = None
+        self._scram = None
+        self._currentQuery = None
+        self._currentVals = None
+        self._currentDescription = None
+        self._stop_copy()
+        self._drop_rows()
+        self._partialRow = None
+        self._sunk = False
+
+        for statement in pipeline or ():
+            if statement.future is not None:
+                self._io_impl.fail_callback(statement.future, error)
+
+        # The first is the one the caller is waiting on; any others are
+        # gathered into it.
+        future = next((x for x in pending if x is not None), None)
+        if future is not None:
+            self._io_impl.fail_callback(future, error)
+
+    @_machine.output()
+    def _on_fatal_error(self, message):
+        # The server is going away, and whatever was running with it.
+        self._hang_up()
+        self._fail_pending(PostgresError.from_error(message))
+
+    @_machine.input()
+    def _fatal_error(self, message):
+        pass
+
+    def _onConnectionLost(self, reason):
+        """
+        The connection to the server is gone, for the exception C{reason}.
+        """
+        self._connection_lost(reason)
+
+    @_machine.input()
+    def _connection_lost(self, reason):
+        pass
+
+    @_machine.output()
+    def _on_connection_lost(self, reason):
+        self._hungUp = True
+        self._fail_pending(reason)
+
+    for _state in (CONNECTING, WAITING_FOR_AUTH, WAITING_FOR_READY):
+        _state.upon(_REMOTE_ERROR, enter=DISCONNECTED, outputs=[_on_startup_error])
+
+    READY.upon(_REMOTE_ERROR, enter=DISCONNECTED, outputs=[_on_fatal_error])
+
+    for _state in (
+        CONNECTING,
+        WAITING_FOR_AUTH,
+        WAITING_FOR_READY,
+        WAITING_FOR_PARSE,
+        WAITING_FOR_DESCRIBE,
+        WAITING_FOR_BIND,
+        PREPARING,
+        WAITING_FOR_CLOSE,
+        READY,
+        NEEDS_AUTH,
+        RECEIVING_COPY_DATA,
+        EXECUTING,
+        SUSPENDED,
+        WAITING_FOR_COPY_OUT_RESPONSE,
+        COPY_OUT_COMPLETE,
+        COMMAND_COMPLETE,
+        EXECUTING_SIMPLE_QUERY,
+        PIPELINING,
+        WAITING_FOR_READY_AFTER_ERROR,
+    ):
+        _state.upon(_fatal_error, enter=DISCONNECTED, outputs=[_on_fatal_error])
+        _state.upon(_connection_lost, enter=DISCONNECTED, outputs=[_on_connection_lost])
+
+    # Hanging up after an error ends up here too.
+    DISCONNECTED.upon(_fatal_error, enter=DISCONNECTED, outputs=[])
+    DISCONNECTED.upon(_connection_lost, enter=DISCONNECTED, outputs=[])
+
+    for _state in (
+        WAITING_FOR_PARSE,
+        WAITING_FOR_DESCRIBE,
+        WAITING_FOR_BIND,
+        EXECUTING,
+        SUSPENDED,
+    ):
+        _state.upon(
+            _REMOTE_ERROR,
+            enter=WAITING_FOR_READY_AFTER_ERROR,
+            outputs=[_on_extended_query_error],
+        )
+
+    for _state in (
+        COMMAND_COMPLETE,
+        WAITING_FOR_CLOSE,
+        WAITING_FOR_COPY_OUT_RESPONSE,
+        RECEIVING_COPY_DATA,
+        COPY_OUT_COMPLETE,
+    ):
+        _state.upon(
+            _REMOTE_ERROR,
+            enter=WAITING_FOR_READY_AFTER_ERROR,
+            outputs=[_on_query_error],
+        )
+
+    EXECUTING_SIMPLE_QUERY.upon(
+        _REMOTE_ERROR,
+        enter=WAITING_FOR_READY_AFTER_ERROR,
+        outputs=[_on_simple_query_error],
+    )
+
+    PREPARING.upon(
+        _REMOTE_ERROR,
+        enter=WAITING_FOR_READY_AFTER_ERROR,
+        outputs=[_on_prepare_error],
+    )
+
+    WAITING_FOR_READY_AFTER_ERROR.upon(
+        _REMOTE_READY_FOR_QUERY, enter=READY, outputs=[_on_ready_after_error]
+    )
+
+    del _state
@@ -0,0 +1,144 @@
+"""
+The client side of SCRAM-SHA-256 (RFC 5802 and 7677), as PostgreSQL uses it.
+"""
+
+import base64
+import hashlib
+import hmac
+import os
+import stringprep
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import attr
+
+MECHANISM = "SCRAM-SHA-256"
+
+# We don't do channel binding.
+_GS2_HEADER = b"n,,"
+
+_CACHE_SIZE = 64
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class ScramError(Exception):
+    """
+    The server's side of the exchange didn't check out.
+    """
+
+
+def _saslprep(password):
+    # The mapping and normalisation steps of SASLprep (RFC 4013). The
+    # prohibited characters aren't checked for, because the server falls back
+    # to the password as it is when they are present.
+    chars = []
+    for c in password:
+        if stringprep.in_table_c12(c):
+            chars.append(" ")
+        elif not stringprep.in_table_b1(c):
+            chars.append(c)
+    return unicodedata.normalize("NFKC", "".join(chars))
+
+
+def _hmac(key, msg):
+    return hmac.new(key, msg, hashlib.sha256).digest()
+
+
+def derive_keys(password, salt, iterations):
+    """
+    The ClientKey and ServerKey for C{password}, which is the expensive part
+    of SCRAM. They are cached for the whole process, keyed by a hash of the
+    password along with the salt and iteration count, so that connecting
+    again with the same credentials skips it.
+    """
+    key = (hashlib.sha256(password).digest(), salt, iterations)
+
+    with _cache_lock:
+        keys = _cache.get(key)
+        if keys is not None:
+            _cache.move_to_end(key)
+            return keys
+
+    salted = hashlib.pbkdf2_hmac("sha256", password, salt, iterations)
+    keys = (_hmac(salted, b"Client Key"), _hmac(salted, b"Server Key"))
+
+    with _cache_lock:
+        _cache[key] = keys
+        while len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+
+    return keys
+
+
+def _parse(message):
+    try:
+        return dict(item.split(b"=", 1) for item in message.split(b","))
+    except ValueError:
+        raise ScramError("Malformed SCRAM message from the server: %r" % (message,))
+
+
+@attr.s
+class ScramClient(object):
+    """
+    One SCRAM exchange. Send C{client_first()}, answer the server's first
+    message with C{client_final(server_first)}, then check its final message
+    with C{verify(server_final)}.
+    """
+
+    _password = attr.ib(repr=False)
+    _nonce = attr.ib(factory=lambda: base64.b64encode(os.urandom(18)), repr=False)
+    _client_first_bare = attr.ib(default=None, init=False, repr=False)
+    _server_signature = attr.ib(default=None, init=False, repr=False)
+
+    def client_first(self):
+        # PostgreSQL takes the user name from the startup message instead.
+        self._client_first_bare = b"n=,r=" + self._nonce
+        return _GS2_HEADER + self._client_first_bare
+
+    def client_final(self, server_first):
+        fields = _parse(server_first)
+
+        try:
+            nonce = fields[b"r"]
+            salt = base64.b64decode(fields[b"s"], validate=True)
+            iterations = int(fields[b"i"])
+        except (KeyError, ValueError):
+            raise ScramError(
+                "Malformed SCRAM message from the server: %r" % (server_first,)
+            )
+
+        if not nonce.startswith(self._nonce):
+            raise ScramError("The server's nonce doesn't extend ours.")
+        elif iterations < 1:
+            raise ScramError("The server asked for %d iterations." % (iterations,))
+
+        password = _saslprep(self._password).encode("utf8")
+        client_key, server_key = derive_keys(password, salt, iterations)
+
+        without_proof = b"c=" + base64.b64encode(_GS2_HEADER) + b",r=" + nonce
+        auth_message = b",".join([self._client_first_bare, server_first, without_proof])
+
+        stored_key = hashlib.sha256(client_key).digest()
+        signature = _hmac(stored_key, auth_message)
+        proof = bytes(a ^ b for a, b in zip(client_key, signature))
+        self._server_signature = _hmac(server_key, auth_message)
+
+        return without_proof + b",p=" + base64.b64encode(proof)
+
+    def verify(self, server_final):
+        fields = _parse(server_final)
+
+        if b"e" in fields:
+            raise ScramError(fields[b"e"].decode("utf8", "replace"))
+
+        try:
+            signature = base64.b64decode(fields.get(b"v", b""), validate=True)
+        except ValueError:
+            raise ScramError("The server's signature is malformed.")
+
+        if self._server_signature is None or not hmac.compare_digest(
+            signature, self._server_signature
+        ):
+            raise ScramError("The server's signature is wrong.")
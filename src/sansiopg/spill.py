@@ -0,0 +1,182 @@
+"""
+Keeping the rows buffered for results within a memory budget, by spilling
+those beyond it to a temporary file, which is read back lazily.
+"""
+
+import array
+import mmap
+import struct
+import tempfile
+from collections.abc import Sequence
+
+import attr
+
+from .messages import DataRowBatch, _data_row_values
+
+_LENGTH = struct.Struct("!i")
+_NULL = _LENGTH.pack(-1)
+
+
+@attr.s
+class MemoryBudget(object):
+    """
+    At most C{limit} bytes of rows buffered at once, between everything that
+    shares this budget, and within the C{parent} budget too if there is one.
+    A C{limit} of None is no limit of its own.
+
+    Spill files go in C{directory}, or the default temporary directory.
+    """
+
+    limit = attr.ib(default=None)
+    parent = attr.ib(default=None)
+    directory = attr.ib(default=None)
+    used = attr.ib(default=0, init=False)
+
+    def reserve(self, size):
+        """
+        Take C{size} bytes of the budget, if there is room.
+        """
+        if self.limit is not None and self.used + size > self.limit:
+            return False
+        if self.parent is not None and not self.parent.reserve(size):
+            return False
+        self.used += size
+        return True
+
+    def release(self, size):
+        self.used -= size
+        if self.parent is not None:
+            self.parent.release(size)
+
+
+def as_budget(value):
+    """
+    A L{MemoryBudget} for C{value}, which may be one already or a limit.
+    """
+    if value is None or isinstance(value, MemoryBudget):
+        return value
+    return MemoryBudget(value)
+
+
+@attr.s
+class SpillFile(object):
+    """
+    Rows written to a temporary file as DataRows, which are length-prefixed
+    and so as compact as they came. Rows that can't be written, because
+    they hold values that were sent to a C{large_value_sink}, are kept in
+    memory in their place.
+    """
+
+    directory = attr.ib(default=None)
+    _file = attr.ib(default=None, init=False, repr=False)
+    _offsets = attr.ib(factory=lambda: array.array("q"), init=False, repr=False)
+    _kept = attr.ib(factory=list, init=False, repr=False)
+    _size = attr.ib(default=0, init=False)
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def add(self, row):
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(dir=self.directory)
+
+        if type(row) is DataRowBatch:
+            size = self._size
+            self._offsets.extend(size + offset for offset in row.offsets)
+            self._write(row.data)
+        elif all(type(value) is bytes or value is None for value in row):
+            parts = [b"", b"", struct.pack("!h", len(row))]
+            for value in row:
+                if value is None:
+                    parts.append(_NULL)
+                else:
+                    parts.append(_LENGTH.pack(len(value)))
+                    parts.append(value)
+            length = sum(map(len, parts)) + 4
+            parts[0:2] = [b"D", _LENGTH.pack(length)]
+            self._offsets.append(self._size)
+            self._write(b"".join(parts))
+        else:
+            self._offsets.append(-1 - len(self._kept))
+            self._kept.append(row)
+
+    def _write(self, data):
+        self._file.write(data)
+        self._size += len(data)
+
+    def read(self):
+        """
+        Finish writing, returning the rows written as the file mapped into
+        memory (or None if nothing was written), where each starts in it,
+        and the rows kept in memory.
+        """
+        mapped = None
+
+        if self._size:
+            self._file.flush()
+            mapped = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.close()
+        return mapped, self._offsets, self._kept
+
+    def close(self):
+        # The file has no name, so it goes once closed and no longer mapped.
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class SpilledResult(Sequence):
+    """
+    The rows of a result that went over the memory budget: the first ones
+    are in memory, and the rest are parsed and decoded from the spill file
+    as they are read. The file is deleted once this is closed or garbage.
+    """
+
+    def __init__(self, head, spill, decoders, result_type):
+        self._head = head
+        self._mapped, self._offsets, self._kept = spill.read()
+        self._decoders = list(enumerate(decoders))
+        self._result_type = result_type
+
+    def __len__(self):
+        return len(self._head) + len(self._offsets)
+
+    def __repr__(self):
+        return "<SpilledResult of %d rows, %d in memory>" % (len(self), len(self._head))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        if index < 0:
+            index += len(self)
+
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+
+        if index < len(self._head):
+            return self._head[index]
+        return self._row(self._offsets[index - len(self._head)])
+
+    def __iter__(self):
+        yield from self._head
+        for offset in self._offsets:
+            yield self._row(offset)
+
+    def _row(self, offset):
+        if offset < 0:
+            values = list(self._kept[-1 - offset])
+        else:
+            values = list(_data_row_values(self._mapped, offset))
+
+        for index, decoder in self._decoders:
+            if decoder is not None and type(values[index]) is bytes:
+                values[index] = decoder(values[index])
+
+        return self._result_type._make(values)
+
+    def close(self):
+        if self._mapped is not None:
+            self._mapped.close()
+            self._mapped = None
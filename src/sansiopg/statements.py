@@ -0,0 +1,94 @@
+"""
+Named prepared statements, for the queries that are run often enough to be
+worth keeping parsed and planned on the server.
+"""
+
+from collections import Counter
+
+import attr
+
+from .errors import PostgresError
+
+# Named statements are ours, so they are given names nothing else will use.
+STATEMENT_PREFIX = "_sansiopg_"
+
+
+@attr.s(frozen=True)
+class PreparedStatement(object):
+    """
+    A statement prepared as C{name}, with what the server said its
+    parameters and columns are. C{description} is None if it returns no
+    rows.
+    """
+
+    name = attr.ib()
+    parameter_types = attr.ib()
+    description = attr.ib()
+
+
+@attr.s
+class StatementRegistry(object):
+    """
+    How often each query has been run with parameters, to learn which are
+    hot: those run at least C{threshold} times. A connection with a
+    registry prepares its hot statements as named statements, up to
+    C{max_statements} of them, and binds them from then on instead of
+    parsing them again.
+
+    Only C{max_tracked} queries are counted; past that, every count is
+    halved and those that reach nothing are forgotten, so that queries that
+    stop being run make way for new ones.
+
+    A pool shares one between its connections, and prepares the hot
+    statements on each new connection before handing it out.
+    """
+
+    threshold = attr.ib(default=5)
+    max_statements = attr.ib(default=100)
+    max_tracked = attr.ib(default=10000)
+    _counts = attr.ib(factory=Counter, init=False, repr=False)
+
+    def used(self, query):
+        """
+        Count a run of C{query}, returning whether it is hot.
+        """
+        counts = self._counts
+        count = counts[query] = counts[query] + 1
+
+        if len(counts) > self.max_tracked:
+            self._age()
+
+        return count >= self.threshold
+
+    def _age(self):
+        for query, count in list(self._counts.items()):
+            if count > 1:
+                self._counts[query] = count // 2
+            else:
+                del self._counts[query]
+
+    def hot(self):
+        """
+        The hot queries, the most used first.
+        """
+        return [
+            query
+            for query, count in self._counts.most_common(self.max_statements)
+            if count >= self.threshold
+        ]
+
+
+def invalidated(error):
+    """
+    Whether C{error} says that a prepared statement has to be prepared
+    again: the server no longer has it, say after a C{DISCARD ALL}, or the
+    schema has changed under it so that its result would be different.
+    """
+    if not isinstance(error, PostgresError):
+        return False
+    elif error.sqlstate == "26000":
+        return True
+    return (
+        error.sqlstate == "0A000"
+        and error.error.info.get("routine") == "RevalidateCachedQuery"
+    )
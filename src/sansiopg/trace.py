@@ -0,0 +1,503 @@
+"""
+Recording and replaying the raw bytes of a connection.
+
+A trace is a header followed by records of a direction, a timestamp and the
+bytes that were written or received. Since the protocol is sans-I/O, that
+is enough to push the same workload through L{ParserFeed} and
+L{PostgresConnection} again, without a network or a server.
+"""
+
+import struct
+import time
+from collections import Counter
+
+import attr
+
+from .conversion import Converter
+from .messages import BindParam
+from .parser import ParserFeed
+from .protocol import PostgresConnection, _PipelinedStatement
+
+_MAGIC = b"PGTRACE1"
+_RECORD = struct.Struct("!cdI")
+
+INBOUND = b"<"
+OUTBOUND = b">"
+
+
+@attr.s
+class TraceRecord(object):
+    direction = attr.ib()
+    timestamp = attr.ib()
+    data = attr.ib()
+
+
+@attr.s
+class TraceWriter(object):
+    """
+    Write a trace to C{file}, which must be opened in binary mode.
+    """
+
+    _file = attr.ib()
+    clock = attr.ib(default=time.time)
+
+    def __attrs_post_init__(self):
+        self._file.write(_MAGIC)
+
+    @classmethod
+    def open(cls, path):
+        return cls(open(path, "wb"))
+
+    def inbound(self, data):
+        self._write(INBOUND, data)
+
+    def outbound(self, data):
+        self._write(OUTBOUND, data)
+
+    def _write(self, direction, data):
+        self._file.write(_RECORD.pack(direction, self.clock(), len(data)))
+        self._file.write(data)
+
+    def close(self):
+        self._file.close()
+
+
+def read_trace(file):
+    """
+    Read the L{TraceRecord}s of a trace from C{file}, or from the path given.
+    """
+    if isinstance(file, str):
+        with open(file, "rb") as f:
+            return read_trace(f)
+
+    content = file.read()
+
+    if content[: len(_MAGIC)] != _MAGIC:
+        raise ValueError("Not a trace file.")
+
+    records = []
+    offset = len(_MAGIC)
+
+    while offset < len(content):
+        direction, timestamp, length = _RECORD.unpack_from(content, offset)
+        offset += _RECORD.size
+        records.append(
+            TraceRecord(direction, timestamp, content[offset : offset + length])
+        )
+        offset += length
+
+    return records
+
+
+def replay_parser(records, server_encoding="utf8"):
+    """
+    Feed the inbound side of a trace through a L{ParserFeed}, returning how
+    many messages it produced.
+    """
+    feed = ParserFeed(server_encoding)
+    count = 0
+
+    for record in records:
+        if record.direction == INBOUND:
+            count += len(feed.feed(record.data))
+
+    return count
+
+
+def _frontend_messages(records):
+    """
+    Split the outbound side of a trace into (index of the record it ends in,
+    type code, body) for each message. The startup message has a type code
+    of None.
+    """
+    buf = b""
+    started = False
+
+    for index, record in enumerate(records):
+        if record.direction != OUTBOUND:
+            continue
+
+        buf += record.data
+
+        while True:
+            if not started:
+                if len(buf) < 4:
+                    break
+                (length,) = struct.unpack("!i", buf[:4])
+                if len(buf) < length:
+                    break
+                body, buf = buf[4:length], buf[length:]
+                (code,) = struct.unpack("!i", body[:4])
+                # SSL and cancel requests don't start the conversation.
+                started = code == 196608
+                yield index, None, body
+                continue
+
+            if len(buf) < 5:
+                break
+            (length,) = struct.unpack("!i", buf[1:5])
+            if len(buf) < length + 1:
+                break
+            yield index, buf[0:1], buf[5 : length + 1]
+            buf = buf[length + 1 :]
+
+
+def _parse_startup(body):
+    parts = body[4:].split(b"\0")
+    return dict(zip(parts[0::2], parts[1::2]))
+
+
+def _parse_parse(body, encoding):
+    name, query, _ = body.split(b"\0", 2)
+    return name.decode(encoding), query.decode(encoding)
+
+
+def _parse_bind(body):
+    portal, statement, rest = body.split(b"\0", 2)
+    (format_count,) = struct.unpack("!h", rest[:2])
+    formats = struct.unpack("!%dh" % (format_count,), rest[2 : 2 + 2 * format_count])
+    offset = 2 + 2 * format_count
+    (param_count,) = struct.unpack("!h", rest[offset : offset + 2])
+    offset += 2
+
+    if format_count < param_count:
+        # None means all text, and one means all the same.
+        formats = (formats[0] if formats else 0,) * param_count
+
+    params = []
+    for x in range(param_count):
+        (length,) = struct.unpack("!i", rest[offset : offset + 4])
+        offset += 4
+        if length == -1:
+            params.append(BindParam(formats[x], None))
+        else:
+            params.append(BindParam(formats[x], rest[offset : offset + length]))
+            offset += length
+
+    return params
+
+
+def _parse_execute(body):
+    (rows,) = struct.unpack("!i", body[-4:])
+    return rows
+
+
+class _PassthroughConverter(Converter):
+    """
+    Parameters in a trace have already been encoded.
+    """
+
+    def to_postgres(self, value, encoding="utf8", data_type=None):
+        return value
+
+
+@attr.s
+class _ReplayFuture(object):
+
+    _callbacks = attr.ib(factory=list)
+    _fired = attr.ib(default=False)
+    _result = attr.ib(default=None)
+
+    def add(self, callback):
+        if self._fired:
+            self._result = callback(self._result)
+        else:
+            self._callbacks.append(callback)
+
+    def fire(self, result):
+        self._fired = True
+        self._result = result
+        while self._callbacks:
+            self._result = self._callbacks.pop(0)(self._result)
+
+
+class _NullTransport(object):
+    def loseConnection(self):
+        pass
+
+
+@attr.s
+class _ReplayProtocol(object):
+    """
+    Stands in for the network side of the connection. Queries the connection
+    sends by itself, like the ROLLBACK of a failed pipeline, are noted so
+    that the replay doesn't issue them a second time.
+    """
+
+    _encoding = attr.ib(default="utf8")
+    transport = attr.ib(factory=_NullTransport)
+    sent = attr.ib(factory=Counter)
+
+    def sendQuery(self, query):
+        self.sent[(b"Q", query)] += 1
+
+    def sendParse(self, query, name=""):
+        self.sent[(b"P", query)] += 1
+
+    def sendPipelinedQuery(self, query, bind):
+        self.sent[(b"P", query)] += 1
+
+    def __getattr__(self, name):
+        if name.startswith("send") or name in ("flush", "sync", "close"):
+            return lambda *args, **kwargs: None
+        raise AttributeError(name)
+
+
+@attr.s
+class _ReplayPortal(object):
+    """
+    Stands in for a L{Cursor}, dropping each batch as it comes. The next is
+    fetched when the trace says the client fetched it.
+    """
+
+    _conn = attr.ib()
+
+    def _batch_received(self, suspended):
+        rows, spill = self._conn._take_rows()
+        self._conn._sunk = False
+        if spill is not None:
+            spill.close()
+
+
+@attr.s
+class _ReplayDelayedCall(object):
+    """
+    A call that never comes: a replay has no clock, and whatever a deadline
+    would have cancelled finished as it did in the trace.
+    """
+
+    _active = attr.ib(default=True)
+
+    def active(self):
+        return self._active
+
+    def cancel(self):
+        self._active = False
+
+
+@attr.s
+class _ReplayIOImplementation(object):
+    """
+    Runs callbacks synchronously and has no network.
+    """
+
+    def connect(self, connection, endpoint, database, username, password=None):
+        connection._pg = _ReplayProtocol(connection.encoding)
+
+    def make_callback(self):
+        return _ReplayFuture()
+
+    def trigger_callback(self, future, result):
+        future.fire(result)
+
+    def fail_callback(self, future, exception):
+        future.fire(exception)
+
+    def add_callback(self, future, callback):
+        future.add(
+            lambda result: result if isinstance(result, Exception) else callback(result)
+        )
+
+    def add_both(self, future, callback):
+        future.add(callback)
+
+    def add_errback(self, future, callback):
+        def _errback(result):
+            if not isinstance(result, Exception):
+                return result
+            try:
+                return callback(result)
+            except Exception as e:
+                return e
+
+        future.add(_errback)
+
+    def submit(self, pool, func, *args):
+        future = _ReplayFuture()
+        future.fire(func(*args))
+        return future
+
+    def gather_last(self, futures):
+        # Failures are passed on as results here, so the last is enough.
+        return futures[-1]
+
+    def call_later(self, seconds, func):
+        return _ReplayDelayedCall()
+
+    def produce(self, connection, pause, resume):
+        pass
+
+    def stop_producing(self, connection):
+        pass
+
+
+def replay_connection(records, encoding="utf8", instrumentation=None):
+    """
+    Drive a L{PostgresConnection} with a trace: the queries the client sent
+    are issued again, and the bytes the server sent are fed back in, as fast
+    as possible. Returns the connection.
+
+    Connects, simple and extended queries, prepared statements, portals,
+    COPY OUT and pipelined transactions are replayed; anything else the
+    client sent is skipped.
+    """
+    conn = PostgresConnection(
+        _ReplayIOImplementation(),
+        encoding=encoding,
+        converter=_PassthroughConverter(),
+        instrumentation=instrumentation,
+        # Any types that were looked up are in the trace, as queries.
+        types=None,
+    )
+    feed = ParserFeed(encoding, batch_copy=True)
+    outbound = list(_frontend_messages(records))
+    # The queries of statements the client named, by name.
+    names = {}
+    position = 0
+
+    def _issue(upto):
+        # Issue the calls for everything the client sent before record
+        # number `upto`.
+        nonlocal position
+
+        while position < len(outbound) and outbound[position][0] < upto:
+            position = _issue_one(position)
+
+    def _issue_one(position):
+        index, type_code, body = outbound[position]
+
+        if type_code is None:
+            params = _parse_startup(body)
+            if b"user" in params:
+                conn.connect(
+                    None,
+                    params.get(b"database", b"").decode(encoding),
+                    params[b"user"].decode(encoding),
+                )
+            return position + 1
+
+        if type_code == b"Q":
+            query = body[:-1].decode(encoding)
+            if not _already_sent(b"Q", query):
+                if query.startswith("COPY ") and query.endswith(" TO STDOUT"):
+                    source = query[len("COPY ") : -len(" TO STDOUT")]
+                    if source.startswith("("):
+                        conn.copy_out(lambda message: None, query=source[1:-1])
+                    else:
+                        conn.copy_out(lambda message: None, table=source)
+                else:
+                    conn.script(query)
+                conn._pg.sent[(b"Q", query)] -= 1
+            return position + 1
+
+        if type_code == b"P":
+            return _issue_extended(position)
+
+        if type_code == b"B":
+            # A statement that was prepared earlier, bound without a Parse,
+            # and executed whole or, with a row limit, as a portal.
+            _, statement, _ = body.split(b"\0", 2)
+            query = names.get(statement.decode(encoding))
+            end = position + 1
+            while end < len(outbound) and outbound[end][1] == b"H":
+                end += 1
+            if end == len(outbound) or outbound[end][1] != b"E":
+                return position + 1
+
+            if query in conn._prepared:
+                vals = _parse_bind(body)
+                rows = _parse_execute(outbound[end][2])
+                if rows:
+                    conn._portal_query(_ReplayPortal(conn), query, vals, (), rows)
+                else:
+                    conn._prepared_query(query, vals)
+            return end + 1
+
+        if type_code == b"E":
+            # Any other Execute with a row limit fetches from a portal.
+            rows = _parse_execute(body)
+            if rows:
+                conn._fetch(rows)
+            return position + 1
+
+        if type_code == b"C":
+            kind, name = body[:1], body[1:-1].decode(encoding)
+            if kind == b"P":
+                conn._close()
+            elif name in names:
+                conn._forget_statement(names.pop(name))
+            return position + 1
+
+        return position + 1
+
+    def _already_sent(type_code, query):
+        sent = conn._pg.sent
+        if sent[(type_code, query)] > 0:
+            sent[(type_code, query)] -= 1
+            return True
+        return False
+
+    def _issue_extended(start):
+        # A Flush straight after the Parse means a plain extended query, or
+        # prepare() if there is a Describe but no Bind before the Sync;
+        # otherwise it is a pipeline that runs until the Sync.
+        statements = []
+        parsed = []
+        described = False
+        position = start
+        pipelined = not (start + 1 < len(outbound) and outbound[start + 1][1] == b"H")
+
+        while position < len(outbound):
+            index, type_code, body = outbound[position]
+            position += 1
+
+            if type_code == b"P":
+                parsed.append(_parse_parse(body, encoding))
+            elif type_code == b"D":
+                described = True
+            elif type_code == b"B" and len(parsed) > len(statements):
+                statements.append(_PipelinedStatement(parsed[-1][1], _parse_bind(body)))
+                if not pipelined:
+                    break
+            elif type_code == b"S":
+                break
+
+        name, query = parsed[0]
+
+        if pipelined:
+            if _already_sent(b"P", query):
+                return start + 1
+            conn._run_pipeline(statements)
+            for statement in statements:
+                conn._pg.sent[(b"P", statement.query)] -= 1
+            return position
+
+        # The rest of the cycle, up to its Bind, is sent by the connection.
+        if _already_sent(b"P", query):
+            return position
+
+        names.update((n, q) for n, q in parsed if n)
+
+        if described and not statements:
+            queries = [q for n, q in parsed]
+            conn.prepare(queries)
+            for q in queries:
+                _already_sent(b"P", q)
+        else:
+            vals = statements[0].vals if statements else []
+            conn._extended_query(query, vals, (), name)
+            conn._pg.sent[(b"P", query)] -= 1
+
+        return position
+
+    for number, record in enumerate(records):
+        if record.direction == OUTBOUND:
+            continue
+
+        _issue(number)
+
+        for message in feed.feed(record.data):
+            conn._onMessage(message)
+
+    _issue(len(records))
+    return conn
@@ -1,7 +1,37 @@
-from .protocol import TwistedIOImplementation
+"""
+sansiopg on Twisted.
 
-from sansiopg.protocol import PostgresConnection
+Twisted and the protocol modules are only imported once a connection is made,
+or one of their names is looked up here, so that importing txpg is cheap.
+"""
 
+import importlib
 
-def new_connection(encoding="utf8", debug=True):
-    return PostgresConnection(TwistedIOImplementation(debug=debug), encoding=encoding)
+_LAZY = {
+    "TwistedIOImplementation": "txpg.protocol",
+    "PostgresConnection": "sansiopg.protocol",
+}
+
+
+def _load(name):
+    value = globals().get(name)
+
+    if value is None:
+        module = importlib.import_module(_LAZY[name])
+        value = globals()[name] = getattr(module, name)
+
+    return value
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    return _load(name)
+
+
+def new_connection(encoding="utf8", debug=False, instrumentation=None):
+    return _load("PostgresConnection")(
+        _load("TwistedIOImplementation")(debug=debug),
+        encoding=encoding,
+        instrumentation=instrumentation,
+    )
@@ -0,0 +1,424 @@
+"""
+Pools of connections to one server, and a router that spreads queries over
+the pools of a primary and its replicas.
+"""
+
+import time
+from collections import deque
+
+import attr
+from twisted.internet import defer
+from twisted.internet.error import (
+    ConnectError,
+    ConnectionClosed,
+    ConnectionDone,
+    DNSLookupError,
+)
+from twisted.python.failure import Failure
+
+from sansiopg.errors import PostgresError
+from sansiopg.instrumentation import Instrumentation
+from sansiopg.introspection import TypeCache
+from sansiopg.protocol import PostgresConnection
+from sansiopg.spill import MemoryBudget
+
+from .protocol import TwistedIOImplementation, host_endpoint
+
+PRIMARY = "primary"
+REPLICA = "replica"
+
+
+def _role_of(parameters):
+    """
+    The role of a server, going by whether it is a hot standby, or None if
+    it hasn't said. Servers report in_hot_standby from PostgreSQL 14 on.
+
+    Being read-only by default doesn't tell, since a primary can be too.
+    """
+    value = parameters.get("in_hot_standby")
+
+    if value is None:
+        return None
+    elif value == "on":
+        return REPLICA
+    return PRIMARY
+
+
+class NoHostAvailable(Exception):
+    """
+    No server that can run the query is up.
+    """
+
+
+# Resolving the host name is part of connecting, as far as failing over goes.
+_CONNECT_FAILURES = (ConnectError, DNSLookupError)
+
+
+class _WrongRole(Exception):
+    pass
+
+
+def _new_connection():
+    return PostgresConnection(TwistedIOImplementation())
+
+
+@attr.s
+class ConnectionPool(object):
+    """
+    Up to C{max_size} connections to the server at C{endpoint}.
+
+    After a connection fails to be made, or drops, the server is considered
+    down for C{retry_after} seconds.
+
+    The connections share a L{TypeCache}, since they are all to the same
+    server.
+
+    Results being received are held to C{connection_memory_budget} bytes of
+    rows for each connection, and C{memory_budget} between them, beyond
+    which they are spilled to disk (see L{MemoryBudget}).
+
+    If C{statements} is a L{StatementStats}, the connections keep their
+    latency histograms in it.
+
+    If C{registry} is a L{StatementRegistry}, the connections learn which
+    statements are hot from it and prepare them, and each new connection
+    has the hot statements prepared before it is handed out.
+    """
+
+    endpoint = attr.ib()
+    database = attr.ib()
+    username = attr.ib()
+    password = attr.ib(default=None, repr=False)
+    max_size = attr.ib(default=10)
+    retry_after = attr.ib(default=5.0)
+    connection_factory = attr.ib(default=_new_connection, repr=False)
+    memory_budget = attr.ib(default=None)
+    connection_memory_budget = attr.ib(default=None)
+    statements = attr.ib(default=None)
+    registry = attr.ib(default=None)
+    clock = attr.ib(default=time.monotonic, repr=False)
+    role = attr.ib(default=None, init=False)
+    latency = attr.ib(default=None, init=False)
+    down_until = attr.ib(default=None, init=False)
+    types = attr.ib(factory=TypeCache, init=False, repr=False)
+    # Connections compare by value, so these go by id().
+    _idle = attr.ib(factory=dict, init=False, repr=False)
+    _busy = attr.ib(factory=dict, init=False, repr=False)
+    _running = attr.ib(factory=dict, init=False, repr=False)
+    _connecting = attr.ib(default=0, init=False, repr=False)
+    _waiting = attr.ib(factory=deque, init=False, repr=False)
+    _budget = attr.ib(init=False, repr=False)
+
+    @_budget.default
+    def _budget_default(self):
+        if self.memory_budget is not None:
+            return MemoryBudget(self.memory_budget)
+
+    @property
+    def in_use(self):
+        return len(self._busy) + self._connecting
+
+    @property
+    def load(self):
+        return (self.in_use + len(self._waiting)) / self.max_size
+
+    def available(self):
+        return self.down_until is None or self.down_until <= self.clock()
+
+    async def acquire(self):
+        if self._idle:
+            conn = self._idle.popitem()[1]
+        elif self.in_use < self.max_size:
+            self._connecting += 1
+            try:
+                conn = await self._connect()
+            finally:
+                self._connecting -= 1
+        else:
+            waiter = defer.Deferred()
+            self._waiting.append(waiter)
+            conn = await waiter
+
+        self._busy[id(conn)] = conn
+        return conn
+
+    def release(self, conn):
+        self._busy.pop(id(conn), None)
+
+        if conn._pg.lost.called:
+            return
+
+        if not conn.idle:
+            # Something is still running on it, or it was left in a
+            # transaction, so the next user would inherit that.
+            conn._pg.transport.loseConnection()
+            return
+
+        self.role = _role_of(conn._parameters)
+
+        if self._waiting:
+            self._waiting.popleft().callback(conn)
+        else:
+            self._idle[id(conn)] = conn
+
+    async def _connect(self):
+        conn = self.connection_factory()
+        # Types are looked up once for the server, not once per connection.
+        conn.types = self.types
+
+        if self.statements is not None:
+            if conn.instrumentation is None:
+                conn.instrumentation = Instrumentation()
+                conn.trace_states(conn.instrumentation.state_changed)
+            conn.instrumentation.statements = self.statements
+
+        if self.registry is not None:
+            conn.registry = self.registry
+
+        if self._budget is not None or self.connection_memory_budget is not None:
+            conn.memory_budget = MemoryBudget(
+                self.connection_memory_budget, parent=self._budget
+            )
+
+        try:
+            await conn.connect(
+                self.endpoint, self.database, self.username, self.password
+            )
+        except _CONNECT_FAILURES:
+            self._mark_down()
+            raise
+
+        try:
+            if _role_of(conn._parameters) is None:
+                # An older server, so we have to ask, and note the answer as
+                # a newer one would have reported it.
+                rows = await conn.query("SELECT pg_is_in_recovery()")
+                conn._parameters["in_hot_standby"] = "on" if rows[0][0] else "off"
+
+            if self.registry is not None:
+                hot = self.registry.hot()
+                if hot:
+                    try:
+                        await conn.prepare(hot)
+                    except PostgresError:
+                        # One of them no longer prepares, and it and those
+                        # after it will be prepared as they are used instead.
+                        pass
+        except BaseException:
+            # Nobody else will close it.
+            conn._pg.transport.loseConnection()
+            raise
+
+        self.down_until = None
+        self.role = _role_of(conn._parameters)
+        conn._pg.lost.addCallback(self._lost, conn)
+        return conn
+
+    def _mark_down(self):
+        self.down_until = self.clock() + self.retry_after
+
+    def _lost(self, reason, conn):
+        self._busy.pop(id(conn), None)
+        self._idle.pop(id(conn), None)
+        running = self._running.pop(id(conn), None)
+
+        # An idle connection being closed cleanly is more likely to be an
+        # idle timeout than the server going away.
+        if running is not None or not isinstance(reason, ConnectionDone):
+            self._mark_down()
+
+        if running is not None:
+            running.errback(reason)
+
+        if self._waiting and self.available():
+            # There is room for another connection now.
+            waiter = self._waiting.popleft()
+            self._connecting += 1
+            d = defer.ensureDeferred(self._connect())
+            d.addBoth(self._connected_for, waiter)
+
+    def _connected_for(self, result, waiter):
+        self._connecting -= 1
+
+        if isinstance(result, Failure):
+            waiter.errback(result)
+        else:
+            waiter.callback(result)
+
+    async def run(self, func, role=None):
+        """
+        Call C{func} with a connection, returning what its future or
+        awaitable does. The call fails with the connection if the connection
+        drops in the meantime.
+        """
+        conn = await self.acquire()
+
+        try:
+            if role is not None and self.role != role:
+                raise _WrongRole(self.role)
+
+            start = time.perf_counter()
+            result = await self._unless_lost(conn, defer.ensureDeferred(func(conn)))
+            elapsed = time.perf_counter() - start
+
+            if self.latency is None:
+                self.latency = elapsed
+            else:
+                self.latency = 0.8 * self.latency + 0.2 * elapsed
+
+            return result
+        finally:
+            self.release(conn)
+
+    def _unless_lost(self, conn, d):
+        result = defer.Deferred()
+        self._running[id(conn)] = result
+
+        def _done(res):
+            if self._running.pop(id(conn), None) is result:
+                result.callback(res)
+            elif isinstance(res, Failure):
+                # The connection dropped first; this is just the fallout.
+                return None
+
+        d.addBoth(_done)
+        return result
+
+    def query(self, query, vals=[], timeout=None):
+        return defer.ensureDeferred(
+            self.run(lambda conn: conn.query(query, vals, timeout=timeout))
+        )
+
+    def execute(self, command, args=[], timeout=None):
+        return defer.ensureDeferred(
+            self.run(lambda conn: conn.execute(command, args, timeout=timeout))
+        )
+
+    def close(self):
+        while self._waiting:
+            self._waiting.popleft().cancel()
+
+        for conn in list(self._idle.values()) + list(self._busy.values()):
+            conn._pg.transport.loseConnection()
+
+
+@attr.s
+class Router(object):
+    """
+    Send writes to the primary and read-only queries to the replicas, going
+    by the roles the servers report, and fail over when one drops.
+
+    With the C{least_loaded} strategy the server with the smallest share of
+    its pool in use is picked. With C{latency} it is the one with the
+    lowest recent latency, weighted by how many queries it is already
+    running.
+    """
+
+    pools = attr.ib()
+    strategy = attr.ib(default="least_loaded")
+
+    @strategy.validator
+    def _check_strategy(self, attribute, value):
+        if value not in ("least_loaded", "latency"):
+            raise ValueError("Unknown strategy %r" % (value,))
+
+    @classmethod
+    def for_hosts(cls, reactor, hosts, database, username, password=None, **kwargs):
+        """
+        A router over a pool for each of C{hosts}; see L{host_endpoint} for what
+        they can be. Other keyword arguments are passed to the pools, except
+        C{strategy}.
+        """
+        strategy = kwargs.pop("strategy", "least_loaded")
+        pools = [
+            ConnectionPool(
+                host_endpoint(reactor, host), database, username, password, **kwargs
+            )
+            for host in hosts
+        ]
+        return cls(pools, strategy)
+
+    async def refresh(self):
+        """
+        Connect to every server not known to be down, to learn its role.
+        """
+
+        async def _probe(pool):
+            try:
+                pool.release(await pool.acquire())
+            except _CONNECT_FAILURES:
+                pass
+
+        await defer.gatherResults(
+            [
+                defer.ensureDeferred(_probe(pool))
+                for pool in self.pools
+                if pool.available()
+            ]
+        )
+
+    def _choose(self, read_only, tried):
+        up = [pool for pool in self.pools if id(pool) not in tried and pool.available()]
+
+        if read_only:
+            preferences = (REPLICA, None, PRIMARY)
+        else:
+            preferences = (PRIMARY, None)
+
+        for role in preferences:
+            candidates = [pool for pool in up if pool.role == role]
+            if candidates:
+                return min(candidates, key=self._cost)
+
+        return None
+
+    def _cost(self, pool):
+        if self.strategy == "latency":
+            return ((pool.latency or 0.0) * (1 + pool.in_use), pool.load)
+        return (pool.load, pool.latency or 0.0)
+
+    async def run(self, func, read_only=False):
+        """
+        Call C{func} with a connection to the primary, or to a replica if
+        C{read_only}, as in L{ConnectionPool.run}.
+
+        If the server can't be connected to, another is tried. If it drops
+        while a read-only C{func} is running, that is retried elsewhere too;
+        anything else might have taken effect, so the failure is passed on.
+        """
+        tried = set()
+
+        while True:
+            pool = self._choose(read_only, tried)
+
+            if pool is None:
+                raise NoHostAvailable(
+                    "No %s server is available." % ("read" if read_only else PRIMARY,)
+                )
+
+            tried.add(id(pool))
+
+            try:
+                return await pool.run(func, None if read_only else PRIMARY)
+            except _CONNECT_FAILURES + (_WrongRole,):
+                continue
+            except ConnectionClosed:
+                if read_only:
+                    continue
+                raise
+
+    def query(self, query, vals=[], timeout=None, read_only=False):
+        return defer.ensureDeferred(
+            self.run(lambda conn: conn.query(query, vals, timeout=timeout), read_only)
+        )
+
+    def execute(self, command, args=[], timeout=None, read_only=False):
+        return defer.ensureDeferred(
+            self.run(
+                lambda conn: conn.execute(command, args, timeout=timeout), read_only
+            )
+        )
+
+    def close(self):
+        for pool in self.pools:
+            pool.close()
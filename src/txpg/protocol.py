@@ -1,16 +1,29 @@
+import inspect
+import os
+import socket
+
 import attr
 
 from twisted.internet import defer
+from twisted.internet.endpoints import HostnameEndpoint, UNIXClientEndpoint
+from twisted.internet.interfaces import IPushProducer
 from twisted.internet.protocol import Protocol, Factory
+from zope.interface import implementer
 from sansiopg.messages import (
     Bind,
+    CancelRequest,
     Describe,
     Execute,
     Flush,
     Close,
+    CopyData,
+    CopyDone,
+    CopyFail,
     Parse,
     PasswordMessage,
     Query,
+    SaslInitialResponse,
+    SaslResponse,
     StartupMessage,
     Sync,
 )
@@ -18,6 +31,59 @@ from sansiopg.messages import (
 
 from sansiopg.parser import ParserFeed
 
+# The keepalive options, where the platform has them.
+_KEEPALIVE_OPTIONS = {
+    "keepalive_idle": getattr(socket, "TCP_KEEPIDLE", None),
+    "keepalive_interval": getattr(socket, "TCP_KEEPINTVL", None),
+    "keepalive_count": getattr(socket, "TCP_KEEPCNT", None),
+}
+
+
+def host_endpoint(reactor, host, port=5432):
+    """
+    An endpoint for C{host}, which may be C{"host"}, C{"host:port"} (with
+    IPv6 addresses in brackets), the path of a UNIX socket, or of the
+    directory it is in as libpq takes it, optionally followed by
+    C{":port"}, or already an endpoint. C{port} is used when C{host} doesn't
+    give one.
+    """
+    if not isinstance(host, str):
+        return host
+    elif host.startswith("/"):
+        directory, _, suffix = host.rpartition(":")
+        if directory and suffix.isdigit() and not os.path.exists(host):
+            host, port = directory, int(suffix)
+        if os.path.isdir(host):
+            # The server names its socket after the port it listens on.
+            host = os.path.join(host, ".s.PGSQL.%d" % (int(port),))
+        return UNIXClientEndpoint(reactor, host)
+
+    if ":" in host:
+        host, _, port = host.rpartition(":")
+    return HostnameEndpoint(reactor, host.strip("[]"), int(port))
+
+
+@implementer(IPushProducer)
+@attr.s
+class _Producer(object):
+    """
+    Passes on the transport asking a connection to pause or resume what it
+    is sending.
+    """
+
+    _pause = attr.ib()
+    _resume = attr.ib()
+
+    def pauseProducing(self):
+        self._pause()
+
+    def resumeProducing(self):
+        self._resume()
+
+    def stopProducing(self):
+        # The connection is gone, and the query with it.
+        self._pause()
+
 
 @attr.s
 class PostgreSQLClientProtocol(Protocol):
@@ -27,18 +93,38 @@ class PostgreSQLClientProtocol(Protocol):
     _on_message = attr.ib()
     _debug = attr.ib(default=False)
     _encoding = attr.ib(default="utf8")
+    _instrumentation = attr.ib(default=None)
+    _trace = attr.ib(default=None)
+    _stream_threshold = attr.ib(default=None)
+    _batch_rows = attr.ib(default=False)
+    _configure_transport = attr.ib(default=None)
+    _on_lost = attr.ib(default=None)
     _parser = attr.ib()
+    lost = attr.ib(factory=defer.Deferred, init=False, repr=False)
 
     @_parser.default
     def _parser_build(self):
-        return ParserFeed(self._encoding)
+        return ParserFeed(
+            self._encoding,
+            self._stream_threshold,
+            self._batch_rows,
+            batch_copy=True,
+        )
 
     def send(self, msg):
         if self._debug:
             print(">>> " + repr(msg))
-        self.transport.write(msg.ser())
+        data = msg.ser()
+        if self._instrumentation is not None:
+            self._instrumentation.bytes_sent(len(data))
+        if self._trace is not None:
+            self._trace.outbound(data)
+        self.transport.write(data)
 
     def connectionMade(self):
+        if self._configure_transport is not None:
+            self._configure_transport(self.transport)
+
         s = StartupMessage(
             parameters={"user": self.username, "database": self.database},
             encoding=self._encoding,
@@ -46,7 +132,17 @@ class PostgreSQLClientProtocol(Protocol):
 
         self.send(s)
 
+    def connectionLost(self, reason):
+        self.lost.callback(reason.value)
+        if self._on_lost is not None:
+            self._on_lost(reason.value)
+
     def dataReceived(self, data):
+        if self._instrumentation is not None:
+            self._instrumentation.bytes_received(len(data))
+        if self._trace is not None:
+            self._trace.inbound(data)
+
         messages = self._parser.feed(data)
 
         for i in messages:
@@ -64,15 +160,40 @@ class PostgreSQLClientProtocol(Protocol):
         self.flush()
 
     def sendDescribe(self, name=""):
-        d = Describe(self._encoding, "")
+        d = Describe(self._encoding, name)
         self.send(d)
         self.flush()
 
-    def sendBind(self, bind):
-        b = Bind(self._encoding, "", "", bind, None)
+    def sendBind(self, bind, result_formats=None, statement=""):
+        b = Bind(self._encoding, "", statement, bind, result_formats)
         self.send(b)
         self.flush()
 
+    def sendCloseStatement(self, name):
+        # Sent ahead of a Parse, which flushes.
+        self.send(Close(self._encoding, "S", name))
+
+    def sendPipelinedQuery(self, query, bind):
+        """
+        Send a full extended query cycle for the unnamed statement and portal,
+        without flushing, so that several can go out in one write.
+        """
+        self.send(Parse(self._encoding, "", query))
+        self.send(Bind(self._encoding, "", "", bind, None))
+        self.send(Describe(self._encoding, "", "P"))
+        self.send(Execute(self._encoding, "", 0))
+
+    # COPY FROM STDIN happens within a simple query, so these don't flush.
+
+    def sendCopyData(self, data):
+        self.send(CopyData(data))
+
+    def sendCopyDone(self):
+        self.send(CopyDone())
+
+    def sendCopyFail(self, message):
+        self.send(CopyFail(self._encoding, message))
+
     def flush(self):
         f = Flush()
         self.send(f)
@@ -91,10 +212,21 @@ class PostgreSQLClientProtocol(Protocol):
         self.send(m)
         self.flush()
 
+    # The server expects nothing but the SASL messages until it is done, so
+    # these don't flush.
+
+    def sendSaslInitialResponse(self, mechanism, data):
+        self.send(SaslInitialResponse(mechanism, data))
+
+    def sendSaslResponse(self, data):
+        self.send(SaslResponse(data))
+
     def close(self):
         m = Close(self._encoding, "P", "")
         self.send(m)
-        self.flush()
+        # Synced, so that the transaction the portal was in is ended if it
+        # was implicit, and the server says when it's ready again.
+        self.sync()
 
     def sync(self):
         m = Sync()
@@ -102,10 +234,80 @@ class PostgreSQLClientProtocol(Protocol):
         self.flush()
 
 
+@attr.s
+class _CancelRequestProtocol(Protocol):
+    """
+    Send a CancelRequest and hang up.
+    """
+
+    _request = attr.ib()
+    done = attr.ib(factory=defer.Deferred, init=False)
+
+    def connectionMade(self):
+        self.transport.write(self._request.ser())
+        self.transport.loseConnection()
+
+    def connectionLost(self, reason):
+        self.done.callback(None)
+
+
 @attr.s
 class TwistedIOImplementation:
+    """
+    Run connections on Twisted. If C{trace} is a L{sansiopg.trace.TraceWriter},
+    every byte sent and received is recorded to it.
+
+    Connections can be made to an endpoint, or to anything L{host_endpoint}
+    takes, such as the directory of a local server's UNIX socket.
+
+    Over TCP, C{tcp_nodelay} turns Nagle's algorithm off, so that a small
+    write isn't held back waiting for the acknowledgement of the last, and
+    C{keepalive} has the OS probe idle connections, with the given timings
+    in seconds where the platform allows. C{receive_buffer} and
+    C{send_buffer} set the socket buffer sizes, of UNIX sockets too; on
+    Linux, setting them stops the kernel from sizing them itself.
+    """
 
     debug = attr.ib(default=False)
+    trace = attr.ib(default=None)
+    tcp_nodelay = attr.ib(default=True)
+    keepalive = attr.ib(default=True)
+    keepalive_idle = attr.ib(default=None)
+    keepalive_interval = attr.ib(default=None)
+    keepalive_count = attr.ib(default=None)
+    receive_buffer = attr.ib(default=None)
+    send_buffer = attr.ib(default=None)
+
+    def _endpoint(self, endpoint):
+        from twisted.internet import reactor
+
+        return host_endpoint(reactor, endpoint)
+
+    def configure_transport(self, transport):
+        """
+        Set the socket options of a new connection's C{transport}.
+        """
+        handle = getattr(transport, "getHandle", None)
+        sock = handle() if handle is not None else None
+
+        if not isinstance(sock, socket.socket):
+            # Not a real socket, such as one in memory.
+            return
+
+        if sock.family in (socket.AF_INET, socket.AF_INET6):
+            transport.setTcpNoDelay(self.tcp_nodelay)
+            transport.setTcpKeepAlive(self.keepalive)
+
+            if self.keepalive:
+                for name, option in _KEEPALIVE_OPTIONS.items():
+                    value = getattr(self, name)
+                    if value is not None and option is not None:
+                        sock.setsockopt(socket.IPPROTO_TCP, option, value)
+
+        if self.receive_buffer is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.receive_buffer)
+        if self.send_buffer is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer)
 
     def connect(self, connection, endpoint, database, username, password=None):
 
@@ -115,10 +317,50 @@ class TwistedIOImplementation:
             connection._onMessage,
             encoding=connection.encoding,
             debug=self.debug,
+            instrumentation=connection.instrumentation,
+            trace=self.trace,
+            stream_threshold=connection.stream_threshold,
+            # With a pool to decode them in, rows are parsed there too.
+            batch_rows=connection.decode_pool is not None,
+            configure_transport=self.configure_transport,
+            on_lost=connection._onConnectionLost,
         )
         cf = Factory.forProtocol(lambda: connection._pg)
 
-        return endpoint.connect(cf)
+        return self._endpoint(endpoint).connect(cf)
+
+    def cancel(self, endpoint, process_id, secret_key):
+        proto = _CancelRequestProtocol(CancelRequest(process_id, secret_key))
+        d = self._endpoint(endpoint).connect(Factory.forProtocol(lambda: proto))
+        d.addCallback(lambda _: proto.done)
+        return d
+
+    def call_later(self, seconds, func):
+        from twisted.internet import reactor
+
+        return reactor.callLater(seconds, func)
+
+    def produce(self, connection, pause, resume):
+        """
+        Call C{pause} when the connection's transport has more buffered than
+        it wants, and C{resume} once it has written it, until
+        C{stop_producing}.
+        """
+        connection._pg.transport.registerProducer(_Producer(pause, resume), True)
+
+    def stop_producing(self, connection):
+        connection._pg.transport.unregisterProducer()
+
+    def pause_reading(self, connection):
+        connection._pg.transport.pauseProducing()
+
+    def resume_reading(self, connection):
+        connection._pg.transport.resumeProducing()
+
+    def as_future(self, result):
+        if inspect.isawaitable(result) and not isinstance(result, defer.Deferred):
+            return defer.ensureDeferred(result)
+        return defer.maybeDeferred(lambda: result)
 
     def make_callback(self):
         return defer.Deferred()
@@ -126,5 +368,41 @@ class TwistedIOImplementation:
     def trigger_callback(self, future, result):
         return future.callback(result)
 
+    def fail_callback(self, future, exception):
+        return future.errback(exception)
+
     def add_callback(self, future, callback):
         future.addCallback(callback)
+
+    def add_both(self, future, callback):
+        future.addBoth(callback)
+
+    def add_errback(self, future, callback):
+        """
+        Call C{callback} with the exception if C{future} fails. It may
+        return a result or a future to recover, or raise.
+        """
+        future.addErrback(lambda failure: callback(failure.value))
+
+    def submit(self, pool, func, *args):
+        """
+        Run C{func} in C{pool}, a L{concurrent.futures.Executor}.
+        """
+        from twisted.internet import reactor
+
+        d = defer.Deferred()
+
+        def _done(future):
+            error = future.exception()
+            if error is None:
+                reactor.callFromThread(d.callback, future.result())
+            else:
+                reactor.callFromThread(d.errback, error)
+
+        pool.submit(func, *args).add_done_callback(_done)
+        return d
+
+    def gather_last(self, futures):
+        d = defer.DeferredList(futures, fireOnOneErrback=True, consumeErrors=True)
+        d.addCallbacks(lambda res: res[-1][-1], lambda f: f.value.subFailure)
+        return d
@@ -0,0 +1,551 @@
+"""
+A scripted stand-in for a PostgreSQL server.
+
+L{FakeBackend} is sans-I/O like the client: feed it what the client wrote and
+it returns what a server would have answered, built from canned L{Result}s.
+L{FakeServerFactory} puts it on a socket, and L{MemoryEndpoint} connects a
+client to it without one.
+"""
+
+import struct
+
+import attr
+from twisted.internet import defer
+from twisted.internet.error import ConnectionDone
+from twisted.internet.interfaces import IStreamClientEndpoint
+from twisted.internet.protocol import Factory, Protocol
+from twisted.python.failure import Failure
+from zope.interface import implementer
+
+from sansiopg.messages import DataType
+
+
+def _msg(type_code, payload=b""):
+    return type_code + struct.pack("!i", len(payload) + 4) + payload
+
+
+def authentication_ok():
+    return _msg(b"R", struct.pack("!i", 0))
+
+
+def authentication_sasl(mechanisms):
+    return _msg(
+        b"R", struct.pack("!i", 10) + b"".join(m + b"\0" for m in mechanisms) + b"\0"
+    )
+
+
+def authentication_sasl_continue(data):
+    return _msg(b"R", struct.pack("!i", 11) + data)
+
+
+def authentication_sasl_final(data):
+    return _msg(b"R", struct.pack("!i", 12) + data)
+
+
+def parameter_status(name, value):
+    return _msg(b"S", name.encode("utf8") + b"\0" + value.encode("utf8") + b"\0")
+
+
+def backend_key_data(process_id, secret_key):
+    return _msg(b"K", struct.pack("!ii", process_id, secret_key))
+
+
+def ready_for_query(status=b"I"):
+    return _msg(b"Z", status)
+
+
+def parse_complete():
+    return _msg(b"1")
+
+
+def bind_complete():
+    return _msg(b"2")
+
+
+def close_complete():
+    return _msg(b"3")
+
+
+def no_data():
+    return _msg(b"n")
+
+
+def empty_query_response():
+    return _msg(b"I")
+
+
+def parameter_description(oids):
+    return _msg(b"t", struct.pack("!h%di" % len(oids), len(oids), *oids))
+
+
+def row_description(columns, format_code=0):
+    res = [struct.pack("!h", len(columns))]
+    for name, oid in columns:
+        res.append(name.encode("utf8") + b"\0")
+        res.append(struct.pack("!ihihih", 0, 0, oid, -1, -1, format_code))
+    return _msg(b"T", b"".join(res))
+
+
+def data_row(values):
+    res = [struct.pack("!h", len(values))]
+    for val in values:
+        if val is None:
+            res.append(struct.pack("!i", -1))
+        else:
+            res.append(struct.pack("!i", len(val)))
+            res.append(val)
+    return _msg(b"D", b"".join(res))
+
+
+def portal_suspended():
+    return _msg(b"s")
+
+
+def command_complete(tag):
+    return _msg(b"C", tag.encode("utf8") + b"\0")
+
+
+def copy_out_response(column_count):
+    return _msg(
+        b"H", struct.pack("!bh%dh" % column_count, 0, column_count, *[0] * column_count)
+    )
+
+
+def copy_in_response(column_count, format_code=0):
+    return _msg(
+        b"G",
+        struct.pack(
+            "!bh%dh" % column_count,
+            format_code,
+            column_count,
+            *[format_code] * column_count
+        ),
+    )
+
+
+def copy_data(data):
+    return _msg(b"d", data)
+
+
+def copy_done():
+    return _msg(b"c")
+
+
+def notification_response(process_id, channel, payload):
+    return _msg(
+        b"A",
+        struct.pack("!i", process_id)
+        + channel.encode("utf8")
+        + b"\0"
+        + payload.encode("utf8")
+        + b"\0",
+    )
+
+
+def error_response(sqlstate, message, severity="ERROR"):
+    fields = [b"S" + severity.encode("utf8"), b"V" + severity.encode("utf8")]
+    fields.append(b"C" + sqlstate.encode("ascii"))
+    fields.append(b"M" + message.encode("utf8"))
+    return _msg(b"E", b"\0".join(fields) + b"\0\0")
+
+
+@attr.s
+class Result(object):
+    """
+    A canned result: C{columns} is a list of (name, type OID) pairs, and
+    C{rows} a list of tuples of already-encoded text values (or None).
+    """
+
+    columns = attr.ib(factory=list)
+    rows = attr.ib(factory=list)
+    tag = attr.ib(default=None)
+
+    @classmethod
+    def of(cls, names, rows, oid=DataType.TEXT.value):
+        """
+        Build a result from Python values, sent as text of type C{oid}.
+        """
+        encoded = [
+            tuple(None if v is None else str(v).encode("utf8") for v in row)
+            for row in rows
+        ]
+        return cls(columns=[(name, oid) for name in names], rows=encoded)
+
+    def command_tag(self):
+        if self.tag is not None:
+            return self.tag
+        return "SELECT %d" % (len(self.rows),)
+
+    def data_bytes(self):
+        """
+        The DataRows and CommandComplete, serialised once and then reused.
+        """
+        cached = self.__dict__.get("_data_bytes")
+        if cached is None:
+            cached = b"".join(data_row(row) for row in self.rows)
+            cached += command_complete(self.command_tag())
+            self.__dict__["_data_bytes"] = cached
+        return cached
+
+    def portal_bytes(self, start, count):
+        """
+        The DataRows of C{count} rows from C{start}, and whether there may
+        be more, as for an Execute of a portal; like the server, it can't
+        tell that there aren't until it's asked for them.
+        """
+        rows = self.__dict__.get("_row_bytes")
+        if rows is None:
+            rows = self.__dict__["_row_bytes"] = [data_row(row) for row in self.rows]
+        return b"".join(rows[start : start + count]), start + count <= len(rows)
+
+    def copy_bytes(self):
+        cached = self.__dict__.get("_copy_bytes")
+        if cached is None:
+            lines = [
+                copy_data(b"\t".join(b"\\N" if v is None else v for v in row) + b"\n")
+                for row in self.rows
+            ]
+            cached = b"".join(lines) + copy_done()
+            cached += command_complete("COPY %d" % (len(self.rows),))
+            self.__dict__["_copy_bytes"] = cached
+        return cached
+
+
+_EMPTY = Result(tag="OK")
+
+
+@attr.s
+class FakeBackend(object):
+    """
+    Answers a single client connection.
+
+    C{results} maps query text to the L{Result} to send back, and COPY
+    statements are answered with the result of the query or table they
+    name. Queries it doesn't know get C{default}, or an error if that is
+    None. The data of a COPY FROM STDIN is counted in C{copied}, and
+    thrown away.
+
+    BEGIN, COMMIT and ROLLBACK move it in and out of a transaction, which
+    an error aborts, as ReadyForQuery reports. Once C{closed} is set, the
+    connection is closed after the answer is sent. C{push}, once connected,
+    sends bytes to the client unprompted.
+    """
+
+    results = attr.ib(factory=dict)
+    default = attr.ib(default=_EMPTY)
+    parameters = attr.ib(
+        factory=lambda: {
+            "server_version": "12.0",
+            "server_encoding": "UTF8",
+            "client_encoding": "UTF8",
+            "in_hot_standby": "off",
+        }
+    )
+    process_id = attr.ib(default=4242)
+    secret_key = attr.ib(default=1234)
+    received = attr.ib(default=0, init=False)
+    cancelled = attr.ib(default=0, init=False)
+    copied = attr.ib(default=0, init=False)
+    closed = attr.ib(default=False, init=False)
+    push = attr.ib(default=None, init=False, repr=False)
+    _buffer = attr.ib(default=b"", init=False)
+    _started = attr.ib(default=False, init=False)
+    _statement = attr.ib(default=None, init=False)
+    _named = attr.ib(factory=dict, init=False)
+    _position = attr.ib(default=0, init=False)
+    _failed = attr.ib(default=False, init=False)
+    _status = attr.ib(default=b"I", init=False)
+    _copying = attr.ib(default=False, init=False)
+
+    def receive(self, data):
+        """
+        Take bytes from the client, returning the bytes to answer with.
+        """
+        self.received += len(data)
+        self._buffer += data
+        out = []
+
+        while True:
+            if not self._started:
+                if len(self._buffer) < 8:
+                    break
+                (length,) = struct.unpack("!i", self._buffer[:4])
+                if len(self._buffer) < length:
+                    break
+                body = self._buffer[4:length]
+                self._buffer = self._buffer[length:]
+                out.append(self._startup(body))
+                continue
+
+            if len(self._buffer) < 5:
+                break
+            (length,) = struct.unpack("!i", self._buffer[1:5])
+            if len(self._buffer) < length + 1:
+                break
+            type_code = self._buffer[0:1]
+            body = self._buffer[5 : length + 1]
+            self._buffer = self._buffer[length + 1 :]
+            out.append(self._handle(type_code, body))
+
+        return b"".join(out)
+
+    def _startup(self, body):
+        (code,) = struct.unpack("!i", body[:4])
+
+        if code == 80877102:
+            self.cancelled += 1
+            return b""
+
+        self._started = True
+        return authentication_ok() + self._welcome()
+
+    def _welcome(self):
+        """
+        What the server sends once the client has authenticated.
+        """
+        res = []
+        for name, value in self.parameters.items():
+            res.append(parameter_status(name, value))
+        res.append(backend_key_data(self.process_id, self.secret_key))
+        res.append(ready_for_query())
+        return b"".join(res)
+
+    def _lookup(self, query):
+        verb = query.split(None, 1)[0].upper() if query else ""
+
+        if self._status == b"E" and verb not in ("COMMIT", "ROLLBACK"):
+            raise KeyError(query)
+
+        result = self.results.get(query, self.default)
+        if result is None:
+            raise KeyError(query)
+
+        if verb == "BEGIN":
+            self._status = b"T"
+        elif verb in ("COMMIT", "ROLLBACK"):
+            self._status = b"I"
+        return result
+
+    def _error(self, sqlstate, message):
+        if self._status == b"T":
+            self._status = b"E"
+        return error_response(sqlstate, message)
+
+    def _copy_source(self, query):
+        # COPY table TO STDOUT, or COPY (query) TO STDOUT
+        source = query[len("COPY ") : query.rindex(" TO STDOUT")]
+        if source.startswith("("):
+            source = source[1:-1]
+        return self._lookup(source)
+
+    def _handle(self, type_code, body):
+        if self._failed and type_code != b"S":
+            return b""
+
+        if self._copying:
+            return self._copy_in(type_code, body)
+
+        if type_code == b"Q":
+            return self._simple_query(body[:-1].decode("utf8"))
+        elif type_code == b"P":
+            name, query, _ = body.split(b"\0", 2)
+            try:
+                self._statement = self._lookup(query.decode("utf8"))
+            except KeyError:
+                self._failed = True
+                return self._error("42P01", "unknown query")
+            if name:
+                self._named[name] = self._statement
+            return parse_complete()
+        elif type_code == b"D":
+            description = self._describe(self._statement)
+            if body[:1] == b"S":
+                return parameter_description([]) + description
+            return description
+        elif type_code == b"B":
+            portal, name, _ = body.split(b"\0", 2)
+            if name:
+                self._statement = self._named[name]
+            self._position = 0
+            return bind_complete()
+        elif type_code == b"E":
+            (count,) = struct.unpack("!i", body[-4:])
+            if not count and not self._position:
+                return self._statement.data_bytes()
+            return self._execute(count or len(self._statement.rows))
+        elif type_code == b"S":
+            self._failed = False
+            return ready_for_query(self._status)
+        elif type_code == b"C":
+            return close_complete()
+        return b""
+
+    def _execute(self, count):
+        result = self._statement
+        data, more = result.portal_bytes(self._position, count)
+        self._position += count
+
+        if more:
+            return data + portal_suspended()
+        return data + command_complete("SELECT %d" % (len(result.rows),))
+
+    def _describe(self, result):
+        if result.columns:
+            return row_description(result.columns)
+        return no_data()
+
+    def _simple_query(self, query):
+        if not query:
+            return empty_query_response() + ready_for_query(self._status)
+
+        try:
+            if " FROM STDIN" in query:
+                self._copying = True
+                return copy_in_response(0, 1 if "FORMAT binary" in query else 0)
+
+            if query.startswith("COPY "):
+                result = self._copy_source(query)
+                return (
+                    copy_out_response(len(result.columns))
+                    + result.copy_bytes()
+                    + ready_for_query(self._status)
+                )
+
+            result = self._lookup(query)
+        except KeyError:
+            return self._error("42P01", "unknown query") + ready_for_query(self._status)
+
+        res = [result.data_bytes(), ready_for_query(self._status)]
+        if result.columns:
+            res.insert(0, row_description(result.columns))
+        return b"".join(res)
+
+    def _copy_in(self, type_code, body):
+        if type_code == b"d":
+            self.copied += len(body)
+            return b""
+
+        self._copying = False
+
+        if type_code == b"f":
+            return self._error("57014", "COPY from stdin failed") + ready_for_query(
+                self._status
+            )
+
+        # The statements after the COPY don't return anything.
+        return command_complete("COPY") + ready_for_query(self._status)
+
+
+@attr.s
+class FakeServerProtocol(Protocol):
+
+    _backend = attr.ib()
+
+    def connectionMade(self):
+        self._backend.push = self.transport.write
+
+    def dataReceived(self, data):
+        response = self._backend.receive(data)
+        if response:
+            self.transport.write(response)
+        if self._backend.closed:
+            self.transport.loseConnection()
+
+
+@attr.s
+class FakeServerFactory(Factory):
+    """
+    Serve a fresh L{FakeBackend}, made by C{backend_factory}, to each
+    connection.
+    """
+
+    backend_factory = attr.ib(default=FakeBackend)
+
+    def buildProtocol(self, addr):
+        return FakeServerProtocol(self.backend_factory())
+
+
+@attr.s
+class _MemoryTransport(object):
+    """
+    Enough of a transport to connect a client protocol straight to a
+    L{FakeBackend}. Responses are delivered on the next reactor turn, like
+    they would be over a socket.
+    """
+
+    _reactor = attr.ib()
+    _backend = attr.ib()
+    _protocol = attr.ib()
+    _paused = attr.ib(default=False, init=False)
+    _pending = attr.ib(factory=list, init=False)
+    disconnected = attr.ib(default=False, init=False)
+
+    def __attrs_post_init__(self):
+        self._backend.push = self.push
+
+    def write(self, data):
+        response = self._backend.receive(data)
+        if response:
+            self.push(response)
+
+    def push(self, data):
+        """
+        Deliver C{data} from the backend to the client.
+        """
+        self._pending.append(data)
+        if len(self._pending) == 1:
+            self._reactor.callLater(0, self._deliver)
+
+    def writeSequence(self, seq):
+        self.write(b"".join(seq))
+
+    def _deliver(self):
+        while self._pending and not self._paused and not self.disconnected:
+            self._protocol.dataReceived(self._pending.pop(0))
+
+        if not self._pending and self._backend.closed:
+            self.loseConnection()
+
+    def pauseProducing(self):
+        self._paused = True
+
+    def resumeProducing(self):
+        self._paused = False
+        if self._pending:
+            self._reactor.callLater(0, self._deliver)
+
+    def stopProducing(self):
+        self.loseConnection()
+
+    def registerProducer(self, producer, streaming):
+        # Writes are handled as they are made, so there is never a backlog
+        # to pause the producer for.
+        pass
+
+    def unregisterProducer(self):
+        pass
+
+    def loseConnection(self):
+        if not self.disconnected:
+            self.disconnected = True
+            self._protocol.connectionLost(Failure(ConnectionDone()))
+
+    def getHandle(self):
+        return None
+
+
+@implementer(IStreamClientEndpoint)
+@attr.s
+class MemoryEndpoint(object):
+    """
+    A client endpoint that connects to a L{FakeBackend} in memory.
+    """
+
+    reactor = attr.ib()
+    backend_factory = attr.ib(default=FakeBackend)
+
+    def connect(self, protocolFactory):
+        protocol = protocolFactory.buildProtocol(None)
+        transport = _MemoryTransport(self.reactor, self.backend_factory(), protocol)
+        protocol.makeConnection(transport)
+        return defer.succeed(protocol)
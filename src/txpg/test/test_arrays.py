@@ -0,0 +1,160 @@
+"""
+Tests for the array and record codecs.
+"""
+
+import array
+import struct
+
+from twisted.internet import reactor
+from twisted.trial.unittest import TestCase
+
+from sansiopg.arrays import (
+    binary_array_decoder,
+    binary_record_decoder,
+    encode_binary_array,
+    format_text_array,
+    text_array_decoder,
+    text_record_decoder,
+)
+from sansiopg.protocol import PostgresConnection
+from txpg.protocol import TwistedIOImplementation
+
+from . import fakeserver
+
+
+def _text(value):
+    return value.decode("utf8")
+
+
+def _int4(value):
+    return struct.unpack("!i", value)[0]
+
+
+def _int4_decoder_for(oid):
+    return _int4 if oid == 23 else None
+
+
+class TextArrayTests(TestCase):
+    def test_elements(self):
+        """
+        Elements are decoded, quoted ones unescaped, and unquoted NULLs are
+        None.
+        """
+        decode = text_array_decoder(_text)
+
+        self.assertEqual(
+            decode(b'{a,"b,c","d\\"e",NULL,"NULL",""}'),
+            ["a", "b,c", 'd"e', None, "NULL", ""],
+        )
+        self.assertEqual(decode(b"{}"), [])
+
+    def test_nested(self):
+        """
+        Each dimension is a level of nested lists.
+        """
+        decode = text_array_decoder(int)
+
+        self.assertEqual(decode(b"{{1,2},{3,4}}"), [[1, 2], [3, 4]])
+
+    def test_compact(self):
+        """
+        With a type code, an array without NULLs is an L{array.array}.
+        """
+        decode = text_array_decoder(int, compact="i")
+
+        self.assertEqual(decode(b"{1,2,3}"), array.array("i", [1, 2, 3]))
+        self.assertEqual(decode(b"{1,NULL}"), [1, None])
+
+    def test_format(self):
+        """
+        Formatted arrays decode to what they were made from.
+        """
+        seq = [["a", 'b"\\'], [None, "d,e"]]
+        text = format_text_array(seq, lambda x: x.encode("utf8"))
+
+        self.assertEqual(text_array_decoder(_text)(text), seq)
+
+
+class BinaryArrayTests(TestCase):
+    def test_round_trip(self):
+        """
+        Arrays encoded in the binary format decode to the same lists.
+        """
+        decode = binary_array_decoder(_int4_decoder_for)
+
+        for seq in ([1, 2, 3], [[1, 2], [3, 4]], [1, None, 3], []):
+            encoded = encode_binary_array(seq, 23, lambda x: struct.pack("!i", x))
+            self.assertEqual(decode(encoded), seq)
+
+    def test_compact(self):
+        """
+        With C{compact}, an array of numbers without NULLs is an
+        L{array.array}.
+        """
+        decode = binary_array_decoder(_int4_decoder_for, compact=True)
+        encoded = encode_binary_array([1, 2], 23, None)
+
+        self.assertEqual(decode(encoded), array.array("i", [1, 2]))
+
+    def test_not_rectangular(self):
+        """
+        Arrays whose rows differ in length can't be encoded.
+        """
+        with self.assertRaises(ValueError):
+            encode_binary_array([[1, 2], [3]], 23, None)
+
+
+class RecordTests(TestCase):
+    def test_text(self):
+        """
+        Fields are decoded, quoted ones unescaped, and empty ones are None.
+        """
+        decode = text_record_decoder(_text)
+
+        self.assertEqual(decode(b'(1,,"a b","c""d","")'), ("1", None, "a b", 'c"d', ""))
+        self.assertEqual(decode(b"(,)"), (None, None))
+
+    def test_text_empty(self):
+        """
+        A record without fields is an empty tuple.
+        """
+        self.assertEqual(text_record_decoder(_text)(b"()"), ())
+
+    def test_binary(self):
+        """
+        Binary fields are decoded by their type, and left as bytes if there
+        is no decoder for it.
+        """
+        value = struct.pack("!i", 3)
+        value += struct.pack("!iii", 23, 4, 7)
+        value += struct.pack("!ii", 25, -1)
+        value += struct.pack("!ii", 25, 2) + b"hi"
+
+        self.assertEqual(
+            binary_record_decoder(_int4_decoder_for)(value), (7, None, b"hi")
+        )
+        self.assertEqual(binary_record_decoder(_int4_decoder_for)(b"\0\0\0\0"), ())
+
+
+class ConnectionTests(TestCase):
+    async def test_columns(self):
+        """
+        Array and record columns are decoded as lists and tuples.
+        """
+        result = fakeserver.Result(
+            columns=[("ids", 1007), ("names", 1009), ("pair", 2249)],
+            rows=[(b"{1,2,NULL}", b'{a,"b c"}', b"(1,x)"), (b"{}", b"{}", b"()")],
+        )
+        conn = PostgresConnection(TwistedIOImplementation())
+        endpoint = fakeserver.MemoryEndpoint(
+            reactor, lambda: fakeserver.FakeBackend(results={"SELECT arrays": result})
+        )
+        await conn.connect(endpoint, "db", "user")
+        self.addCleanup(conn._pg.transport.loseConnection)
+
+        rows = await conn.query("SELECT arrays")
+
+        self.assertEqual(
+            [tuple(row) for row in rows],
+            [([1, 2, None], ["a", "b c"], ("1", "x")), ([], [], ())],
+        )
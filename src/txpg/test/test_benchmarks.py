@@ -0,0 +1,52 @@
+"""
+Tests for the benchmark suite, run on a tiny workload.
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from twisted.trial.unittest import TestCase
+
+_RUN = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "benchmarks", "run.py"
+)
+
+
+class BenchmarkTests(TestCase):
+    timeout = 120
+
+    if not os.path.exists(_RUN):
+        skip = "The benchmarks are not in this checkout."
+
+    def test_run(self):
+        """
+        Every benchmark runs, and the results are saved as JSON that can be
+        compared against.
+        """
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        output = os.path.join(path, "results.json")
+        args = [sys.executable, _RUN, "--scale", "0.001", "--repeat", "1"]
+
+        subprocess.run(
+            args + ["--transport", "memory", "-o", output],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        with open(output) as f:
+            document = json.load(f)
+
+        self.assertEqual(document["options"]["scale"], 0.001)
+        for name in ("connect", "small_query_simple", "copy_out", "bulk_upsert"):
+            self.assertTrue(document["results"][name])
+
+        compared = subprocess.run(
+            args + ["--only", "connect", "--compare", output],
+            check=True,
+            stdout=subprocess.PIPE,
+        )
+        self.assertIn(b"x)", compared.stdout)
@@ -0,0 +1,161 @@
+"""
+Tests for upserting rows in bulk with COPY.
+"""
+
+import struct
+
+import attr
+from twisted.internet import reactor
+from twisted.trial.unittest import TestCase
+
+from sansiopg.arrays import encode_binary_array
+from sansiopg.bulk import COLUMNS_QUERY, upsert_script
+from sansiopg.protocol import PostgresConnection
+from txpg.protocol import TwistedIOImplementation
+
+from . import fakeserver
+
+
+def _columns(table, names, types):
+    # The arrays are asked for in binary.
+    return fakeserver.Result(
+        columns=[("name", 25), ("columns", 1009), ("types", 1028)],
+        rows=[
+            (
+                table.encode("utf8"),
+                encode_binary_array([x.encode("utf8") for x in names], 25, bytes),
+                encode_binary_array(types, 26, None),
+            )
+        ],
+    )
+
+
+@attr.s
+class _CopyingBackend(fakeserver.FakeBackend):
+    """
+    Keeps the queries the client sends and the data it copies in, and
+    describes the columns of C{tables}, by name.
+    """
+
+    queries = attr.ib(factory=list, init=False)
+    data = attr.ib(factory=list, init=False)
+    tables = attr.ib(factory=dict)
+
+    def _handle(self, type_code, body):
+        data = fakeserver.FakeBackend._handle(self, type_code, body)
+        if type_code == b"B":
+            for table, result in self.tables.items():
+                if struct.pack("!i", len(table)) + table.encode("utf8") in body:
+                    self._statement = result
+        return data
+
+    def _simple_query(self, query):
+        self.queries.append(query)
+        return fakeserver.FakeBackend._simple_query(self, query)
+
+    def _copy_in(self, type_code, body):
+        if type_code == b"d":
+            self.data.append(body)
+        return fakeserver.FakeBackend._copy_in(self, type_code, body)
+
+
+class UpsertScriptTests(TestCase):
+    def test_update(self):
+        """
+        The columns that aren't keys are updated from the staged rows, and
+        names are quoted.
+        """
+        script = upsert_script("t", "staging", ["id", 'we"ird'], ["id"], False)
+
+        self.assertEqual(
+            script.split(";\n"),
+            [
+                'CREATE TEMP TABLE staging ON COMMIT DROP AS SELECT "id", "we""ird"'
+                " FROM t WITH NO DATA",
+                'COPY staging ("id", "we""ird") FROM STDIN',
+                'INSERT INTO t ("id", "we""ird") SELECT "id", "we""ird" FROM staging'
+                ' ON CONFLICT ("id") DO UPDATE SET "we""ird" = EXCLUDED."we""ird"',
+                "DROP TABLE staging",
+            ],
+        )
+
+    def test_nothing(self):
+        """
+        If every column is a key, rows already there are left alone.
+        """
+        script = upsert_script("t", "staging", ["a", "b"], ["a", "b"], True)
+
+        self.assertIn("FROM STDIN (FORMAT binary)", script)
+        self.assertIn('ON CONFLICT ("a", "b") DO NOTHING', script)
+
+
+class BulkUpsertTests(TestCase):
+    timeout = 10
+
+    async def connect(self):
+        backends = []
+
+        def _backend():
+            tables = {
+                "plain": _columns("plain", ["id", "name"], [23, 25]),
+                "money": _columns("money", ["id", "amount"], [23, 1700]),
+            }
+            backends.append(
+                _CopyingBackend(results={COLUMNS_QUERY: tables["plain"]}, tables=tables)
+            )
+            return backends[-1]
+
+        conn = PostgresConnection(TwistedIOImplementation())
+        await conn.connect(fakeserver.MemoryEndpoint(reactor, _backend), "db", "user")
+        self.addCleanup(conn._pg.transport.loseConnection)
+        return conn, backends[0]
+
+    async def test_binary(self):
+        """
+        Rows whose columns all have a binary encoding are copied in binary,
+        and merged with INSERT ... ON CONFLICT in the same Query.
+        """
+        conn, backend = await self.connect()
+
+        await conn.bulk_upsert("plain", [(1, "one"), (2, None)], ["id"])
+
+        (script,) = backend.queries
+        self.assertIn("(FORMAT binary)", script)
+        self.assertIn(
+            'ON CONFLICT ("id") DO UPDATE SET "name" = EXCLUDED."name"', script
+        )
+
+        data = b"".join(backend.data)
+        self.assertTrue(data.startswith(b"PGCOPY\n\xff\r\n\x00"))
+        self.assertIn(
+            struct.pack("!hii", 2, 4, 1) + struct.pack("!i", 3) + b"one", data
+        )
+        self.assertIn(struct.pack("!hii", 2, 4, 2) + struct.pack("!i", -1), data)
+        self.assertTrue(data.endswith(struct.pack("!h", -1)))
+        self.assertTrue(conn.idle)
+
+    async def test_text(self):
+        """
+        Rows with a column without a binary encoding are copied as text.
+        """
+        conn, backend = await self.connect()
+
+        await conn.bulk_upsert(
+            "money", [(1, "1.50"), (2, None)], ["id"], ["id", "amount"]
+        )
+
+        self.assertNotIn("(FORMAT binary)", backend.queries[0])
+        self.assertEqual(b"".join(backend.data), b"1\t1.50\n2\t\\N\n")
+
+    async def test_missing_column(self):
+        """
+        Columns the table doesn't have are refused before anything is
+        copied.
+        """
+        conn, backend = await self.connect()
+
+        with self.assertRaises(ValueError):
+            await conn.bulk_upsert("plain", [(1,)], ["id"], ["nothing"])
+
+        self.assertEqual(backend.queries, [])
+        self.assertTrue(conn.idle)
@@ -0,0 +1,136 @@
+"""
+Tests for caching query results.
+"""
+
+import array
+
+import attr
+from twisted.internet import reactor
+from twisted.trial.unittest import TestCase
+
+from sansiopg.cache import ResultCache
+from sansiopg.protocol import PostgresConnection
+from txpg.protocol import TwistedIOImplementation
+
+from . import fakeserver
+
+_ROWS = fakeserver.Result.of(["id"], [(i,) for i in range(3)], oid=23)
+
+
+@attr.s
+class _CountingBackend(fakeserver.FakeBackend):
+    """
+    Counts the Parses and Queries the client sends.
+    """
+
+    queries = attr.ib(default=0, init=False)
+
+    def _handle(self, type_code, body):
+        if type_code in (b"P", b"Q"):
+            self.queries += 1
+        return fakeserver.FakeBackend._handle(self, type_code, body)
+
+    def notify(self, channel, payload):
+        self.push(fakeserver.notification_response(1, channel, payload))
+
+
+class ResultCacheTests(TestCase):
+    timeout = 10
+
+    async def connect(self):
+        backends = []
+
+        def _backend():
+            backends.append(
+                _CountingBackend(results={"SELECT rows": _ROWS, "SELECT $1": _ROWS})
+            )
+            return backends[-1]
+
+        conn = PostgresConnection(TwistedIOImplementation())
+        await conn.connect(fakeserver.MemoryEndpoint(reactor, _backend), "db", "user")
+        self.addCleanup(conn._pg.transport.loseConnection)
+        return conn, backends[0]
+
+    async def test_hit(self):
+        """
+        A query that was run with the same parameters is answered from the
+        cache, with a list of its own.
+        """
+        conn, backend = await self.connect()
+        cache = ResultCache()
+
+        first = await cache.query(conn, "SELECT $1", [[1, 2]])
+        first.clear()
+        second = await cache.query(conn, "SELECT $1", [[1, 2]])
+
+        self.assertEqual([tuple(row) for row in second], [(0,), (1,), (2,)])
+        self.assertEqual(backend.queries, 1)
+        self.assertEqual((cache.stats.hits, cache.stats.misses), (1, 1))
+
+    async def test_types(self):
+        """
+        Equal parameters of different types, which are sent differently,
+        are cached apart.
+        """
+        conn, backend = await self.connect()
+        cache = ResultCache()
+
+        for vals in ([1], [True], [1.0], [1], [(1,)], [[1]], [[True]]):
+            await cache.query(conn, "SELECT $1", vals)
+
+        self.assertEqual(len(cache), 6)
+        self.assertEqual(backend.queries, 6)
+
+    async def test_unhashable(self):
+        """
+        Queries with parameters that can't be part of a key aren't cached.
+        """
+        conn, backend = await self.connect()
+        cache = ResultCache()
+
+        for _ in range(2):
+            await cache.query(conn, "SELECT $1", [array.array("i", [1, 2])])
+
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(backend.queries, 2)
+
+    async def test_expiry_and_eviction(self):
+        """
+        Entries expire after their C{ttl}, and the least recently used are
+        evicted once there are too many.
+        """
+        conn, backend = await self.connect()
+        now = [0.0]
+        cache = ResultCache(max_entries=2, ttl=10, clock=lambda: now[0])
+
+        await cache.query(conn, "SELECT $1", [1])
+        await cache.query(conn, "SELECT $1", [2])
+        await cache.query(conn, "SELECT $1", [1])
+        await cache.query(conn, "SELECT $1", [3])
+        self.assertEqual(cache.stats.evictions, 1)
+        self.assertEqual(backend.queries, 3)
+
+        now[0] = 20.0
+        await cache.query(conn, "SELECT $1", [1])
+        self.assertEqual(cache.stats.expirations, 1)
+        self.assertEqual(backend.queries, 4)
+
+    async def test_listen(self):
+        """
+        A NOTIFY invalidates the entries with the tag in its payload, or
+        every entry if it is empty.
+        """
+        conn, backend = await self.connect()
+        cache = ResultCache()
+        await cache.listen(conn)
+        await cache.query(conn, "SELECT rows", tags=["things"])
+        await cache.query(conn, "SELECT $1", [1], tags=["other"])
+
+        backend.notify("sansiopg_invalidate", "things")
+        await conn.query("SELECT 1")
+        self.assertEqual(len(cache), 1)
+
+        backend.notify("sansiopg_invalidate", "")
+        await conn.query("SELECT 1")
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.stats.invalidations, 2)
@@ -0,0 +1,117 @@
+"""
+Tests for iterating over the rows of a COPY OUT in batches.
+"""
+
+import attr
+from twisted.internet import reactor
+from twisted.trial.unittest import TestCase
+
+from sansiopg.errors import PostgresError
+from sansiopg.messages import CopyDataBatch
+from sansiopg.protocol import PostgresConnection
+from txpg.protocol import TwistedIOImplementation
+
+from . import fakeserver
+
+_ROWS = fakeserver.Result.of(
+    ["id", "name"], [(i, "name-%d" % (i,)) for i in range(100)]
+)
+_LINES = [b"%d\tname-%d\n" % (i, i) for i in range(100)]
+
+
+@attr.s
+class _ChunkedBackend(fakeserver.FakeBackend):
+    """
+    Sends the rows of a COPY OUT a few at a time, as if they had arrived
+    in separate reads.
+    """
+
+    chunk_size = attr.ib(default=200)
+
+    def _simple_query(self, query):
+        data = fakeserver.FakeBackend._simple_query(self, query)
+
+        if query.startswith("COPY "):
+            for i in range(0, len(data), self.chunk_size):
+                self.push(data[i : i + self.chunk_size])
+            return b""
+
+        return data
+
+
+class CopyOutTests(TestCase):
+    timeout = 10
+
+    async def connect(self):
+        conn = PostgresConnection(TwistedIOImplementation())
+        endpoint = fakeserver.MemoryEndpoint(
+            reactor,
+            lambda: _ChunkedBackend(
+                results={"rows": _ROWS, "SELECT rows": _ROWS}, default=None
+            ),
+        )
+        await conn.connect(endpoint, "db", "user")
+        self.addCleanup(conn._pg.transport.loseConnection)
+        return conn
+
+    async def test_batches(self):
+        """
+        Rows come in batches of at least C{batch_rows}, apart from the last,
+        in order, whether a table or a query is copied.
+        """
+        conn = await self.connect()
+
+        for source in [{"table": "rows"}, {"query": "SELECT rows"}]:
+            batches = [batch async for batch in conn.copy_out(batch_rows=25, **source)]
+
+            self.assertTrue(all(type(x) is CopyDataBatch for x in batches))
+            self.assertGreater(len(batches), 1)
+            self.assertTrue(all(len(x) >= 25 for x in batches[:-1]))
+            self.assertEqual([y for x in batches for y in x.lines()], _LINES)
+            self.assertEqual(batches[0].rows()[0], [b"0", b"name-0"])
+            self.assertTrue(conn.idle)
+
+    async def test_batch_bytes(self):
+        """
+        A batch is also given once it holds C{batch_bytes} bytes.
+        """
+        conn = await self.connect()
+
+        batches = [
+            batch
+            async for batch in conn.copy_out(
+                table="rows", batch_rows=1000, batch_bytes=300
+            )
+        ]
+
+        self.assertGreater(len(batches), 1)
+        self.assertTrue(all(len(x.data) >= 300 for x in batches[:-1]))
+        self.assertEqual([y for x in batches for y in x.lines()], _LINES)
+
+    async def test_close(self):
+        """
+        Leaving an C{async with} block early drops the rows that haven't
+        been taken, and waits for the COPY to be over.
+        """
+        conn = await self.connect()
+
+        async with conn.copy_out(table="rows", batch_rows=10) as rows:
+            async for batch in rows:
+                break
+
+        self.assertEqual(batch.lines()[0], _LINES[0])
+        self.assertEqual((conn.flow_control.rows, conn.flow_control.bytes), (0, 0))
+        self.assertTrue(conn.idle)
+        self.assertEqual(len(await conn.query("SELECT rows")), 100)
+
+    async def test_error(self):
+        """
+        If the COPY fails, iterating raises the error.
+        """
+        conn = await self.connect()
+
+        with self.assertRaises(PostgresError):
+            async for batch in conn.copy_out(table="nothing"):
+                pass
+
+        self.assertEqual(len(await conn.query("SELECT rows")), 100)
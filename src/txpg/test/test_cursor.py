@@ -0,0 +1,47 @@
+"""
+Tests for iterating over rows fetched from a portal.
+"""
+
+from twisted.internet import reactor
+from twisted.trial.unittest import TestCase
+
+from sansiopg.protocol import PostgresConnection
+from txpg.protocol import TwistedIOImplementation
+
+from . import fakeserver
+
+_LARGE = fakeserver.Result.of(["id"], [(i,) for i in range(50)], oid=23)
+_WIDE = fakeserver.Result.of(["a", "b", "c"], [("a", "b", "c")] * 10)
+
+
+def _backend():
+    return fakeserver.FakeBackend(
+        results={"SELECT large": _LARGE, "SELECT wide": _WIDE}
+    )
+
+
+class CursorTests(TestCase):
+    timeout = 10
+
+    async def connect(self, **kwargs):
+        conn = PostgresConnection(TwistedIOImplementation(), **kwargs)
+        await conn.connect(fakeserver.MemoryEndpoint(reactor, _backend), "db", "user")
+        self.addCleanup(conn._pg.transport.loseConnection)
+        return conn
+
+    async def test_after_unkept_statement(self):
+        """
+        A statement prepared only for a portal is closed once the portal is
+        done, along with the next portal a prepared statement is opened
+        for.
+        """
+        conn = await self.connect()
+        await conn.prepare(["SELECT large"])
+
+        wide = [tuple(row) async for row in conn.iterate("SELECT wide", batch=3)]
+        large = [tuple(row) async for row in conn.iterate("SELECT large", batch=7)]
+
+        self.assertEqual(wide, [("a", "b", "c")] * 10)
+        self.assertEqual(large, [(i,) for i in range(50)])
+        self.assertNotIn("SELECT wide", conn._prepared)
+        self.assertTrue(conn.idle)
@@ -0,0 +1,154 @@
+"""
+Tests for queries that are cancelled once they have run too long.
+"""
+
+import struct
+
+import attr
+from twisted.internet import defer, reactor
+from twisted.internet.error import ConnectionRefusedError
+from twisted.internet.interfaces import IStreamClientEndpoint
+from twisted.trial.unittest import TestCase
+from zope.interface import implementer
+
+from sansiopg.errors import QueryCanceled
+from sansiopg.protocol import PostgresConnection
+from txpg.protocol import TwistedIOImplementation
+
+from . import fakeserver
+
+_ROWS = fakeserver.Result.of(["id"], [(i,) for i in range(3)], oid=23)
+_SLEEP = fakeserver.Result.of(["pg_sleep"], [("",)])
+
+
+@attr.s
+class _SleepingBackend(fakeserver.FakeBackend):
+    """
+    Never finishes a pg_sleep until a CancelRequest for it comes in over
+    another connection to one of C{backends}.
+    """
+
+    backends = attr.ib(factory=list)
+    _sleeping = attr.ib(default=None, init=False)
+    _synced = attr.ib(default=False, init=False)
+
+    def _startup(self, body):
+        code, process_id = struct.unpack("!ii", body[:8])
+        if code == 80877102:
+            for backend in self.backends:
+                if backend.process_id == process_id:
+                    backend.interrupt()
+        return fakeserver.FakeBackend._startup(self, body)
+
+    def _handle(self, type_code, body):
+        if self._sleeping:
+            self._synced = self._synced or type_code == b"S"
+            return b""
+        elif type_code == b"Q" and b"pg_sleep" in body:
+            self._sleeping = b"Q"
+            return b""
+        elif type_code == b"E" and self._statement is _SLEEP:
+            self._sleeping = b"E"
+            return b""
+        return fakeserver.FakeBackend._handle(self, type_code, body)
+
+    def interrupt(self):
+        if not self._sleeping:
+            return
+
+        data = self._error("57014", "canceling statement due to user request")
+        if self._sleeping == b"Q" or self._synced:
+            data += fakeserver.ready_for_query(self._status)
+        else:
+            self._failed = True
+        self._sleeping, self._synced = None, False
+        self.push(data)
+
+
+@implementer(IStreamClientEndpoint)
+class _RefusingEndpoint(object):
+    def connect(self, protocolFactory):
+        return defer.fail(ConnectionRefusedError())
+
+
+class DeadlineTests(TestCase):
+    timeout = 10
+
+    async def connect(self, backend_factory=None):
+        backends = []
+
+        def _backend():
+            backends.append(
+                _SleepingBackend(
+                    results={"SELECT rows": _ROWS, "SELECT pg_sleep($1)": _SLEEP},
+                    default=None,
+                    process_id=len(backends) + 1,
+                    backends=backends,
+                )
+            )
+            return backends[-1]
+
+        conn = PostgresConnection(TwistedIOImplementation())
+        await conn.connect(
+            fakeserver.MemoryEndpoint(reactor, backend_factory or _backend),
+            "db",
+            "user",
+        )
+        self.addCleanup(conn._pg.transport.loseConnection)
+        return conn, backends
+
+    async def test_timeout(self):
+        """
+        A query that runs past its timeout is cancelled, and fails with
+        L{QueryCanceled}, leaving the connection ready for the next.
+        """
+        for query, vals in [("SELECT pg_sleep(10)", []), ("SELECT pg_sleep($1)", [10])]:
+            conn, backends = await self.connect()
+
+            with self.assertRaises(QueryCanceled):
+                await conn.query(query, vals, timeout=0.01)
+
+            self.assertEqual(backends[1].cancelled, 1)
+            self.assertTrue(conn.idle)
+            self.assertEqual(len(await conn.query("SELECT rows", timeout=10)), 3)
+
+    async def test_in_time(self):
+        """
+        A query that finishes in time isn't cancelled.
+        """
+        conn, backends = await self.connect()
+
+        self.assertEqual(len(await conn.query("SELECT rows", timeout=10)), 3)
+        self.assertEqual(len(await conn.script("SELECT rows", timeout=10)), 1)
+        self.assertEqual(len(backends), 1)
+
+    async def test_no_key(self):
+        """
+        A timeout is refused before anything is sent if the server gave us no
+        key to cancel the query with.
+        """
+
+        @attr.s
+        class _Keyless(fakeserver.FakeBackend):
+            def _welcome(self):
+                res = [fakeserver.parameter_status(*x) for x in self.parameters.items()]
+                return b"".join(res) + fakeserver.ready_for_query()
+
+        conn, _ = await self.connect(lambda: _Keyless(results={"SELECT rows": _ROWS}))
+
+        for run in (conn.query, conn.script):
+            with self.assertRaises(ValueError):
+                run("SELECT rows", timeout=1)
+
+        self.assertTrue(conn.idle)
+        self.assertEqual(len(await conn.query("SELECT rows")), 3)
+
+    async def test_cancel_fails(self):
+        """
+        If the cancellation can't be sent, the query fails with the reason.
+        """
+        conn, _ = await self.connect()
+        conn._endpoint = _RefusingEndpoint()
+
+        with self.assertRaises(ConnectionRefusedError):
+            await conn.query("SELECT pg_sleep(10)", timeout=0.01)
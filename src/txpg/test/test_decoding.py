@@ -0,0 +1,87 @@
+"""
+Tests for decoding the columns of results.
+"""
+
+from twisted.internet import reactor
+from twisted.trial.unittest import TestCase
+
+from sansiopg.protocol import PostgresConnection
+from txpg.protocol import TwistedIOImplementation
+
+from . import fakeserver
+
+_TYPED = fakeserver.Result(
+    columns=[("i", 23), ("b", 16), ("data", 17), ("f", 701), ("name", 25)],
+    rows=[
+        (b"1", b"t", b"\\x00ff", b"1.5", "café".encode("utf8")),
+        (b"-2", b"f", b"\\x", b"NaN", None),
+    ],
+)
+_LATIN1 = fakeserver.Result(columns=[("name", 25)], rows=[("café".encode("latin-1"),)])
+
+
+def _backend(**parameters):
+    def _make():
+        backend = fakeserver.FakeBackend(
+            results={
+                "SELECT typed": _TYPED,
+                "SELECT $1": _TYPED,
+                "SELECT latin1": _LATIN1,
+            }
+        )
+        backend.parameters.update(parameters)
+        return backend
+
+    return _make
+
+
+class DecodingTests(TestCase):
+    async def connect(self, **parameters):
+        conn = PostgresConnection(TwistedIOImplementation())
+        endpoint = fakeserver.MemoryEndpoint(reactor, _backend(**parameters))
+        await conn.connect(endpoint, "db", "user")
+        self.addCleanup(conn._pg.transport.loseConnection)
+        return conn
+
+    async def test_types(self):
+        """
+        Values are decoded by their column's type, whichever protocol the
+        query is sent with.
+        """
+        conn = await self.connect()
+
+        for rows in [
+            await conn.query("SELECT typed"),
+            await conn.query("SELECT $1", [1]),
+        ]:
+            first, second = [tuple(row) for row in rows]
+            self.assertEqual(first, (1, True, b"\x00\xff", 1.5, "café"))
+            self.assertEqual(second[:3], (-2, False, b""))
+            self.assertNotEqual(second[3], second[3])
+            self.assertIsNone(second[4])
+
+    async def test_client_encoding(self):
+        """
+        Text is decoded in the encoding the server says it sends.
+        """
+        conn = await self.connect(client_encoding="LATIN1")
+
+        self.assertEqual(conn.client_encoding, "LATIN1")
+        self.assertEqual((await conn.query("SELECT latin1"))[0].name, "café")
+
+    async def test_raw(self):
+        """
+        The columns named in C{raw}, or all of them if it is True, are left
+        as the bytes that were sent.
+        """
+        conn = await self.connect()
+
+        for run in (
+            lambda raw: conn.query("SELECT typed", raw=raw),
+            lambda raw: conn.query("SELECT $1", [1], raw=raw),
+        ):
+            row = (await run(("i", "name")))[0]
+            self.assertEqual(tuple(row), (b"1", True, b"\x00\xff", 1.5, b"caf\xc3\xa9"))
+
+            row = (await run(True))[0]
+            self.assertEqual(tuple(row), _TYPED.rows[0])
@@ -0,0 +1,178 @@
+"""
+Tests for recovering from errors the server sends, and for connections that
+go away.
+"""
+
+import attr
+from twisted.internet import reactor
+from twisted.internet.error import ConnectionDone
+from twisted.trial.unittest import TestCase
+
+from sansiopg.errors import PostgresError, UniqueViolation
+from sansiopg.protocol import PostgresConnection
+from txpg.protocol import TwistedIOImplementation
+
+from . import fakeserver
+
+_ROWS = fakeserver.Result.of(["id"], [(i,) for i in range(3)], oid=23)
+
+
+@attr.s
+class _FailingBackend(fakeserver.FakeBackend):
+    """
+    Hangs up with a FATAL error on a query that says to terminate, fails a
+    query that says duplicate with a unique violation, and never answers a
+    query that says hang.
+    """
+
+    def _handle(self, type_code, body):
+        if type_code in (b"Q", b"P"):
+            if b"terminate" in body:
+                self.closed = True
+                return fakeserver.error_response(
+                    "57P01",
+                    "terminating connection due to administrator command",
+                    severity="FATAL",
+                )
+            elif b"duplicate" in body and type_code == b"Q":
+                return self._error(
+                    "23505", "duplicate key"
+                ) + fakeserver.ready_for_query(self._status)
+            elif b"hang" in body:
+                return b""
+
+        return fakeserver.FakeBackend._handle(self, type_code, body)
+
+
+def _backend():
+    return _FailingBackend(
+        results={
+            "BEGIN": fakeserver.Result(tag="BEGIN"),
+            "ROLLBACK": fakeserver.Result(tag="ROLLBACK"),
+            "SELECT rows": _ROWS,
+            "SELECT $1": _ROWS,
+        },
+        default=None,
+    )
+
+
+class ErrorTests(TestCase):
+    async def connect(self):
+        conn = PostgresConnection(TwistedIOImplementation())
+        await conn.connect(fakeserver.MemoryEndpoint(reactor, _backend), "db", "user")
+        self.addCleanup(conn._pg.transport.loseConnection)
+        return conn
+
+    async def assertRecovers(self, conn):
+        """
+        The connection is idle and runs the next query.
+        """
+        self.assertTrue(conn.idle)
+        self.assertEqual(len(await conn.query("SELECT rows")), 3)
+        self.assertEqual(len(await conn.query("SELECT $1", [1])), 3)
+
+    async def test_simple_query(self):
+        conn = await self.connect()
+
+        with self.assertRaises(PostgresError) as e:
+            await conn.query("SELECT nothing")
+
+        self.assertEqual(e.exception.sqlstate, "42P01")
+        await self.assertRecovers(conn)
+
+    async def test_extended_query(self):
+        conn = await self.connect()
+
+        with self.assertRaises(PostgresError):
+            await conn.query("SELECT nothing", [1])
+
+        await self.assertRecovers(conn)
+
+    async def test_prepare(self):
+        conn = await self.connect()
+
+        with self.assertRaises(PostgresError):
+            await conn.prepare(["SELECT $1", "SELECT nothing"])
+
+        self.assertIn("SELECT $1", conn._prepared)
+        await self.assertRecovers(conn)
+
+    async def test_pipeline(self):
+        conn = await self.connect()
+
+        with self.assertRaises(PostgresError):
+            async with conn.new_pipelined_transaction() as transaction:
+                failing = transaction.execute("SELECT nothing", [1])
+
+        with self.assertRaises(PostgresError):
+            await failing
+        await self.assertRecovers(conn)
+
+    async def test_sqlstate(self):
+        """
+        Errors are raised as the subclass for their SQLSTATE.
+        """
+        conn = await self.connect()
+
+        with self.assertRaises(UniqueViolation):
+            await conn.execute("INSERT duplicate")
+
+        await self.assertRecovers(conn)
+
+    async def test_in_transaction(self):
+        """
+        An error in a transaction leaves it aborted until it is rolled back.
+        """
+        conn = await self.connect()
+        await conn.execute("BEGIN")
+
+        with self.assertRaises(PostgresError):
+            await conn.query("SELECT nothing", [1])
+
+        self.assertFalse(conn.idle)
+        await conn.execute("ROLLBACK")
+        await self.assertRecovers(conn)
+
+    async def test_fatal(self):
+        """
+        A FATAL error fails the query at once, since the server hangs up
+        rather than saying it is ready.
+        """
+        for vals in ([], [1]):
+            conn = await self.connect()
+
+            with self.assertRaises(PostgresError) as e:
+                await conn.query("SELECT terminate", vals)
+
+            self.assertEqual(e.exception.severity, "FATAL")
+            self.assertFalse(conn.idle)
+            self.assertTrue(conn._pg.lost.called)
+
+    async def test_lost(self):
+        """
+        Whatever is waiting on the server fails once the connection is
+        lost.
+        """
+        for vals in ([], [1]):
+            conn = await self.connect()
+            d = conn.query("SELECT hang", vals)
+            conn._pg.transport.loseConnection()
+
+            with self.assertRaises(ConnectionDone):
+                await d
+
+            self.assertFalse(conn.idle)
+
+    async def test_lost_pipeline(self):
+        """
+        The futures of the statements of a pipeline fail too.
+        """
+        conn = await self.connect()
+        transaction = conn.new_pipelined_transaction()
+        rows = transaction.query("SELECT hang", [1])
+        d = transaction.commit()
+        conn._pg.transport.loseConnection()
+
+        for future in (rows, d):
+            with self.assertRaises(ConnectionDone):
+                await future
@@ -0,0 +1,73 @@
+"""
+Tests for the fake server, over a real socket.
+"""
+
+from twisted.internet import reactor
+from twisted.internet.endpoints import TCP4ClientEndpoint, TCP4ServerEndpoint
+from twisted.trial.unittest import TestCase
+
+from sansiopg.protocol import PostgresConnection
+from txpg.protocol import TwistedIOImplementation
+
+from . import fakeserver
+
+_ROWS = fakeserver.Result.of(["id", "name"], [(i, "name-%d" % (i,)) for i in range(20)])
+_ROWS.columns[0] = ("id", 23)
+
+
+class FakeServerTests(TestCase):
+    timeout = 10
+
+    async def connect(self):
+        backends = []
+
+        def _backend():
+            backends.append(
+                fakeserver.FakeBackend(
+                    results={"SELECT rows": _ROWS, "SELECT $1": _ROWS, "rows": _ROWS}
+                )
+            )
+            return backends[-1]
+
+        server = TCP4ServerEndpoint(reactor, 0, interface="127.0.0.1")
+        port = await server.listen(fakeserver.FakeServerFactory(_backend))
+        self.addCleanup(port.stopListening)
+
+        conn = PostgresConnection(TwistedIOImplementation())
+        endpoint = TCP4ClientEndpoint(reactor, "127.0.0.1", port.getHost().port)
+        await conn.connect(endpoint, "db", "user")
+        self.addCleanup(lambda: conn._pg.transport.loseConnection() or conn._pg.lost)
+        return conn, backends[0]
+
+    async def test_queries(self):
+        """
+        Simple and extended queries get the canned rows, and a portal them
+        a batch at a time.
+        """
+        conn, backend = await self.connect()
+        expected = [(i, "name-%d" % (i,)) for i in range(20)]
+
+        self.assertEqual(
+            [tuple(row) for row in await conn.query("SELECT rows")], expected
+        )
+        self.assertEqual(
+            [tuple(row) for row in await conn.query("SELECT $1", [1])], expected
+        )
+        self.assertEqual(
+            [tuple(row) async for row in conn.iterate("SELECT $1", [1], batch=7)],
+            expected,
+        )
+        self.assertTrue(conn.idle)
+        self.assertGreater(backend.received, 0)
+
+    async def test_copy_out(self):
+        """
+        COPY OUT sends the rows of the table, as text.
+        """
+        conn, backend = await self.connect()
+        lines = []
+
+        await conn.copy_out(lambda message: lines.append(message.data), table="rows")
+
+        self.assertEqual(lines, [[b"%d" % (i,), b"name-%d" % (i,)] for i in range(20)])
+        self.assertTrue(conn.idle)
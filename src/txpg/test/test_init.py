@@ -0,0 +1,50 @@
+"""
+Tests for importing txpg, and the names it exports.
+"""
+
+import os
+import subprocess
+import sys
+
+from twisted.trial.unittest import TestCase
+
+import txpg
+
+_SRC = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class ImportTests(TestCase):
+    def test_cheap(self):
+        """
+        Importing txpg doesn't import Twisted's reactor machinery or the
+        protocol, which are only needed once a connection is made.
+        """
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(
+            [_SRC] + [x for x in [env.get("PYTHONPATH")] if x]
+        )
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import txpg"],
+            env=env,
+            check=True,
+            stderr=subprocess.PIPE,
+        )
+        imported = {
+            line.rsplit(b"|", 1)[-1].strip().decode("ascii")
+            for line in result.stderr.splitlines()
+            if line.startswith(b"import time:")
+        }
+
+        self.assertIn("txpg", imported)
+        self.assertNotIn("sansiopg.protocol", imported)
+        self.assertNotIn("twisted.internet", imported)
+
+
+class NewConnectionTests(TestCase):
+    def test_quiet(self):
+        """
+        Connections don't print the messages they send and receive unless
+        asked to.
+        """
+        self.assertFalse(txpg.new_connection()._io_impl.debug)
+        self.assertTrue(txpg.new_connection(debug=True)._io_impl.debug)
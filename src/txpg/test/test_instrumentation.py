@@ -0,0 +1,176 @@
+"""
+Tests for the latency histograms of statements.
+"""
+
+import itertools
+
+from twisted.internet import reactor
+from twisted.trial.unittest import TestCase
+
+from sansiopg.instrumentation import (
+    Instrumentation,
+    LatencyHistogram,
+    QueryStats,
+    StatementStats,
+)
+from sansiopg.protocol import PostgresConnection
+from txpg.protocol import TwistedIOImplementation
+
+from . import fakeserver
+
+_ROWS = fakeserver.Result.of(["id"], [(i,) for i in range(5)])
+
+
+def _stats(query, latency, params=None, **phases):
+    stats = QueryStats(query=query, started=10.0, params=params)
+    stats.finished = 10.0 + latency
+    stats.phases.update(phases)
+    return stats
+
+
+class LatencyHistogramTests(TestCase):
+    def assertNear(self, latency, expected):
+        """
+        C{latency} is within the eighth of C{expected} that buckets are
+        precise to.
+        """
+        self.assertTrue(
+            abs(latency - expected) <= expected / 8, "%r != %r" % (latency, expected)
+        )
+
+    def test_percentiles(self):
+        """
+        Percentiles are within an eighth of the latencies recorded, and
+        never more than the longest.
+        """
+        histogram = LatencyHistogram()
+        for millis in range(1, 101):
+            histogram.record(millis / 1000.0)
+
+        for percent in (50, 90, 99):
+            self.assertNear(histogram.percentile(percent), percent / 1000.0)
+        self.assertEqual(histogram.percentile(100), 0.1)
+        self.assertEqual(histogram.summary()["count"], 100)
+        self.assertAlmostEqual(histogram.summary()["mean"], 0.0505)
+
+    def test_empty(self):
+        """
+        Nothing recorded has no percentiles.
+        """
+        histogram = LatencyHistogram()
+
+        self.assertIsNone(histogram.percentile(50))
+        self.assertIsNone(histogram.summary()["mean"])
+
+    def test_tiny(self):
+        """
+        Latencies under a microsecond go in the first bucket.
+        """
+        histogram = LatencyHistogram()
+        histogram.record(0.0)
+        histogram.record(1e-7)
+
+        self.assertEqual(histogram.percentile(100), 1e-7)
+
+    def test_merge(self):
+        """
+        Merging adds the counts of the other histogram.
+        """
+        first, second = LatencyHistogram(), LatencyHistogram()
+        first.record(0.001)
+        second.record(0.002)
+        second.record(1.0)
+        first.merge(second)
+
+        self.assertEqual((first.count, first.max), (3, 1.0))
+        self.assertNear(first.percentile(50), 0.002)
+
+
+class StatementStatsTests(TestCase):
+    def test_record(self):
+        """
+        The whole query and each of its phases are recorded under its text,
+        pipelines as their queries joined together, and connecting not at
+        all.
+        """
+        statements = StatementStats()
+        statements.record(_stats("SELECT 1", 0.01, parse=0.001, execute=0.005))
+        statements.record(_stats("SELECT 1", 0.02, execute=0.01))
+        statements.record(_stats(("SELECT 1", "SELECT 2"), 0.03))
+        statements.record(_stats(None, 0.04))
+
+        histograms = statements.histograms("SELECT 1")
+        self.assertEqual(sorted(histograms), ["execute", "parse", "total"])
+        self.assertEqual(histograms["total"].count, 2)
+        self.assertEqual(histograms["parse"].count, 1)
+        self.assertEqual(
+            sorted(statements.snapshot()), ["SELECT 1", "SELECT 1; SELECT 2"]
+        )
+        self.assertEqual(statements.histograms("SELECT 3"), {})
+
+    def test_max_statements(self):
+        """
+        Statements beyond the first C{max_statements} are counted together.
+        """
+        statements = StatementStats(max_statements=2)
+        for query in ["SELECT 1", "SELECT 2", "SELECT 3", "SELECT 4", "SELECT 1"]:
+            statements.record(_stats(query, 0.01))
+
+        snapshot = statements.snapshot()
+        self.assertEqual(sorted(snapshot), ["(other)", "SELECT 1", "SELECT 2"])
+        self.assertEqual(snapshot["(other)"]["total"]["count"], 2)
+        self.assertEqual(snapshot["SELECT 1"]["total"]["count"], 2)
+
+    def test_slow(self):
+        """
+        Queries at or over the threshold keep their parameters and are
+        sampled, up to C{slow_samples}; faster ones lose their parameters.
+        """
+        statements = StatementStats(slow_threshold=1.0, slow_samples=2)
+        fast = _stats("SELECT $1", 0.5, params=[1])
+        statements.record(fast)
+        for i in range(3):
+            statements.record(_stats("SELECT $1", 1.0 + i, params=[i]))
+
+        self.assertIsNone(fast.params)
+        self.assertEqual([stats.params for stats in statements.slow], [[1], [2]])
+
+
+class ConnectionTests(TestCase):
+    timeout = 10
+
+    async def test_histograms(self):
+        """
+        A connection's queries are recorded by their text, with their
+        parameters if they are slow.
+        """
+        statements = StatementStats(slow_threshold=0)
+        # Every reading of the clock is a second after the last.
+        clock = itertools.count()
+        instrumentation = Instrumentation(
+            clock=lambda: next(clock), statements=statements
+        )
+        conn = PostgresConnection(
+            TwistedIOImplementation(), instrumentation=instrumentation
+        )
+        endpoint = fakeserver.MemoryEndpoint(
+            reactor,
+            lambda: fakeserver.FakeBackend(
+                results={"SELECT rows": _ROWS, "SELECT $1": _ROWS}
+            ),
+        )
+        await conn.connect(endpoint, "db", "user")
+        self.addCleanup(conn._pg.transport.loseConnection)
+
+        await conn.query("SELECT $1", [1])
+        await conn.query("SELECT $1", [2])
+        await conn.query("SELECT rows")
+
+        histograms = statements.histograms("SELECT $1")
+        self.assertEqual(histograms["total"].count, 2)
+        self.assertTrue({"parse", "bind", "execute", "fetch"} <= set(histograms))
+        self.assertEqual(statements.histograms("SELECT rows")["total"].count, 1)
+        self.assertEqual(
+            [(stats.query, stats.params) for stats in statements.slow],
+            [("SELECT $1", [1]), ("SELECT $1", [2]), ("SELECT rows", None)],
+        )
@@ -0,0 +1,125 @@
+"""
+Tests for LISTEN and NOTIFY.
+"""
+
+import struct
+
+import attr
+from twisted.internet import reactor
+from twisted.trial.unittest import TestCase
+
+from sansiopg.protocol import PostgresConnection
+from txpg.protocol import TwistedIOImplementation
+
+from . import fakeserver
+
+_ROWS = fakeserver.Result.of(["id"], [(i,) for i in range(3)], oid=23)
+
+
+@attr.s
+class _NotifyingBackend(fakeserver.FakeBackend):
+    """
+    Notes the queries the client sends, and sends a notification on
+    C{events} in the middle of the rows of SELECT rows.
+    """
+
+    queries = attr.ib(factory=list, init=False)
+
+    def _simple_query(self, query):
+        self.queries.append(query)
+        response = fakeserver.FakeBackend._simple_query(self, query)
+        if query == "SELECT rows":
+            # After the RowDescription.
+            (length,) = struct.unpack("!i", response[1:5])
+            notification = fakeserver.notification_response(1, "events", "during")
+            response = response[: length + 1] + notification + response[length + 1 :]
+        return response
+
+    def notify(self, channel, payload):
+        self.push(fakeserver.notification_response(1, channel, payload))
+
+
+class NotifyTests(TestCase):
+    timeout = 10
+
+    async def connect(self):
+        backends = []
+
+        def _backend():
+            backends.append(_NotifyingBackend(results={"SELECT rows": _ROWS}))
+            return backends[-1]
+
+        conn = PostgresConnection(TwistedIOImplementation())
+        await conn.connect(fakeserver.MemoryEndpoint(reactor, _backend), "db", "user")
+        self.addCleanup(conn._pg.transport.loseConnection)
+        return conn, backends[0]
+
+    async def test_listen(self):
+        """
+        LISTEN is sent once for a channel, and every callback is called with
+        each notification on it.
+        """
+        conn, backend = await self.connect()
+        first, second, other = [], [], []
+        await conn.listen("events", first.append)
+        await conn.listen("events", second.append)
+        await conn.listen("other", other.append)
+
+        backend.notify("events", "hello")
+        await conn.query("SELECT 1")
+
+        self.assertEqual(backend.queries[:2], ['LISTEN "events"', 'LISTEN "other"'])
+        self.assertEqual([n.payload for n in first], ["hello"])
+        self.assertEqual(first, second)
+        self.assertEqual(first[0].channel, "events")
+        self.assertEqual(other, [])
+
+    async def test_during_query(self):
+        """
+        A notification in the middle of a query is dispatched at once, and
+        the query goes on.
+        """
+        conn, backend = await self.connect()
+        received = []
+        await conn.listen("events", received.append)
+
+        rows = await conn.query("SELECT rows")
+
+        self.assertEqual([n.payload for n in received], ["during"])
+        self.assertEqual(len(rows), 3)
+        self.assertTrue(conn.idle)
+
+    async def test_unlisten(self):
+        """
+        UNLISTEN is only sent once the last callback for a channel is gone.
+        """
+        conn, backend = await self.connect()
+        first, second = [], []
+        await conn.listen("events", first.append)
+        await conn.listen("events", second.append)
+
+        await conn.unlisten("events", first.append)
+        self.assertNotIn('UNLISTEN "events"', backend.queries)
+        backend.notify("events", "one")
+        await conn.query("SELECT 1")
+        await conn.unlisten("events")
+        backend.notify("events", "two")
+        await conn.query("SELECT 1")
+
+        self.assertEqual(backend.queries[-2], 'UNLISTEN "events"')
+        self.assertEqual(first, [])
+        self.assertEqual([n.payload for n in second], ["one"])
+
+    async def test_failing_callback(self):
+        """
+        A callback that raises doesn't stop the others being called.
+        """
+        conn, backend = await self.connect()
+        received = []
+        await conn.listen("events", lambda n: 1 / 0)
+        await conn.listen("events", received.append)
+
+        backend.notify("events", "hello")
+        await conn.query("SELECT 1")
+
+        self.assertEqual(len(received), 1)
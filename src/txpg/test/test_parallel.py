@@ -0,0 +1,99 @@
+"""
+Tests for decoding results in a pool.
+"""
+
+import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from twisted.internet import reactor
+from twisted.trial.unittest import TestCase
+
+from sansiopg import parallel
+from sansiopg.messages import DataRowBatch
+from sansiopg.protocol import PostgresConnection
+from txpg.protocol import TwistedIOImplementation
+
+from . import fakeserver
+
+_ROWS = fakeserver.Result.of(
+    ["id", "name"], [(i, None if i % 7 else "name-%d" % (i,)) for i in range(500)]
+)
+_ROWS.columns[0] = ("id", 23)
+
+
+def _backend():
+    return fakeserver.FakeBackend(results={"SELECT rows": _ROWS, "SELECT $1": _ROWS})
+
+
+class _CountingPool(ThreadPoolExecutor):
+    """
+    Counts the work it is given.
+    """
+
+    submitted = 0
+
+    def submit(self, *args, **kwargs):
+        self.submitted += 1
+        return ThreadPoolExecutor.submit(self, *args, **kwargs)
+
+
+class TasksTests(TestCase):
+    def test_joined(self):
+        """
+        Batches are joined until they reach the size, and the offsets moved
+        along with them.
+        """
+        batches = [
+            DataRowBatch(b"abc", array.array("q", [0, 2])),
+            DataRowBatch(b"defg", array.array("q", [0])),
+            DataRowBatch(b"h", array.array("q", [0])),
+        ]
+
+        self.assertEqual(
+            list(parallel.tasks(batches, size=5)),
+            [
+                (b"abcdefg", array.array("q", [0, 2, 3])),
+                (b"h", array.array("q", [0])),
+            ],
+        )
+
+
+class DecodePoolTests(TestCase):
+    timeout = 30
+
+    async def connect(self, pool):
+        conn = PostgresConnection(TwistedIOImplementation(), decode_pool=pool)
+        await conn.connect(fakeserver.MemoryEndpoint(reactor, _backend), "db", "user")
+        self.addCleanup(conn._pg.transport.loseConnection)
+        return conn
+
+    def assertRows(self, rows):
+        self.assertEqual(
+            [tuple(row) for row in rows],
+            [(i, None if i % 7 else "name-%d" % (i,)) for i in range(500)],
+        )
+
+    async def test_threads(self):
+        """
+        Rows are decoded in the pool, in order, whichever protocol the query
+        is sent with.
+        """
+        pool = _CountingPool(2)
+        self.addCleanup(pool.shutdown)
+        conn = await self.connect(pool)
+
+        self.assertRows(await conn.query("SELECT rows"))
+        self.assertRows(await conn.query("SELECT $1", [1]))
+        self.assertGreater(pool.submitted, 0)
+        self.assertTrue(conn.idle)
+
+    async def test_processes(self):
+        """
+        What the workers are sent can be pickled, so the pool may be of
+        processes.
+        """
+        pool = ProcessPoolExecutor(1)
+        self.addCleanup(pool.shutdown)
+        conn = await self.connect(pool)
+
+        self.assertRows(await conn.query("SELECT rows"))
@@ -0,0 +1,107 @@
+"""
+Tests for pipelined transactions, sent in a single flight.
+"""
+
+import attr
+from twisted.internet import reactor
+from twisted.trial.unittest import TestCase
+
+from sansiopg.errors import PostgresError
+from sansiopg.protocol import PostgresConnection
+from txpg.protocol import TwistedIOImplementation
+
+from . import fakeserver
+
+_ROWS = fakeserver.Result.of(["id"], [(i,) for i in range(3)], oid=23)
+_RESULTS = {
+    "BEGIN": fakeserver.Result(tag="BEGIN"),
+    "COMMIT": fakeserver.Result(tag="COMMIT"),
+    "ROLLBACK": fakeserver.Result(tag="ROLLBACK"),
+    "SELECT $1": _ROWS,
+    "UPDATE things SET x = $1": fakeserver.Result(tag="UPDATE 3"),
+}
+
+
+@attr.s
+class _RecordingBackend(fakeserver.FakeBackend):
+    """
+    Notes the type code of every message the client sends.
+    """
+
+    sent = attr.ib(factory=list, init=False)
+
+    def _handle(self, type_code, body):
+        self.sent.append(type_code)
+        return fakeserver.FakeBackend._handle(self, type_code, body)
+
+
+class PipelinedTransactionTests(TestCase):
+    async def connect(self):
+        backends = []
+
+        def _backend():
+            backends.append(_RecordingBackend(results=_RESULTS, default=None))
+            return backends[-1]
+
+        conn = PostgresConnection(TwistedIOImplementation())
+        await conn.connect(fakeserver.MemoryEndpoint(reactor, _backend), "db", "user")
+        self.addCleanup(conn._pg.transport.loseConnection)
+        backends[0].sent.clear()
+        return conn, backends[0]
+
+    async def test_single_flight(self):
+        """
+        The statements go out between a BEGIN and a COMMIT with one Sync
+        and no Flush, and each future fires with its statement's rows.
+        """
+        conn, backend = await self.connect()
+
+        async with conn.new_pipelined_transaction() as transaction:
+            rows = transaction.query("SELECT $1", [1])
+            updated = transaction.execute("UPDATE things SET x = $1", [2])
+
+        self.assertEqual([tuple(row) for row in await rows], [(0,), (1,), (2,)])
+        self.assertIsNone(await updated)
+        self.assertEqual(backend.sent.count(b"S"), 1)
+        self.assertEqual(backend.sent[-1], b"S")
+        self.assertNotIn(b"H", backend.sent)
+        self.assertTrue(conn.idle)
+
+    async def test_error(self):
+        """
+        When a statement fails, it and those after it fail with the error,
+        as does the commit, and the transaction is rolled back.
+        """
+        conn, backend = await self.connect()
+        transaction = conn.new_pipelined_transaction()
+        first = transaction.query("SELECT $1", [1])
+        failing = transaction.query("SELECT nothing", [1])
+        after = transaction.query("SELECT $1", [2])
+
+        with self.assertRaises(PostgresError):
+            await transaction.commit()
+
+        self.assertEqual(len(await first), 3)
+        for future in (failing, after):
+            with self.assertRaises(PostgresError):
+                await future
+
+        self.assertEqual(backend.sent[-1], b"Q")
+        self.assertTrue(conn.idle)
+        self.assertEqual(len(await conn.query("SELECT $1", [1])), 3)
+
+    async def test_aborted(self):
+        """
+        Leaving the block with an exception sends nothing, and fails the
+        futures of the statements with it.
+        """
+        conn, backend = await self.connect()
+
+        with self.assertRaises(ZeroDivisionError):
+            async with conn.new_pipelined_transaction() as transaction:
+                rows = transaction.query("SELECT $1", [1])
+                1 / 0
+
+        with self.assertRaises(ZeroDivisionError):
+            await rows
+        self.assertEqual(backend.sent, [])
@@ -0,0 +1,120 @@
+"""
+Tests for pools of connections, and routing queries between them.
+"""
+
+from twisted.internet import reactor
+from twisted.trial.unittest import TestCase
+
+from sansiopg.errors import PostgresError
+from sansiopg.protocol import PostgresConnection
+from txpg.pool import PRIMARY, REPLICA, ConnectionPool, Router
+from txpg.protocol import TwistedIOImplementation
+
+from . import fakeserver
+
+_ROWS = fakeserver.Result.of(["id"], [(i,) for i in range(3)], oid=23)
+
+
+def _recovery(value):
+    return fakeserver.Result.of(["pg_is_in_recovery"], [(value,)], oid=16)
+
+
+def _endpoint(in_hot_standby=None, results={}, **parameters):
+    """
+    An endpoint for a fake server that reports C{parameters}, along with
+    C{in_hot_standby} if it isn't None.
+    """
+    if in_hot_standby is not None:
+        parameters["in_hot_standby"] = in_hot_standby
+
+    def _backend():
+        return fakeserver.FakeBackend(
+            results=dict(results, **{"SELECT $1": _ROWS}),
+            default=None,
+            parameters=dict(parameters, client_encoding="UTF8"),
+        )
+
+    return fakeserver.MemoryEndpoint(reactor, _backend)
+
+
+class ConnectionPoolTests(TestCase):
+    timeout = 10
+
+    def pool(self, endpoint):
+        connections = []
+
+        def _connection():
+            connections.append(PostgresConnection(TwistedIOImplementation()))
+            return connections[-1]
+
+        pool = ConnectionPool(endpoint, "db", "user", connection_factory=_connection)
+        self.addCleanup(pool.close)
+        return pool, connections
+
+    async def test_reported_role(self):
+        """
+        A server that reports being a hot standby is a replica, and one that
+        reports it isn't is the primary, even if it is read-only by default.
+        """
+        for in_hot_standby, role in [("on", REPLICA), ("off", PRIMARY)]:
+            pool, _ = self.pool(
+                _endpoint(in_hot_standby, default_transaction_read_only="on")
+            )
+            pool.release(await pool.acquire())
+            self.assertEqual(pool.role, role)
+
+    async def test_asked_role(self):
+        """
+        An older server that doesn't report whether it is a hot standby is
+        asked whether it is in recovery.
+        """
+        for value, role in [("t", REPLICA), ("f", PRIMARY)]:
+            results = {"SELECT pg_is_in_recovery()": _recovery(value)}
+            pool, _ = self.pool(_endpoint(results=results))
+            pool.release(await pool.acquire())
+            self.assertEqual(pool.role, role)
+
+    async def test_setup_fails(self):
+        """
+        A connection that can't be set up once it is made is closed, and
+        the failure passed on.
+        """
+        pool, connections = self.pool(_endpoint())
+
+        with self.assertRaises(PostgresError):
+            await pool.acquire()
+
+        self.assertTrue(connections[0]._pg.lost.called)
+        self.assertEqual(pool.in_use, 0)
+
+    async def test_reuse(self):
+        """
+        A connection is reused once it is released.
+        """
+        pool, connections = self.pool(_endpoint("off"))
+
+        for i in range(3):
+            self.assertEqual(len(await pool.query("SELECT $1", [i])), 3)
+
+        self.assertEqual(len(connections), 1)
+
+
+class RouterTests(TestCase):
+    timeout = 10
+
+    async def test_roles(self):
+        """
+        Writes go to the primary, and read-only queries to a replica.
+        """
+        primary = ConnectionPool(_endpoint("off"), "db", "user")
+        replica = ConnectionPool(_endpoint("on"), "db", "user")
+        router = Router([replica, primary])
+        self.addCleanup(router.close)
+
+        await router.refresh()
+        await router.execute("SELECT $1", [1])
+        self.assertIsNotNone(primary.latency)
+        self.assertIsNone(replica.latency)
+
+        await router.query("SELECT $1", [1], read_only=True)
+        self.assertIsNotNone(replica.latency)
@@ -0,0 +1,148 @@
+"""
+Tests for SCRAM-SHA-256 authentication against L{fakeserver}.
+"""
+
+import base64
+import hashlib
+import hmac
+import struct
+
+import attr
+from twisted.internet import reactor
+from twisted.internet.endpoints import TCP4ClientEndpoint, TCP4ServerEndpoint
+from twisted.trial.unittest import TestCase
+
+from sansiopg.protocol import PostgresConnection
+from sansiopg.scram import ScramError, derive_keys
+from txpg.protocol import TwistedIOImplementation
+
+from . import fakeserver
+
+_SALT = b"saltsaltsalt"
+_ITERATIONS = 4096
+
+
+@attr.s
+class _ScramBackend(fakeserver.FakeBackend):
+    """
+    Asks for SCRAM-SHA-256 with C{password}. The SASLFinal carrying the
+    server's signature is only sent if C{sign} is set. If C{server_first} is
+    given, it is sent instead of a well-formed server-first-message.
+    """
+
+    password = attr.ib(default=b"secret")
+    sign = attr.ib(default=True)
+    server_first = attr.ib(default=None)
+    _server_first = attr.ib(default=None, init=False)
+    _client_first_bare = attr.ib(default=None, init=False)
+
+    def _startup(self, body):
+        (code,) = struct.unpack("!i", body[:4])
+
+        if code == 80877102:
+            return super()._startup(body)
+
+        self._started = True
+        return fakeserver.authentication_sasl([b"SCRAM-SHA-256"])
+
+    def _handle(self, type_code, body):
+        if type_code != b"p":
+            return super()._handle(type_code, body)
+
+        if self._server_first is None:
+            # SASLInitialResponse: the mechanism, then the GS2 header and the
+            # client-first-message.
+            _, rest = body.split(b"\0", 1)
+            self._client_first_bare = rest[4:].split(b",", 2)[2]
+            nonce = self._client_first_bare.split(b"r=", 1)[1]
+            self._server_first = b"r=%s0123,s=%s,i=%d" % (
+                nonce,
+                base64.b64encode(_SALT),
+                _ITERATIONS,
+            )
+            return fakeserver.authentication_sasl_continue(
+                self.server_first or self._server_first
+            )
+
+        without_proof = body.rsplit(b",p=", 1)[0]
+        auth_message = b",".join(
+            [self._client_first_bare, self._server_first, without_proof]
+        )
+        _, server_key = derive_keys(self.password, _SALT, _ITERATIONS)
+        signature = hmac.new(server_key, auth_message, hashlib.sha256).digest()
+
+        res = []
+        if self.sign:
+            res.append(
+                fakeserver.authentication_sasl_final(
+                    b"v=" + base64.b64encode(signature)
+                )
+            )
+        res.append(fakeserver.authentication_ok())
+        res.append(self._welcome())
+        return b"".join(res)
+
+
+class ScramTests(TestCase):
+    timeout = 10
+
+    async def connect(self, backend_factory, password="secret"):
+        # Over a socket, where the connection isn't lost as soon as the
+        # client hangs up, so it could go on to the rest of what it got.
+        server = TCP4ServerEndpoint(reactor, 0, interface="127.0.0.1")
+        port = await server.listen(fakeserver.FakeServerFactory(backend_factory))
+        self.addCleanup(port.stopListening)
+
+        self.conn = PostgresConnection(TwistedIOImplementation())
+        self.states = []
+        self.conn.trace_states(lambda old, input, new: self.states.append(new))
+        self.addCleanup(lambda: self.conn._pg.transport.loseConnection())
+        endpoint = TCP4ClientEndpoint(reactor, "127.0.0.1", port.getHost().port)
+        await self.conn.connect(endpoint, "db", "user", password)
+
+    async def assertRefused(self, backend_factory):
+        """
+        Connecting fails with L{ScramError}, and the connection is closed
+        without going on to what the server sent after.
+        """
+        with self.assertRaises(ScramError):
+            await self.connect(backend_factory)
+
+        await self.conn._pg.lost
+        self.assertNotIn("READY", self.states)
+
+    async def test_signed(self):
+        """
+        A server that proves it knows the password lets the client in.
+        """
+        await self.connect(_ScramBackend)
+        self.assertTrue(self.conn.idle)
+
+    async def test_missing_signature(self):
+        """
+        A server that lets the client in without sending its signature
+        fails the connection.
+        """
+        await self.assertRefused(lambda: _ScramBackend(sign=False))
+
+    async def test_wrong_signature(self):
+        """
+        A server whose signature is for another password fails the
+        connection.
+        """
+        await self.assertRefused(lambda: _ScramBackend(password=b"other"))
+
+    async def test_malformed(self):
+        """
+        A server-first-message that is missing a field, or has one that
+        doesn't parse, fails the connection.
+        """
+        for server_first in [
+            b"s=c2FsdA==,i=4096",
+            b"r=nonce,i=4096",
+            b"r=nonce,s=c2FsdA==",
+            b"r=nonce,s=c2FsdA==,i=many",
+            b"r=nonce,s=!!!,i=4096",
+            b"garbage",
+        ]:
+            await self.assertRefused(lambda: _ScramBackend(server_first=server_first))
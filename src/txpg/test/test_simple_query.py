@@ -0,0 +1,111 @@
+"""
+Tests for running queries without parameters with the simple query
+protocol.
+"""
+
+import attr
+from twisted.internet import reactor
+from twisted.trial.unittest import TestCase
+
+from sansiopg.protocol import PostgresConnection
+from txpg.protocol import TwistedIOImplementation
+
+from . import fakeserver
+
+_ROWS = fakeserver.Result.of(["id", "name"], [(i, "name-%d" % (i,)) for i in range(3)])
+_ROWS.columns[0] = ("id", 23)
+
+
+@attr.s
+class _RecordingBackend(fakeserver.FakeBackend):
+    """
+    Notes the type code of every message the client sends, and reports a
+    new application_name in the middle of a SET.
+    """
+
+    sent = attr.ib(factory=list, init=False)
+
+    def _handle(self, type_code, body):
+        self.sent.append(type_code)
+        return fakeserver.FakeBackend._handle(self, type_code, body)
+
+    def _simple_query(self, query):
+        response = fakeserver.FakeBackend._simple_query(self, query)
+        if query.startswith("SET application_name TO "):
+            value = query[len("SET application_name TO ") :]
+            response = fakeserver.parameter_status("application_name", value) + response
+        return response
+
+
+class SimpleQueryTests(TestCase):
+    async def connect(self):
+        backends = []
+
+        def _backend():
+            backends.append(
+                _RecordingBackend(results={"SELECT rows": _ROWS, "SELECT $1": _ROWS})
+            )
+            return backends[-1]
+
+        conn = PostgresConnection(TwistedIOImplementation())
+        await conn.connect(fakeserver.MemoryEndpoint(reactor, _backend), "db", "user")
+        self.addCleanup(conn._pg.transport.loseConnection)
+        backends[0].sent.clear()
+        return conn, backends[0]
+
+    async def test_without_parameters(self):
+        """
+        A query without parameters is sent as a single Query.
+        """
+        conn, backend = await self.connect()
+        rows = await conn.query("SELECT rows")
+
+        self.assertEqual(
+            [tuple(row) for row in rows], [(0, "name-0"), (1, "name-1"), (2, "name-2")]
+        )
+        self.assertEqual(backend.sent, [b"Q"])
+
+    async def test_with_parameters(self):
+        """
+        A query with parameters still uses the extended query protocol.
+        """
+        conn, backend = await self.connect()
+        rows = await conn.query("SELECT $1", [1])
+
+        self.assertEqual(len(rows), 3)
+        self.assertIn(b"P", backend.sent)
+        self.assertNotIn(b"Q", backend.sent)
+
+    async def test_transaction(self):
+        """
+        BEGIN, COMMIT and what runs between them without parameters go out
+        as simple queries.
+        """
+        conn, backend = await self.connect()
+
+        async with conn.new_transaction():
+            await conn.execute("UPDATE things SET x = 1")
+
+        self.assertEqual(backend.sent, [b"Q", b"Q", b"Q"])
+
+    async def test_script(self):
+        """
+        script() returns the rows of each statement, and an empty one has
+        none.
+        """
+        conn, backend = await self.connect()
+
+        self.assertEqual(len((await conn.script("SELECT rows"))[0]), 3)
+        self.assertEqual(await conn.script(""), [[]])
+        self.assertEqual(await conn.query(""), [])
+
+    async def test_parameter_status(self):
+        """
+        A ParameterStatus in the middle of a query is noted, whatever state
+        the connection is in.
+        """
+        conn, backend = await self.connect()
+        await conn.execute("SET application_name TO tests")
+
+        self.assertEqual(conn._parameters["application_name"], "tests")
+        self.assertTrue(conn.idle)
@@ -0,0 +1,64 @@
+"""
+Tests for spilling results that go over a connection's memory budget.
+"""
+
+from twisted.internet import reactor
+from twisted.trial.unittest import TestCase
+
+from sansiopg.protocol import PostgresConnection
+from sansiopg.spill import MemoryBudget, SpilledResult
+from txpg.protocol import TwistedIOImplementation
+
+from . import fakeserver
+
+_ROWS = fakeserver.Result.of(["id", "name"], [(i, "name-%d" % (i,)) for i in range(50)])
+_ROWS.columns[0] = ("id", 23)
+
+
+def _backend():
+    return fakeserver.FakeBackend(results={"SELECT rows": _ROWS, "SELECT $1": _ROWS})
+
+
+class MemoryBudgetTests(TestCase):
+    async def connect(self, **kwargs):
+        conn = PostgresConnection(TwistedIOImplementation(), **kwargs)
+        await conn.connect(fakeserver.MemoryEndpoint(reactor, _backend), "db", "user")
+        self.addCleanup(conn._pg.transport.loseConnection)
+        return conn
+
+    def assertRows(self, rows):
+        self.assertEqual(
+            [tuple(row) for row in rows], [(i, "name-%d" % (i,)) for i in range(50)]
+        )
+
+    async def test_spills_rest(self):
+        """
+        The rows after those that fit in the budget are spilled.
+        """
+        conn = await self.connect(memory_budget=200)
+        rows = await conn.query("SELECT rows")
+
+        self.assertIsInstance(rows, SpilledResult)
+        self.assertRows(rows)
+
+    async def test_smaller_than_a_row(self):
+        """
+        With a budget too small for even the first row, every row is
+        spilled, whichever protocol the query is sent with.
+        """
+        conn = await self.connect(memory_budget=1)
+
+        self.assertRows(await conn.query("SELECT rows"))
+        self.assertRows(await conn.query("SELECT $1", [1]))
+        self.assertRows([row async for row in conn.iterate("SELECT $1", [1], batch=7)])
+
+    async def test_exhausted_shared_budget(self):
+        """
+        Once a budget shared with other connections is used up, every row
+        is spilled.
+        """
+        shared = MemoryBudget(100)
+        self.assertTrue(shared.reserve(100))
+        conn = await self.connect(memory_budget=MemoryBudget(None, parent=shared))
+
+        self.assertRows(await conn.query("SELECT rows"))
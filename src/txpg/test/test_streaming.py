@@ -0,0 +1,111 @@
+"""
+Tests for streaming DataRows and CopyData too large to buffer whole.
+"""
+
+from io import BytesIO
+
+from twisted.internet import reactor
+from twisted.trial.unittest import TestCase
+
+from sansiopg.messages import CopyDataChunk, DataRowChunk
+from sansiopg.parser import ParserFeed
+from sansiopg.protocol import PostgresConnection
+from txpg.protocol import TwistedIOImplementation
+
+from . import fakeserver
+
+_BIG = "x" * 100000
+_ROWS = fakeserver.Result.of(
+    ["id", "value", "nothing"], [(1, "small", None), (2, _BIG, None), (3, "", "y")]
+)
+_ROWS.columns[0] = ("id", 23)
+_EXPECTED = [(1, "small", None), (2, _BIG, None), (3, "", "y")]
+
+
+def _backend():
+    return fakeserver.FakeBackend(
+        results={"SELECT rows": _ROWS, "SELECT $1": _ROWS, "rows": _ROWS}
+    )
+
+
+class StreamingTests(TestCase):
+    async def connect(self, **kwargs):
+        conn = PostgresConnection(
+            TwistedIOImplementation(), stream_threshold=1024, **kwargs
+        )
+        await conn.connect(fakeserver.MemoryEndpoint(reactor, _backend), "db", "user")
+        self.addCleanup(conn._pg.transport.loseConnection)
+        return conn
+
+    async def test_rows(self):
+        """
+        Rows streamed in chunks are put back together, whichever way the
+        query is run.
+        """
+        conn = await self.connect()
+
+        for rows in [
+            await conn.query("SELECT rows"),
+            await conn.query("SELECT $1", [1]),
+            [row async for row in conn.iterate("SELECT $1", [1], batch=2)],
+        ]:
+            self.assertEqual([tuple(row) for row in rows], _EXPECTED)
+        self.assertTrue(conn.idle)
+
+    async def test_sink(self):
+        """
+        Values over the threshold go to a file from C{large_value_sink},
+        which stands in for them in the row.
+        """
+        sinks = []
+
+        def _sink(field):
+            sinks.append((field.field_name, BytesIO()))
+            return sinks[-1][1]
+
+        conn = await self.connect(large_value_sink=_sink)
+        rows = await conn.query("SELECT rows")
+
+        self.assertEqual([name for name, _ in sinks], [b"value"])
+        self.assertIs(rows[1].value, sinks[0][1])
+        self.assertEqual(rows[1].value.getvalue(), _BIG.encode("ascii"))
+        self.assertEqual(tuple(rows[0]), _EXPECTED[0])
+
+    async def test_copy_out(self):
+        """
+        A COPY OUT row over the threshold is handed to the target as the raw
+        bytes, in chunks, and shorter rows as usual.
+        """
+        conn = await self.connect()
+        messages = []
+
+        await conn.copy_out(messages.append, table="rows")
+
+        chunks = [m for m in messages if type(m) is CopyDataChunk]
+        self.assertEqual(
+            b"".join(chunk.data for chunk in chunks), b"2\t%s\t\\N\n" % (_BIG.encode(),)
+        )
+        self.assertTrue(chunks[-1].final)
+        self.assertEqual(messages[0].data, [b"1", b"small", b"\\N"])
+        self.assertTrue(conn.idle)
+
+    def test_parser(self):
+        """
+        A DataRow fed a piece at a time is handed out as its bytes arrive,
+        so that no more than a piece of it is held.
+        """
+        feed = ParserFeed("utf8", stream_threshold=1024)
+        data = fakeserver.data_row((b"1", _BIG.encode("ascii"), None))
+        chunks = []
+
+        for start in range(0, len(data), 1000):
+            messages = feed.feed(data[start : start + 1000])
+            self.assertTrue(all(type(m) is DataRowChunk for m in messages))
+            self.assertTrue(all(len(m.data or b"") <= 1000 for m in messages))
+            chunks.extend(messages)
+
+        self.assertEqual(
+            b"".join(c.data for c in chunks if c.column == 1), _BIG.encode()
+        )
+        self.assertEqual([c.data for c in chunks if c.column != 1], [b"1", None])
+        self.assertTrue(chunks[-1].last)
@@ -0,0 +1,134 @@
+"""
+Tests for recording a connection's trace and replaying it.
+"""
+
+from io import BytesIO
+
+from twisted.internet import reactor
+from twisted.trial.unittest import TestCase
+
+from sansiopg.instrumentation import Instrumentation
+from sansiopg.protocol import PostgresConnection
+from sansiopg.statements import StatementRegistry
+from sansiopg.trace import TraceWriter, read_trace, replay_connection
+from txpg.protocol import TwistedIOImplementation
+
+from . import fakeserver
+
+_ROWS = fakeserver.Result.of(["id", "name"], [(i, "name-%d" % (i,)) for i in range(50)])
+
+
+def _backend():
+    return fakeserver.FakeBackend(results={"SELECT rows": _ROWS, "SELECT $1": _ROWS})
+
+
+def _queries(instrumentation):
+    return [(stats.query, stats.rows) for stats in instrumentation.recent]
+
+
+class ReplayTests(TestCase):
+    async def record(self, workload):
+        """
+        Run C{workload} on a connection to a fake server, returning the
+        L{Instrumentation} of the connection and its trace.
+        """
+        file = BytesIO()
+        instrumentation = Instrumentation()
+        conn = PostgresConnection(
+            TwistedIOImplementation(trace=TraceWriter(file)),
+            instrumentation=instrumentation,
+        )
+        await conn.connect(fakeserver.MemoryEndpoint(reactor, _backend), "db", "user")
+        self.addCleanup(conn._pg.transport.loseConnection)
+        await workload(conn)
+        return instrumentation, read_trace(BytesIO(file.getvalue()))
+
+    def assertReplays(self, instrumentation, records):
+        """
+        Replaying C{records} runs the same queries, with the same rows, as
+        were recorded in C{instrumentation}.
+        """
+        replayed = Instrumentation()
+        conn = replay_connection(records, instrumentation=replayed)
+
+        self.assertTrue(conn.idle)
+        self.assertEqual(_queries(replayed), _queries(instrumentation))
+
+    async def test_prepared(self):
+        """
+        Statements that were prepared are prepared again, and running them
+        binds them without a Parse.
+        """
+
+        async def workload(conn):
+            await conn.prepare(["SELECT rows", "SELECT $1"])
+            await conn.query("SELECT $1", [1])
+            await conn.query("SELECT rows")
+            await conn.query("SELECT $1", [2])
+
+        instrumentation, records = await self.record(workload)
+
+        self.assertEqual(
+            _queries(instrumentation)[1:],
+            [("SELECT $1", 50), ("SELECT rows", 50), ("SELECT $1", 50)],
+        )
+        self.assertReplays(instrumentation, records)
+
+    async def test_hot(self):
+        """
+        A query that a registry finds hot is parsed under a name, and bound
+        by that name from then on.
+        """
+
+        async def workload(conn):
+            conn.registry = StatementRegistry(threshold=2)
+            for i in range(4):
+                await conn.query("SELECT $1", [i])
+
+        instrumentation, records = await self.record(workload)
+
+        self.assertEqual(_queries(instrumentation)[1:], [("SELECT $1", 50)] * 4)
+        self.assertReplays(instrumentation, records)
+
+    async def test_deadline(self):
+        """
+        Queries that had a timeout replay, and a deadline set on the replayed
+        connection never goes off.
+        """
+
+        async def workload(conn):
+            await conn.query("SELECT rows", timeout=10)
+            await conn.query("SELECT $1", [1], timeout=10)
+
+        instrumentation, records = await self.record(workload)
+        self.assertReplays(instrumentation, records)
+
+        called = []
+        delayed = replay_connection(records)._io_impl.call_later(0, called.append)
+        self.assertTrue(delayed.active())
+        delayed.cancel()
+        self.assertFalse(delayed.active())
+        self.assertEqual(called, [])
+
+    async def test_portal(self):
+        """
+        Portals are opened, fetched from and closed as they were, and the
+        statements prepared only for them closed again.
+        """
+
+        async def workload(conn):
+            await conn.prepare(["SELECT $1"])
+            rows = [row async for row in conn.iterate("SELECT rows", batch=7)]
+            async with conn.iterate("SELECT $1", [1], batch=7) as cursor:
+                async for row in cursor:
+                    break
+            await conn.query("SELECT $1", [2])
+            return rows
+
+        instrumentation, records = await self.record(workload)
+
+        self.assertEqual(
+            _queries(instrumentation)[1:],
+            [("SELECT rows", 50), ("SELECT $1", 14), ("SELECT $1", 50)],
+        )
+        self.assertReplays(instrumentation, records)
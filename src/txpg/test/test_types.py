@@ -0,0 +1,127 @@
+"""
+Tests for looking up types the converter doesn't know in pg_type.
+"""
+
+import attr
+from twisted.internet import reactor
+from twisted.trial.unittest import TestCase
+
+from sansiopg.introspection import TYPES_QUERY, TypeCache
+from sansiopg.protocol import PostgresConnection
+from txpg.protocol import TwistedIOImplementation
+
+from . import fakeserver
+
+_DOMAIN, _DOMAIN_ARRAY, _ENUM, _MISSING = 90001, 90002, 90003, 90004
+
+_TYPES = fakeserver.Result.of(
+    ["oid", "typname", "typtype", "typcategory", "typbasetype", "typelem", "typdelim"],
+    [
+        (_DOMAIN, "positive", "d", "N", 23, 0, ","),
+        (_DOMAIN_ARRAY, "_positive", "b", "A", 0, _DOMAIN, ","),
+        (_ENUM, "mood", "e", "E", 0, 0, ","),
+    ],
+)
+_TYPES.columns = [
+    ("oid", 26),
+    ("typname", 19),
+    ("typtype", 25),
+    ("typcategory", 25),
+    ("typbasetype", 26),
+    ("typelem", 26),
+    ("typdelim", 25),
+]
+
+_CUSTOM = fakeserver.Result(
+    columns=[
+        ("n", _DOMAIN),
+        ("ns", _DOMAIN_ARRAY),
+        ("mood", _ENUM),
+        ("other", _MISSING),
+    ],
+    rows=[(b"5", b"{1,2}", b"happy", b"?")],
+)
+
+
+@attr.s
+class _LookupBackend(fakeserver.FakeBackend):
+    """
+    Counts how many times the types are looked up.
+    """
+
+    lookups = attr.ib(default=0, init=False)
+
+    def _handle(self, type_code, body):
+        if type_code == b"P" and TYPES_QUERY.encode("utf8") in body:
+            self.lookups += 1
+        return fakeserver.FakeBackend._handle(self, type_code, body)
+
+
+class TypeLookupTests(TestCase):
+    timeout = 10
+
+    async def connect(self, types):
+        backends = []
+
+        def _backend():
+            backends.append(
+                _LookupBackend(
+                    results={
+                        TYPES_QUERY: _TYPES,
+                        "SELECT custom": _CUSTOM,
+                        "SELECT $1": _CUSTOM,
+                    }
+                )
+            )
+            return backends[-1]
+
+        conn = PostgresConnection(TwistedIOImplementation(), types=types)
+        await conn.connect(fakeserver.MemoryEndpoint(reactor, _backend), "db", "user")
+        self.addCleanup(conn._pg.transport.loseConnection)
+        return conn, backends[0]
+
+    async def test_look_up(self):
+        """
+        Domains are decoded as the type they are built on, arrays of them
+        as lists, and enums as their labels. A type that isn't found is
+        decoded as text.
+        """
+        types = TypeCache()
+        conn, backend = await self.connect(types)
+
+        for rows in [
+            await conn.query("SELECT custom"),
+            await conn.query("SELECT $1", [1]),
+        ]:
+            self.assertEqual(tuple(rows[0]), (5, [1, 2], "happy", "?"))
+
+        self.assertEqual(backend.lookups, 1)
+        self.assertEqual(types.get(_DOMAIN).base, 23)
+        self.assertEqual(types.unknown({_DOMAIN, _MISSING}), set())
+        self.assertTrue(conn.idle)
+
+    async def test_shared(self):
+        """
+        Connections sharing a L{TypeCache} look each type up once between
+        them.
+        """
+        types = TypeCache()
+        first, first_backend = await self.connect(types)
+        second, second_backend = await self.connect(types)
+
+        await first.query("SELECT custom")
+        rows = await second.query("SELECT custom")
+
+        self.assertEqual(rows[0].n, 5)
+        self.assertEqual((first_backend.lookups, second_backend.lookups), (1, 0))
+
+    async def test_without_cache(self):
+        """
+        Without a cache, nothing is looked up, and the values are left as
+        text.
+        """
+        conn, backend = await self.connect(None)
+        rows = await conn.query("SELECT custom")
+
+        self.assertEqual(tuple(rows[0]), ("5", "{1,2}", "happy", "?"))
+        self.assertEqual(backend.lookups, 0)
@@ -0,0 +1,94 @@
+"""
+Tests for connecting to a server's UNIX socket.
+"""
+
+import os
+import shutil
+import socket
+import tempfile
+
+from twisted.internet import reactor
+from twisted.internet.endpoints import UNIXServerEndpoint
+from twisted.trial.unittest import TestCase
+
+from sansiopg.protocol import PostgresConnection
+from txpg.protocol import TwistedIOImplementation, host_endpoint
+
+from . import fakeserver
+
+
+def _buffer_sizes(receive_buffer, send_buffer):
+    """
+    The buffer sizes a UNIX socket reports once they are set, which on
+    Linux are double what was asked for.
+    """
+    a, b = socket.socketpair(socket.AF_UNIX)
+    try:
+        a.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer)
+        a.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, send_buffer)
+        return (
+            a.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF),
+            a.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF),
+        )
+    finally:
+        a.close()
+        b.close()
+
+
+class UNIXSocketTests(TestCase):
+    async def listen(self, port):
+        """
+        Serve a fake server on the socket a server listening on C{port}
+        would have, returning the directory it is in.
+        """
+        # Somewhere short, since socket paths are limited to about a hundred
+        # bytes, which $TMPDIR may not be.
+        directory = tempfile.mkdtemp(dir="/tmp")
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, ".s.PGSQL.%d" % (port,))
+        listener = await UNIXServerEndpoint(reactor, path).listen(
+            fakeserver.FakeServerFactory()
+        )
+        self.addCleanup(listener.stopListening)
+        return directory
+
+    async def connect(self, host, **kwargs):
+        conn = PostgresConnection(TwistedIOImplementation(**kwargs))
+        await conn.connect(host, "db", "user")
+        self.addCleanup(conn._pg.transport.loseConnection)
+        return conn
+
+    async def test_port_in_host(self):
+        """
+        A port after the directory picks the socket of a server listening
+        on that port.
+        """
+        directory = await self.listen(6543)
+        conn = await self.connect("%s:6543" % (directory,))
+
+        self.assertEqual(await conn.query("SELECT 1"), [])
+
+    async def test_port(self):
+        """
+        Without a port in the host, the one given is used.
+        """
+        directory = await self.listen(6543)
+        conn = await self.connect(host_endpoint(reactor, directory, port=6543))
+
+        self.assertEqual(await conn.query("SELECT 1"), [])
+
+    async def test_buffers(self):
+        """
+        The socket buffer sizes are set on UNIX sockets too.
+        """
+        directory = await self.listen(5432)
+        conn = await self.connect(directory, receive_buffer=4096, send_buffer=8192)
+        sock = conn._pg.transport.getHandle()
+
+        self.assertEqual(
+            (
+                sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF),
+                sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF),
+            ),
+            _buffer_sizes(4096, 8192),
+        )